@@ -1,11 +1,12 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.utils import timezone
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 from django.db import connection
 
 from .constants import ACCOUNT_TYPES
 from .managers import UserManager
+from .summary import forget_account, total_balance
 
 
 class User(AbstractUser):
@@ -22,9 +23,8 @@ class User(AbstractUser):
 
     @property
     def balance(self):
-        if hasattr(self, 'account'):
-            return self.account.balance
-        return 0
+        ''' Total balance of the user's accounts, from the cached account summary. '''
+        return total_balance(self.pk)
 
 
 class UserAddress(models.Model):
@@ -54,6 +54,21 @@ class BankAccount(models.Model):
     )
     account_type = models.CharField(choices=ACCOUNT_TYPES, default='CHECKING')
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        forget_account(self.account_no, self.user_id if adding else None)
+        if adding and self.balance:
+            # Accounts opened with money in them start with an OPENING journal entry
+            from transactions.journal import open_accounts
+            open_accounts(self.account_no - 1, self.account_no)
+
+    def delete(self, *args, **kwargs):
+        account_no, user_id = self.account_no, self.user_id
+        result = super().delete(*args, **kwargs)
+        forget_account(account_no, user_id)
+        return result
+
     @staticmethod
     def get_positive_balance_accounts():
         with connection.cursor() as cursor:
@@ -70,9 +85,12 @@ class CheckingBankAccount(BankAccount):
 
     def deduct_service_charge(self):
         '''Deducts service charge from the account balance and returns the deducted amount.'''
-        if self.balance > self.service_charge:  
-            self.balance -= self.service_charge
-            self.save()
+        from transactions.posting import InsufficientFunds, post_transaction
+        if self.balance > self.service_charge:
+            try:
+                post_transaction(self, -self.service_charge, 'CHARGES', -self.service_charge)
+            except InsufficientFunds:
+                return Decimal('0.00')
             return self.service_charge
         return Decimal('0.00')
 
@@ -88,8 +106,9 @@ class SavingsBankAccount(BankAccount):
     def add_interest(self):
         '''Adds interest to the account balance based on the interest rate and returns the interest amount.'''
         
-        monthly_interest_rate = self.interest_rate / 12 / 100
-        interest_amount = monthly_interest_rate * self.balance
-        self.balance += interest_amount
-        self.save()
+        from transactions.posting import post_transaction
+        # The month-end statement's ROUND(balance * interest_rate / 1200, 2), which rounds half up
+        interest_amount = (self.balance * self.interest_rate / 1200).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        if interest_amount > 0:
+            post_transaction(self, interest_amount, 'INTEREST', interest_amount)
         return interest_amount
\ No newline at end of file
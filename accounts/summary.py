@@ -0,0 +1,199 @@
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch
+
+# Per-user account summaries (accounts, balances and latest transactions) served from the
+# shared cache. A user's summary is the list of their account numbers plus one entry per
+# account, so a posting only rewrites the entry of the account it touched:
+#
+# - single and group-committed postings write the new balance and transaction through to
+#   the account's entry once they commit (`record_posting`);
+# - opening, saving or deleting an account drops the entries it affects;
+# - bulk postings (month-end, EMI collection) bump a global generation, which marks every
+#   account entry written before it as stale without touching them one by one.
+#
+# Balances are read back from the database by the postings, and an entry only moves forward
+# to a newer transaction of its account, so a late write-through can not roll it back.
+#
+# Every account also has a version, bumped by each posting before its write-through. An
+# entry records the version read before the database query that built it, and is only
+# served while that version is current: a posting that commits while a cache miss is being
+# loaded finds no entry to write through, but still makes the entry the miss stores stale.
+
+GENERATION_KEY = 'accounts:summary:generation'
+
+
+def _user_key(user_id):
+    return f'accounts:summary:user:{user_id}'
+
+
+def _account_key(account_no):
+    return f'accounts:summary:account:{account_no}'
+
+
+def _version_key(account_no):
+    return f'accounts:summary:version:{account_no}'
+
+
+def _transaction_entry(posted):
+    return {
+        'id': posted.id,
+        'timestamp': posted.timestamp,
+        'transaction_type': posted.transaction_type,
+        'amount': posted.amount,
+        'balance_after_transaction': posted.balance_after_transaction,
+    }
+
+
+def _account_entry(account, generation, version):
+    checking = getattr(account, 'checkingbankaccount', None)
+    savings = getattr(account, 'savingsbankaccount', None)
+    recent = [_transaction_entry(posted) for posted in account.recent_transactions]
+    return {
+        'generation': generation,
+        'version': version,
+        'account_no': account.account_no,
+        'account_type': account.account_type,
+        'date_opened': account.date_opened,
+        'balance': account.balance,
+        'service_charge': checking.service_charge if checking else None,
+        'interest_rate': savings.interest_rate if savings else None,
+        'recent_transactions': recent,
+        'last_transaction_id': recent[0]['id'] if recent else 0,
+    }
+
+
+def _load_accounts(filters, generation, versions):
+    from accounts.models import BankAccount
+    from transactions.models import Transaction
+
+    accounts = (
+        BankAccount.objects.filter(**filters)
+        .select_related('checkingbankaccount', 'savingsbankaccount')
+        .prefetch_related(Prefetch(
+            'transactions',
+            queryset=Transaction.objects.order_by('-timestamp', '-id')[:settings.ACCOUNT_SUMMARY_RECENT_TRANSACTIONS],
+            to_attr='recent_transactions',
+        ))
+        .order_by('account_no')
+    )
+    return [_account_entry(account, generation, versions[account.account_no]) for account in accounts]
+
+
+def _generation(cached):
+    generation = cached.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def _versions(account_nos, cached):
+    versions = {account_no: cached.get(_version_key(account_no)) for account_no in account_nos}
+    unknown = [account_no for account_no, version in versions.items() if version is None]
+    for account_no in unknown:
+        # A random start, so that an entry written before the key was evicted can not match
+        cache.add(_version_key(account_no), random.getrandbits(62), timeout=None)
+    if unknown:
+        added = cache.get_many([_version_key(account_no) for account_no in unknown])
+        versions.update((account_no, added.get(_version_key(account_no))) for account_no in unknown)
+    return versions
+
+
+def get_summary(user_id):
+    '''
+    Returns the accounts of a user, ordered by account number, as dicts with their balance,
+    type details and `recent_transactions`. Costs two cache round trips when warm.
+    '''
+    from accounts.models import BankAccount
+
+    timeout = settings.ACCOUNT_SUMMARY_CACHE_SECONDS
+    cached = cache.get_many([GENERATION_KEY, _user_key(user_id)])
+    generation = _generation(cached)
+    account_nos = cached.get(_user_key(user_id))
+
+    if account_nos is None:
+        account_nos = list(
+            BankAccount.objects.filter(user_id=user_id).order_by('account_no').values_list('account_no', flat=True)
+        )
+        cache.set(_user_key(user_id), account_nos, timeout)
+
+    cached = cache.get_many(
+        [_account_key(account_no) for account_no in account_nos]
+        + [_version_key(account_no) for account_no in account_nos]
+    )
+    versions = _versions(account_nos, cached)
+    entries = {}
+    for account_no in account_nos:
+        entry = cached.get(_account_key(account_no))
+        if entry is not None and entry['generation'] == generation and entry['version'] == versions[account_no]:
+            entries[account_no] = entry
+    missing = [account_no for account_no in account_nos if account_no not in entries]
+    if missing:
+        # The versions were read before the query, so a posting committing meanwhile makes
+        # the loaded entry stale even though it had nothing to write through to
+        loaded = _load_accounts({'user_id': user_id, 'account_no__in': missing}, generation, versions)
+        current = cache.get_many([_version_key(entry['account_no']) for entry in loaded])
+        cache.set_many(
+            {
+                _account_key(entry['account_no']): entry for entry in loaded
+                if entry['version'] is not None and current.get(_version_key(entry['account_no'])) == entry['version']
+            },
+            timeout,
+        )
+        entries.update((entry['account_no'], entry) for entry in loaded)
+    return [entries[account_no] for account_no in account_nos if account_no in entries]
+
+
+def total_balance(user_id):
+    return sum((entry['balance'] for entry in get_summary(user_id)), 0)
+
+
+# ================================ Write-through / invalidation ===============================
+def _write_through(account_no, postings):
+    try:
+        version = cache.incr(_version_key(account_no))
+    except ValueError:
+        # No version, so no entry can be current
+        return
+    key = _account_key(account_no)
+    cached = cache.get_many([GENERATION_KEY, key])
+    entry = cached.get(key)
+    # Only an entry that was current until this posting is moved forward
+    if entry is None or entry['generation'] != cached.get(GENERATION_KEY) or entry['version'] != version - 1:
+        return
+    postings = [posted for posted in postings if posted.id > entry['last_transaction_id']]
+    if not postings:
+        return
+
+    latest = max(postings, key=lambda posted: posted.id)
+    recent = [_transaction_entry(posted) for posted in sorted(postings, key=lambda posted: -posted.id)]
+    entry['version'] = version
+    entry['balance'] = latest.balance_after_transaction
+    entry['recent_transactions'] = (recent + entry['recent_transactions'])[:settings.ACCOUNT_SUMMARY_RECENT_TRANSACTIONS]
+    entry['last_transaction_id'] = latest.id
+    cache.set(key, entry, settings.ACCOUNT_SUMMARY_CACHE_SECONDS)
+
+
+def record_posting(account_no, postings):
+    ''' Writes committed postings (saved Transactions) on an account through to its summary. '''
+    transaction.on_commit(lambda: _write_through(account_no, postings))
+
+
+def forget_account(account_no, user_id=None):
+    ''' Drops the summary of an account, and the account list of its owner when given. '''
+    keys = [_account_key(account_no)] + ([_user_key(user_id)] if user_id is not None else [])
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_all_summaries():
+    ''' Marks every cached account summary stale, after postings that bypass `record_posting`. '''
+    def bump():
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.add(GENERATION_KEY, 1, timeout=None)
+    transaction.on_commit(bump)
@@ -1 +1,82 @@
-# Create your tests here.
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from transactions import posting
+from . import summary
+from .models import User, CheckingBankAccount, SavingsBankAccount
+
+
+class AccountDetailsViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='customer@mail.com', password='secret')
+        self.client.force_login(self.user)
+
+    def open_accounts(self, transactions_per_account):
+        # The account summaries are updated when the postings commit
+        with self.captureOnCommitCallbacks(execute=True):
+            checking = CheckingBankAccount.objects.create(user=self.user, account_type='CHECKING')
+            savings = SavingsBankAccount.objects.create(user=self.user, account_type='SAVINGS')
+            for account in (checking, savings):
+                for _ in range(transactions_per_account):
+                    posting.deposit(account, Decimal('10.00'))
+        return checking, savings
+
+    def test_query_count_does_not_grow_with_accounts_or_history(self):
+        self.open_accounts(transactions_per_account=1)
+        # session, user, account numbers, accounts with their subclass rows, latest transactions
+        with self.assertNumQueries(5):
+            self.client.get(reverse('accounts:accounts_home'))
+
+        self.open_accounts(transactions_per_account=10)
+        with self.assertNumQueries(5):
+            self.client.get(reverse('accounts:accounts_home'))
+
+    def test_cached_summary_follows_postings(self):
+        checking, _ = self.open_accounts(transactions_per_account=1)
+        self.client.get(reverse('accounts:accounts_home'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            posting.withdraw(checking, Decimal('4.00'))
+
+        # session and user only: the accounts come from the cache
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('accounts:accounts_home'))
+        accounts = {account['account_no']: account for account in response.context['accounts']}
+        self.assertEqual(accounts[checking.pk]['balance'], Decimal('6.00'))
+        self.assertEqual(accounts[checking.pk]['recent_transactions'][0]['transaction_type'], 'WITHDRAWAL')
+
+    def test_posting_during_a_cache_miss_does_not_leave_a_stale_summary(self):
+        checking, _ = self.open_accounts(transactions_per_account=1)
+        load_accounts = summary._load_accounts
+
+        def load_then_post(*args, **kwargs):
+            # The posting commits after the miss read the accounts, before it caches them
+            entries = load_accounts(*args, **kwargs)
+            with self.captureOnCommitCallbacks(execute=True):
+                posting.deposit(checking, Decimal('5.00'))
+            return entries
+
+        with mock.patch.object(summary, '_load_accounts', side_effect=load_then_post):
+            self.client.get(reverse('accounts:accounts_home'))
+
+        response = self.client.get(reverse('accounts:accounts_home'))
+        accounts = {account['account_no']: account for account in response.context['accounts']}
+        self.assertEqual(accounts[checking.pk]['balance'], Decimal('15.00'))
+
+    def test_shows_only_latest_three_transactions(self):
+        checking, _ = self.open_accounts(transactions_per_account=5)
+
+        response = self.client.get(reverse('accounts:accounts_home'))
+
+        accounts = {account['account_no']: account for account in response.context['accounts']}
+        recent = accounts[checking.pk]['recent_transactions']
+        self.assertEqual(len(recent), 3)
+        self.assertEqual(
+            [transaction['balance_after_transaction'] for transaction in recent],
+            [Decimal('50.00'), Decimal('40.00'), Decimal('30.00')],
+        )
@@ -16,6 +16,7 @@ from django.views.generic import TemplateView, RedirectView, View, UpdateView, D
 from .forms import UserRegistrationForm, UserAddressForm
 from .models import CheckingBankAccount, SavingsBankAccount
 from .models import CheckingBankAccount
+from .summary import get_summary
 from .forms import UserUpdateForm 
 
 logger = logging.getLogger(__name__)
@@ -194,6 +195,7 @@ class AccountDetailsView(LoginRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # Assuming you have different types of accounts under the same user
-        context['accounts'] = self.request.user.account.all()
+        # Accounts, balances and the latest transactions come from the cached summary, which
+        # the postings keep up to date
+        context['accounts'] = get_summary(self.request.user.pk)
         return context
@@ -3,5 +3,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'banking_system.settings')
+os.environ.setdefault('BANKING_PROCESS', 'asgi')
 
 application = get_asgi_application()
@@ -4,6 +4,7 @@ import os
 
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import celeryd_init
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'banking_system.settings')
@@ -19,12 +20,34 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Load task modules from all registered Django app configs.
 app.autodiscover_tasks()
 
+
+@celeryd_init.connect
+def use_worker_database_settings(**kwargs):
+    ''' Applies the `celery` section of `database.pool` before the worker forks its pool. '''
+    from django.conf import settings
+    from banking_system.settings import database_pool_settings
+
+    settings.DATABASES['default'].update(database_pool_settings(settings.DATABASE_POOL, 'celery'))
+
+
 app.conf.beat_schedule = {
     'calculate_interest': {
         'task': 'update_account_balances',
         # http://docs.celeryproject.org/en/latest/userguide/periodic-tasks.html
         'schedule': crontab(0, 0, day_of_month='1'),
-    }
+    },
+    'collect_emis': {
+        'task': 'collect_emis',
+        'schedule': crontab(0, 1),
+    },
+    'reconcile_balances': {
+        'task': 'reconcile_balances',
+        'schedule': crontab(0, 3),
+    },
+    'maintain_transaction_partitions': {
+        'task': 'maintain_transaction_partitions',
+        'schedule': crontab(0, 2, day_of_month='15'),
+    },
 }
 
 
@@ -0,0 +1,91 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Read replicas (`database.replicas` in config.yml) serve the read-only views that opt in
+# with `use_replica`: transaction history, statement exports, loan listings and analytics.
+# Everything else, including every posting path and the Celery jobs, reads and writes the
+# primary. A user who has just written something (any unsafe request) is pinned to the
+# primary for REPLICA_PIN_SECONDS, so they always see their own writes despite replica lag.
+
+PIN_COOKIE = 'pin_primary'
+
+# The replica serving the current `use_replica` scope, None outside of one
+_replica_alias = ContextVar('replica_alias', default=None)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica')]
+
+
+def read_alias():
+    ''' The database a read made now should use: the scope's replica inside `use_replica`. '''
+    return _replica_alias.get() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def reading_from_replica():
+    # One replica for the whole scope: replicas lag by different amounts, so the queries of
+    # one page must not be spread over several of them
+    replicas = replica_aliases()
+    token = _replica_alias.set(random.choice(replicas) if replicas else None)
+    try:
+        yield
+    finally:
+        _replica_alias.reset(token)
+
+
+def use_replica(view):
+    ''' Routes the reads of `view` to a replica unless the user is pinned to the primary. '''
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        # The view only reads, so it does not pin the client even when it is a POST
+        request.reads_only = True
+        # Sessions and users are always read from the primary
+        request.user.is_authenticated
+        if PIN_COOKIE in request.COOKIES:
+            return view(request, *args, **kwargs)
+        with reading_from_replica():
+            response = view(request, *args, **kwargs)
+            # Template responses run their queries when rendered
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            return response
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class PinPrimaryAfterWriteMiddleware:
+    ''' Pins a client to the primary for REPLICA_PIN_SECONDS after any unsafe request. '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        unsafe = request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+        if unsafe and not getattr(request, 'reads_only', False) and replica_aliases():
+            response.set_cookie(
+                PIN_COOKIE, str(int(time.time())),
+                max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
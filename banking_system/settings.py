@@ -33,6 +33,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.humanize',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'django_extensions',
 
@@ -52,6 +53,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'banking_system.routers.PinPrimaryAfterWriteMiddleware',
 ]
 
 ROOT_URLCONF = 'banking_system.urls'
@@ -97,6 +99,41 @@ DATABASES = {
     }
 }
 
+
+# Connection reuse, from `database.pool` in config.yml. The `asgi` and `celery` sections
+# override the shared values in the ASGI server (which sets BANKING_PROCESS) and in the
+# Celery workers (applied on worker start, see celery.py).
+DATABASE_POOL = config['database'].get('pool') or {}
+BANKING_PROCESS = os.environ.get('BANKING_PROCESS', 'web')
+
+
+def database_pool_settings(pool, process):
+    options = {key: value for key, value in pool.items() if key not in ('web', 'asgi', 'celery')}
+    options.update(pool.get(process) or {})
+    return {
+        # Seconds a connection is kept for the next request (0 closes it after every
+        # request, None keeps it forever)
+        'CONN_MAX_AGE': options.get('MAX_AGE', 0),
+        # Ping a reused connection before the first query of a request
+        'CONN_HEALTH_CHECKS': options.get('HEALTH_CHECKS', False),
+        # PgBouncer in transaction mode can not hold a cursor across transactions
+        'DISABLE_SERVER_SIDE_CURSORS': options.get('PGBOUNCER', False),
+        'OPTIONS': {'connect_timeout': options.get('CONNECT_TIMEOUT', 10)},
+    }
+
+
+DATABASES['default'].update(database_pool_settings(DATABASE_POOL, BANKING_PROCESS))
+
+# Read replicas, from `database.replicas` in config.yml: every entry inherits the primary's
+# settings and overrides what differs (usually HOST and PORT). See banking_system/routers.py
+# for what they serve.
+for index, replica in enumerate(config['database'].get('replicas') or [], start=1):
+    DATABASES[f'replica{index}'] = {**DATABASES['default'], **replica, 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['banking_system.routers.ReplicaRouter']
+# Seconds a client reads from the primary only after writing, to cover the replication lag
+REPLICA_PIN_SECONDS = 10
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -137,11 +174,78 @@ ACCOUNT_NUMBER_START_FROM = 1000000000
 MINIMUM_DEPOSIT_AMOUNT = 10
 MINIMUM_WITHDRAWAL_AMOUNT = 10
 
+# Number of accounts locked and posted per statement by the month-end job
+MONTH_END_BATCH_SIZE = 5000
+# Number of accounts handed to a single Celery worker by the month-end fan-out
+MONTH_END_SHARD_SIZE = 100000
+
+# Number of loans collected per statement, and handed to a single Celery worker, by the
+# nightly EMI collection
+EMI_COLLECTION_BATCH_SIZE = 5000
+EMI_COLLECTION_SHARD_SIZE = 100000
+
+# Rows validated and written per COPY by the university / insurance bulk ingestion, and the
+# largest batch size a request may ask for
+INGESTION_BATCH_SIZE = 5000
+INGESTION_MAX_BATCH_SIZE = 50000
+
+# Lifetime of the cached per-user account summaries, and the number of latest transactions
+# they hold per account
+ACCOUNT_SUMMARY_CACHE_SECONDS = 300
+ACCOUNT_SUMMARY_RECENT_TRANSACTIONS = 3
+
+# Lifetime of cached catalog lookups (university search results, insurance catalog) in the
+# shared cache, and how long a process serves its own copy before re-checking the version
+CATALOG_CACHE_SECONDS = 300
+CATALOG_LOCAL_SECONDS = 5
+# Number of universities returned per search of the education-loan picker
+UNIVERSITY_SEARCH_LIMIT = 20
+UNIVERSITY_SEARCH_MIN_LENGTH = 2
+
+# Group commit for hot accounts: concurrent postings on the same account are applied as one
+# batch, waiting at most MAX_LATENCY seconds for up to MAX_BATCH_SIZE postings to join. A
+# posting only waits while others on its account are in flight. Batches are collected per
+# process, so this only helps with threaded workers (gunicorn gthread, the ASGI API's
+# database threads); with single-threaded sync workers there is nothing to batch.
+POSTING_GROUP_COMMIT = False
+POSTING_GROUP_COMMIT_MAX_LATENCY = 0.005
+POSTING_GROUP_COMMIT_MAX_BATCH_SIZE = 200
+
+# Threads (each with its own persistent connection) running the database work of the
+# async JSON API
+ASYNC_API_DATABASE_THREADS = 16
+
+# Batch transfers touching more accounts than this mark every cached account summary stale
+# instead of writing through to each account, and the API takes at most MAX_LINES per batch
+TRANSFER_WRITE_THROUGH_MAX_ACCOUNTS = 100
+TRANSFER_API_MAX_LINES = 10000
+
+# Accounts (and journal entries) verified per statement by the journal reconciliation, and
+# accounts handed to a single Celery worker by the nightly balance reconciliation
+RECONCILIATION_CHUNK_SIZE = 50000
+RECONCILIATION_SHARD_SIZE = 500000
+
+# Show the exact number of matching transactions on every history page (costs a COUNT(*))
+TRANSACTION_LIST_EXACT_COUNT = False
+
+# Monthly partitions of the transactions table created ahead of time, and how many months of
+# partitions stay attached (None keeps every month)
+TRANSACTION_PARTITION_MONTHS_AHEAD = 3
+TRANSACTION_PARTITION_RETENTION_MONTHS = None
+
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [
     BASE_DIR / "static",
 ]
 
+# Shared cache (catalog lookups), on the Redis server also used by Celery
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    }
+}
+
 # Celery Settings
 CELERY_BROKER_URL = 'redis://localhost:6379'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379'
@@ -0,0 +1,93 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.urls import reverse
+
+from accounts.models import User, CheckingBankAccount
+from transactions.models import Transaction
+from .routers import (
+    PIN_COOKIE, PinPrimaryAfterWriteMiddleware, ReplicaRouter, read_alias, reading_from_replica, use_replica,
+)
+
+
+def with_replicas(*aliases):
+    return mock.patch('banking_system.routers.replica_aliases', return_value=list(aliases))
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def request(self, method='get', **cookies):
+        request = getattr(self.factory, method)('/')
+        request.user = AnonymousUser()
+        request.COOKIES.update(cookies)
+        return request
+
+    def test_a_scope_reads_from_one_replica_and_writes_to_the_primary(self):
+        with with_replicas('replica1', 'replica2'), reading_from_replica():
+            replica = read_alias()
+            self.assertIn(replica, ('replica1', 'replica2'))
+            self.assertEqual({self.router.db_for_read(Transaction) for _ in range(20)}, {replica})
+            self.assertEqual(self.router.db_for_write(Transaction), DEFAULT_DB_ALIAS)
+
+        self.assertEqual(self.router.db_for_read(Transaction), DEFAULT_DB_ALIAS)
+
+    def test_without_replicas_a_scope_reads_from_the_primary(self):
+        with with_replicas(), reading_from_replica():
+            self.assertEqual(read_alias(), DEFAULT_DB_ALIAS)
+
+    def test_only_the_primary_is_migrated(self):
+        self.assertTrue(self.router.allow_migrate(DEFAULT_DB_ALIAS, 'transactions'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'transactions'))
+
+    def test_pinned_clients_read_from_the_primary(self):
+        view = use_replica(lambda request: HttpResponse(read_alias()))
+
+        with with_replicas('replica1'):
+            self.assertEqual(view(self.request()).content, b'replica1')
+            self.assertEqual(view(self.request(**{PIN_COOKIE: '1'})).content, DEFAULT_DB_ALIAS.encode())
+
+    def test_only_unsafe_requests_that_write_pin_the_client(self):
+        middleware = PinPrimaryAfterWriteMiddleware(lambda request: HttpResponse())
+        reads_only = PinPrimaryAfterWriteMiddleware(use_replica(lambda request: HttpResponse()))
+
+        with with_replicas('replica1'):
+            for method in ('post', 'put', 'patch', 'delete'):
+                with self.subTest(method=method):
+                    cookie = middleware(self.request(method)).cookies[PIN_COOKIE]
+                    self.assertEqual((cookie['max-age'], cookie['httponly']), (10, True))
+            for method in ('get', 'head', 'options', 'trace'):
+                with self.subTest(method=method):
+                    self.assertNotIn(PIN_COOKIE, middleware(self.request(method)).cookies)
+            self.assertNotIn(PIN_COOKIE, reads_only(self.request('post')).cookies)
+
+        with with_replicas():
+            self.assertNotIn(PIN_COOKIE, middleware(self.request('post')).cookies)
+
+
+class ReadYourWritesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='customer@mail.com', password='secret')
+        self.account = CheckingBankAccount.objects.create(user=self.user, account_type='CHECKING')
+        self.client.force_login(self.user)
+
+    def test_a_deposit_is_exported_from_the_primary_right_after(self):
+        # No replica1 database exists here: a read routed to it would fail
+        with with_replicas('replica1'):
+            response = self.client.post(reverse('transactions:deposit_money', args=[self.account.pk]), {
+                'amount': '25.00', 'transaction_type': 'DEPOSIT',
+            })
+            self.assertEqual(response.status_code, 302)
+            self.assertIn(PIN_COOKIE, self.client.cookies)
+
+            response = self.client.get(reverse('transactions:transaction_export', args=[self.account.pk]))
+            rows = b''.join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(Decimal(rows[1].split(',')[3]), Decimal('25.00'))
@@ -0,0 +1,296 @@
+import io
+import random
+import time
+from datetime import datetime, time as day_time, timedelta
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.summary import invalidate_all_summaries
+from loans import portfolio
+from loans.amortization import installment, outstanding_balance
+from loans.models import Loan
+from transactions.constants import DEPOSIT, LEDGER_CASH, WITHDRAWAL
+from transactions.posting import current_period
+
+# Synthetic book for benchmarks: users, their personal loans, and accounts with a history
+# of deposits and withdrawals that is consistent everywhere a balance is derived
+# (transactions, journal, daily snapshots), written straight into the tables with COPY in
+# chunks. Primary keys that other rows refer to are reserved from their sequences up
+# front, so the generator should run against a database nobody else is writing to.
+#
+# Everything derived from the loans and accounts is brought up to date at the end: the
+# loan portfolio aggregates are rebuilt and the cached account summaries invalidated.
+
+NULL = '\\N'
+
+FIRST_NAMES = ('Ava', 'Ben', 'Chloe', 'Daniel', 'Emma', 'Farah', 'George', 'Hana', 'Ivan', 'Julia', 'Kofi', 'Lena')
+LAST_NAMES = ('Adams', 'Brown', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Garcia', 'Haddad', 'Ito', 'Jones', 'Khan')
+
+LOAN_AMOUNTS = range(1000, 100001, 500)
+LOAN_RATES = ('7.50', '8.00', '9.50', '10.00', '12.00', '14.00')
+LOAN_TENURES = (12, 24, 36, 48, 60, 120)
+LOAN_STATUSES = (
+    (Loan.LoanStatusChoices.APPROVED, 0.6),
+    (Loan.LoanStatusChoices.PENDING, 0.3),
+    (Loan.LoanStatusChoices.DECLINED, 0.1),
+)
+
+
+def _money(cents):
+    sign = '-' if cents < 0 else ''
+    cents = abs(cents)
+    return f"{sign}{cents // 100}.{cents % 100:02d}"
+
+
+def reserve_ids(cursor, table, column, count):
+    ''' Takes `count` consecutive values from the sequence of `table.column`; returns the first. '''
+    cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [table, column])
+    sequence = cursor.fetchone()[0]
+    cursor.execute("SELECT nextval(%s)", [sequence])
+    first = cursor.fetchone()[0]
+    cursor.execute("SELECT setval(%s, %s)", [sequence, first + count - 1])
+    return first
+
+
+class CopyBuffer:
+    ''' Tab-separated rows for one COPY into `table`. '''
+
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = columns
+        self.buffer = io.StringIO()
+        self.rows = 0
+
+    def add(self, *values):
+        self.buffer.write('\t'.join(values))
+        self.buffer.write('\n')
+        self.rows += 1
+
+    def copy(self, cursor):
+        self.buffer.seek(0)
+        cursor.copy_expert(f"COPY {self.table} ({', '.join(self.columns)}) FROM STDIN", self.buffer)
+        rows, self.rows = self.rows, 0
+        self.buffer = io.StringIO()
+        return rows
+
+
+class BookGenerator:
+    '''
+    Generates `users` users, a `loan_rate` share of whom have a personal loan, and
+    `accounts` accounts owned by them (or by `owner_ids` when no users are generated),
+    round-robin. Each account has up to `transactions` postings spread over the last `days`
+    days, except the first `heavy_accounts`, which get `heavy_transactions` each for the
+    paging benchmarks. A `discrepancy_rate` share of the accounts get a stored balance one
+    cent off, for the reconciliation to find.
+    '''
+
+    def __init__(self, accounts, users=0, owner_ids=(), loan_rate=0.0, transactions=4, days=30,
+                 heavy_accounts=0, heavy_transactions=10000, discrepancy_rate=0.0, chunk_size=50000,
+                 seed=None):
+        if not users and not owner_ids:
+            raise ValueError("Accounts need either generated users or existing owner_ids")
+        self.accounts = accounts
+        self.users = users
+        self.owner_ids = owner_ids
+        self.loan_rate = loan_rate
+        self.transactions = transactions
+        self.days = days
+        self.heavy_accounts = min(heavy_accounts, accounts)
+        self.heavy_transactions = heavy_transactions
+        self.discrepancy_rate = discrepancy_rate
+        self.chunk_size = chunk_size
+        self.random = random.Random(seed)
+        self.zone = ZoneInfo(settings.TIME_ZONE)
+        self.today = timezone.localdate()
+        self.joined = datetime.combine(self.today - timedelta(days=days), day_time(9), self.zone).isoformat()
+        self.loan_terms = {}
+        self.report = {'discrepancies': 0, 'rows': {}}
+
+    def buffers(self):
+        return {
+            'users': CopyBuffer(
+                'accounts_user',
+                ('id', 'password', 'is_superuser', 'first_name', 'last_name', 'is_staff', 'is_active',
+                 'date_joined', 'email'),
+            ),
+            'loans': CopyBuffer(
+                'loans_loan',
+                ('user_id', 'amount', 'emi_amount', 'interest_rate', 'tenure', 'installment_paid',
+                 'outstanding_principal', 'last_collected_period', 'approved_on', 'status', 'loan_type'),
+            ),
+            'accounts': CopyBuffer(
+                'accounts_bankaccount', ('account_no', 'user_id', 'date_opened', 'balance', 'account_type'),
+            ),
+            'checking': CopyBuffer('accounts_checkingbankaccount', ('bankaccount_ptr_id', 'service_charge')),
+            'savings': CopyBuffer('accounts_savingsbankaccount', ('bankaccount_ptr_id', 'interest_rate')),
+            'transactions': CopyBuffer(
+                'transactions_transaction',
+                ('account_id', 'amount', 'balance_after_transaction', 'transaction_type', 'timestamp'),
+            ),
+            'entries': CopyBuffer('transactions_journalentry', ('id', 'entry_type', 'timestamp')),
+            'legs': CopyBuffer('transactions_journalleg', ('entry_id', 'account_id', 'ledger', 'amount')),
+            'snapshots': CopyBuffer(
+                'transactions_dailybalancesnapshot',
+                ('account_id', 'date', 'opening_balance', 'closing_balance', 'total_debits',
+                 'total_credits', 'transaction_count'),
+            ),
+        }
+
+    def history(self, count):
+        ''' `count` `(day, timestamp, delta)` postings of one account, oldest first. '''
+        offsets = sorted((self.random.randrange(self.days) for _ in range(count)), reverse=True)
+        postings = []
+        balance = 0
+        for index, offset in enumerate(offsets):
+            day = self.today - timedelta(days=offset)
+            moment = datetime.combine(day, day_time(8), self.zone) + timedelta(seconds=self.random.randrange(43200))
+            if index and self.random.random() < 0.3 and balance >= 200:
+                delta = -self.random.randint(100, balance // 2)
+            else:
+                delta = self.random.randint(1000, 500000)
+            balance += delta
+            postings.append((day, moment.isoformat(), delta))
+        return postings
+
+    def loan(self, user_id):
+        ''' The loans_loan row of a personal loan of `user_id`. '''
+        amount = self.random.choice(LOAN_AMOUNTS)
+        rate = self.random.choice(LOAN_RATES)
+        tenure = self.random.choice(LOAN_TENURES)
+        status = self.random.choices(
+            [status for status, _ in LOAN_STATUSES], [weight for _, weight in LOAN_STATUSES],
+        )[0]
+        paid = 0
+        if status == Loan.LoanStatusChoices.APPROVED:
+            paid = self.random.randint(0, min(tenure, 24))
+
+        # Few distinct terms, so the schedule arithmetic is only done once for each
+        key = (amount, rate, tenure, paid)
+        if key not in self.loan_terms:
+            emi = installment(amount, rate, tenure)
+            self.loan_terms[key] = (emi, outstanding_balance(amount, rate, tenure, emi, paid))
+        emi, outstanding = self.loan_terms[key]
+
+        # Approved before this month and an installment collected last month, so this
+        # month's is due
+        collected = approved = NULL
+        if status == Loan.LoanStatusChoices.APPROVED:
+            approved = (current_period() - timedelta(days=31 * (paid + 1))).isoformat()
+        if paid:
+            collected = (current_period() - timedelta(days=1)).replace(day=1).isoformat()
+        return (
+            str(user_id), f"{amount}.00", str(emi), rate, str(tenure), str(paid), str(outstanding),
+            collected, approved, status, 'personal',
+        )
+
+    def write_users(self, cursor, buffers, first_user_id, count):
+        for user_id in range(first_user_id, first_user_id + count):
+            buffers['users'].add(
+                str(user_id), '!', 'f', self.random.choice(FIRST_NAMES), self.random.choice(LAST_NAMES),
+                'f', 't', self.joined, f"bench-{user_id}@bench.local",
+            )
+            if self.random.random() < self.loan_rate:
+                buffers['loans'].add(*self.loan(user_id))
+
+        for name in ('users', 'loans'):
+            rows = buffers[name].copy(cursor)
+            self.report['rows'][name] = self.report['rows'].get(name, 0) + rows
+
+    def write_chunk(self, cursor, buffers, first_account_no, count, first_entry_id):
+        entry_id = first_entry_id
+        for offset in range(count):
+            account_no = first_account_no + offset
+            if account_no - self.first_account_no < self.heavy_accounts:
+                postings = self.history(self.heavy_transactions)
+            else:
+                postings = self.history(self.random.randint(1, self.transactions) if self.transactions else 0)
+            balance = 0
+            days = {}
+            for day, moment, delta in postings:
+                balance += delta
+                kind = DEPOSIT if delta > 0 else WITHDRAWAL
+                buffers['transactions'].add(str(account_no), _money(abs(delta)), _money(balance), kind, moment)
+                buffers['entries'].add(str(entry_id), kind, moment)
+                buffers['legs'].add(str(entry_id), str(account_no), NULL, _money(delta))
+                buffers['legs'].add(str(entry_id), NULL, LEDGER_CASH, _money(-delta))
+                entry_id += 1
+                credits, debits, postings_count, _ = days.get(day, (0, 0, 0, 0))
+                days[day] = (credits + max(delta, 0), debits + max(-delta, 0), postings_count + 1, balance)
+            for day, (credits, debits, postings_count, closing) in days.items():
+                buffers['snapshots'].add(
+                    str(account_no), day.isoformat(), _money(closing - credits + debits), _money(closing),
+                    _money(debits), _money(credits), str(postings_count),
+                )
+
+            stored = balance
+            if self.random.random() < self.discrepancy_rate:
+                stored += 1
+                self.report['discrepancies'] += 1
+            opened = (self.today - timedelta(days=self.days)).isoformat()
+            owner = self.owner_ids[account_no % len(self.owner_ids)]
+            if account_no % 2:
+                buffers['accounts'].add(str(account_no), str(owner), opened, _money(stored), 'SAVINGS')
+                buffers['savings'].add(str(account_no), '8.00')
+            else:
+                buffers['accounts'].add(str(account_no), str(owner), opened, _money(stored), 'CHECKING')
+                buffers['checking'].add(str(account_no), '10.00')
+
+        # Referenced rows first, so every COPY satisfies its foreign keys
+        for name in ('accounts', 'checking', 'savings', 'entries', 'legs', 'transactions', 'snapshots'):
+            rows = buffers[name].copy(cursor)
+            self.report['rows'][name] = self.report['rows'].get(name, 0) + rows
+        return entry_id
+
+    def generate(self, on_chunk=None):
+        '''
+        Writes the book and returns a report of the rows written. `on_chunk(kind, done,
+        total, elapsed)` is called after every chunk of users and of accounts.
+        '''
+        started = time.monotonic()
+        buffers = self.buffers()
+        with connection.cursor() as cursor:
+            if self.users:
+                first_user_id = reserve_ids(cursor, 'accounts_user', 'id', self.users)
+                self.owner_ids = range(first_user_id, first_user_id + self.users)
+            self.first_account_no = reserve_ids(cursor, 'accounts_bankaccount', 'account_no', self.accounts)
+            # Every account has at most `transactions` entries, the heavy ones `heavy_transactions`
+            entries = (
+                (self.accounts - self.heavy_accounts) * max(self.transactions, 1)
+                + self.heavy_accounts * self.heavy_transactions
+            )
+            entry_id = reserve_ids(cursor, 'transactions_journalentry', 'id', entries)
+
+        for offset in range(0, self.users, self.chunk_size):
+            count = min(self.chunk_size, self.users - offset)
+            with transaction.atomic(), connection.cursor() as cursor:
+                self.write_users(cursor, buffers, self.owner_ids[offset], count)
+            if on_chunk:
+                on_chunk('users', offset + count, self.users, time.monotonic() - started)
+
+        for offset in range(0, self.accounts, self.chunk_size):
+            count = min(self.chunk_size, self.accounts - offset)
+            with transaction.atomic(), connection.cursor() as cursor:
+                entry_id = self.write_chunk(cursor, buffers, self.first_account_no + offset, count, entry_id)
+            if on_chunk:
+                on_chunk('accounts', offset + count, self.accounts, time.monotonic() - started)
+
+        if self.report['rows'].get('loans'):
+            with transaction.atomic():
+                portfolio.rebuild()
+        invalidate_all_summaries()
+
+        elapsed = time.monotonic() - started
+        rows = sum(self.report['rows'].values())
+        self.report.update({
+            'users': self.users,
+            'accounts': self.accounts,
+            'first_account_no': self.first_account_no,
+            'heavy_accounts': [self.first_account_no, self.first_account_no + self.heavy_accounts - 1]
+            if self.heavy_accounts else [],
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(rows / elapsed, 1) if elapsed > 0 else 0.0,
+        })
+        return self.report
@@ -0,0 +1,258 @@
+import statistics
+import subprocess
+import time
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Exists, OuterRef
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import BankAccount, User
+from accounts.summary import invalidate_all_summaries
+from loans.models import Loan
+from transactions.models import DailyBalanceSnapshot, Transaction
+from transactions.pagination import encode_cursor
+from transactions.posting import current_period, run_month_end
+
+# Benchmark suite of the hot paths, meant to run against a generated book (see
+# generate_benchmark_data). Every benchmark is timed over several runs and reports the
+# spread of its latency and the number of queries it made on all databases, so a results
+# file can be diffed against the one of another commit.
+#
+# Benchmarks that write run in a transaction that is rolled back, so they can be repeated
+# on the same data and every run of the suite measures the same work.
+
+DATASET_TABLES = ('accounts_user', 'accounts_bankaccount', 'transactions_transaction', 'loans_loan')
+
+# Planner estimates, summed over the partitions of a partitioned table
+DATASET_SQL = """
+    SELECT parent.relname, SUM(GREATEST(child.reltuples, 0))::bigint
+    FROM pg_class parent
+    JOIN pg_class child ON child.oid = parent.oid
+        OR child.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = parent.oid)
+    WHERE parent.relname = ANY(%s) AND parent.relnamespace = 'public'::regnamespace
+    GROUP BY parent.relname
+"""
+
+
+class BenchmarkError(RuntimeError):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    ''' Runs the block in a transaction that is rolled back at the end. '''
+    try:
+        with transaction.atomic():
+            yield
+            transaction.set_rollback(True)
+    finally:
+        # Cached summaries may describe postings that no longer exist
+        invalidate_all_summaries()
+
+
+def summarize(timings, queries):
+    timings = sorted(timings)
+    return {
+        'runs': len(timings),
+        'mean_ms': round(statistics.mean(timings) * 1000, 3),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'p95_ms': round(timings[min(int(len(timings) * 0.95), len(timings) - 1)] * 1000, 3),
+        'min_ms': round(timings[0] * 1000, 3),
+        'max_ms': round(timings[-1] * 1000, 3),
+        'queries': max(queries),
+    }
+
+
+def measure(action, runs, setup=None):
+    '''
+    Calls `action` `runs` times, each after `setup()` if given, and returns the summary of
+    its timings and of the queries it made.
+    '''
+    timings, queries = [], []
+    for _ in range(runs):
+        if setup:
+            setup()
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+            started = time.perf_counter()
+            action()
+            timings.append(time.perf_counter() - started)
+        queries.append(sum(len(context) for context in captured))
+    return summarize(timings, queries)
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def dataset():
+    ''' Approximate row counts of the main tables. '''
+    with connection.cursor() as cursor:
+        cursor.execute(DATASET_SQL, [list(DATASET_TABLES)])
+        return dict(cursor.fetchall())
+
+
+class BenchmarkSuite:
+    '''
+    Runs the benchmarks named in `BENCHMARKS`. The history benchmarks page through
+    `account_no` (by default the account with the most postings today), the home page is
+    rendered for its owner and loans are applied for by a user without a personal loan.
+    '''
+
+    BENCHMARKS = (
+        'month_end',
+        'transaction_list_first_page',
+        'transaction_list_deep_page',
+        'transaction_list_date_range',
+        'accounts_home_cold',
+        'accounts_home_warm',
+        'loan_application_form',
+        'loan_application_submit',
+    )
+
+    def __init__(self, runs=20, batch_runs=1, account_no=None, month_end_batch_size=None):
+        self.runs = runs
+        self.batch_runs = batch_runs
+        self.month_end_batch_size = month_end_batch_size
+        self.account = self.pick_account(account_no)
+        self.applicant = (
+            User.objects.filter(~Exists(Loan.objects.filter(user=OuterRef('pk'), loan_type='personal')))
+            .order_by('pk').first()
+        )
+
+    @staticmethod
+    def pick_account(account_no):
+        if account_no is None:
+            account_no = (
+                DailyBalanceSnapshot.objects.filter(date=timezone.localdate())
+                .order_by('-transaction_count').values_list('account_id', flat=True).first()
+            )
+        accounts = BankAccount.objects.select_related('user').order_by('account_no')
+        account = accounts.filter(account_no=account_no).first() if account_no else accounts.first()
+        if account is None:
+            raise BenchmarkError("There are no accounts to benchmark, generate some first")
+        return account
+
+    def client(self, user=None):
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        return client
+
+    @staticmethod
+    def get(client, url, data=None, status=200):
+        response = client.get(url, data)
+        if response.status_code != status:
+            raise BenchmarkError(f"GET {url} returned {response.status_code}, expected {status}")
+        return response
+
+    def subjects(self):
+        return {
+            'account_no': self.account.account_no,
+            'user_id': self.account.user_id,
+            'applicant_id': self.applicant.pk if self.applicant else None,
+        }
+
+    # ================================ Benchmarks ============================================
+    def month_end(self):
+        def post():
+            with rolled_back():
+                run_month_end(batch_size=self.month_end_batch_size, period=current_period())
+        return measure(post, self.batch_runs)
+
+    def transaction_list_first_page(self):
+        client = self.client()
+        url = reverse('transactions:transaction_list', args=[self.account.account_no])
+        return measure(lambda: self.get(client, url), self.runs)
+
+    def transaction_list_deep_page(self):
+        client = self.client()
+        url = reverse('transactions:transaction_list', args=[self.account.account_no])
+        history = Transaction.objects.filter(account=self.account).order_by('-timestamp', '-id')
+        count = history.count()
+        if not count:
+            raise BenchmarkError(f"Account {self.account.account_no} has no transactions")
+        data = {'after': encode_cursor(history[count // 2])}
+        return measure(lambda: self.get(client, url, data), self.runs)
+
+    def transaction_list_date_range(self):
+        client = self.client()
+        url = reverse('transactions:transaction_list', args=[self.account.account_no])
+        today = timezone.localdate()
+        data = {'start_date': (today - timedelta(days=7)).isoformat(), 'end_date': today.isoformat()}
+        return measure(lambda: self.get(client, url, data), self.runs)
+
+    def accounts_home_cold(self):
+        client = self.client(self.account.user)
+        url = reverse('accounts:accounts_home')
+        return measure(lambda: self.get(client, url), self.runs, setup=invalidate_all_summaries)
+
+    def accounts_home_warm(self):
+        client = self.client(self.account.user)
+        url = reverse('accounts:accounts_home')
+        self.get(client, url)
+        return measure(lambda: self.get(client, url), self.runs)
+
+    def loan_application_form(self):
+        if self.applicant is None:
+            raise BenchmarkError("Every user has a personal loan already")
+        client = self.client(self.applicant)
+        url = reverse('loans:apply_personal_loan')
+        return measure(lambda: self.get(client, url), self.runs)
+
+    def loan_application_submit(self):
+        if self.applicant is None:
+            raise BenchmarkError("Every user has a personal loan already")
+        client = self.client(self.applicant)
+        url = reverse('loans:apply_personal_loan')
+
+        def apply():
+            with rolled_back():
+                response = client.post(url, {'amount': '25000.00', 'tenure': 36})
+                if response.status_code != 302 or response.url != reverse('loans:loan_home'):
+                    raise BenchmarkError(f"POST {url} did not create the loan ({response.status_code})")
+        return measure(apply, self.runs)
+
+    def run(self, names=None, on_result=None):
+        ''' Runs the benchmarks in `names` (all by default) and returns the results document. '''
+        started_at = timezone.now()
+        results = {}
+        # The test client's requests come from 'testserver'
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name in names or self.BENCHMARKS:
+                results[name] = getattr(self, name)()
+                if on_result:
+                    on_result(name, results[name])
+        return {
+            'commit': current_commit(),
+            'started_at': started_at.isoformat(),
+            'dataset': dataset(),
+            'subjects': self.subjects(),
+            'benchmarks': results,
+        }
+
+
+def compare(previous, current):
+    '''
+    `(name, previous, current, change)` for every benchmark in both results documents,
+    `change` being the relative change of the median latency.
+    '''
+    rows = []
+    for name, result in current['benchmarks'].items():
+        before = previous.get('benchmarks', {}).get(name)
+        if before is None:
+            continue
+        change = (result['median_ms'] - before['median_ms']) / before['median_ms'] if before['median_ms'] else 0.0
+        rows.append((name, before, result, change))
+    return rows
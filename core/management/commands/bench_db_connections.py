@@ -0,0 +1,84 @@
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connection
+
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulates request cycles (request_started, a short query, request_finished) from "
+        "several threads, with and without connection reuse, and reports the latency of "
+        "each mode and how many connections it opened."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help="Requests per thread")
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument(
+            '--max-age', type=int, default=None,
+            help="CONN_MAX_AGE of the reusing mode (defaults to the configured value, or 600)",
+        )
+
+    def handle(self, *args, **options):
+        configured = connection.settings_dict['CONN_MAX_AGE']
+        max_age = options['max_age'] if options['max_age'] is not None else (configured or 600)
+        self.stdout.write(
+            f"Configured: CONN_MAX_AGE={configured}, "
+            f"CONN_HEALTH_CHECKS={connection.settings_dict['CONN_HEALTH_CHECKS']}"
+        )
+
+        results = {}
+        for label, age in (('per request', 0), (f'reused ({max_age}s)', max_age)):
+            results[label] = self.run(age, options['threads'], options['requests'])
+            self.report(label, results[label])
+
+        baseline, reused = results.values()
+        saved = statistics.mean(baseline['latencies']) - statistics.mean(reused['latencies'])
+        self.stdout.write(self.style.SUCCESS(f"Connection setup overhead removed: {saved * 1000:.2f} ms per request"))
+
+    def run(self, max_age, threads, requests):
+        latencies = []
+        connections = set()
+        lock = threading.Lock()
+
+        def worker():
+            # Connections are per thread, so the setting is applied to this thread's one
+            connection.settings_dict['CONN_MAX_AGE'] = max_age
+            timings = []
+            opened = set()
+            try:
+                for _ in range(requests):
+                    started = time.perf_counter()
+                    request_started.send(sender=self.__class__)
+                    User.objects.filter(pk=0).exists()
+                    opened.add(connection.connection.get_backend_pid())
+                    request_finished.send(sender=self.__class__)
+                    timings.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+            with lock:
+                latencies.extend(timings)
+                connections.update(opened)
+
+        started = time.monotonic()
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return {'latencies': latencies, 'connections': len(connections), 'elapsed': time.monotonic() - started}
+
+    def report(self, label, result):
+        latencies = sorted(result['latencies'])
+        self.stdout.write(
+            f"{label:>16}: {len(latencies) / result['elapsed']:8.0f} req/s, "
+            f"mean {statistics.mean(latencies) * 1000:6.2f} ms, "
+            f"p50 {latencies[len(latencies) // 2] * 1000:6.2f} ms, "
+            f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:6.2f} ms, "
+            f"{result['connections']} connections opened"
+        )
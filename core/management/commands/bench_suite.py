@@ -0,0 +1,63 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmarks import BenchmarkError, BenchmarkSuite, compare
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the month-end job, the transaction history pages, the accounts home page "
+        "and loan applications on the current data, and writes the timings and query counts "
+        "to a JSON results file that can be compared with the results of another commit."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=20, help="Runs of every request benchmark")
+        parser.add_argument('--batch-runs', type=int, default=1, help="Runs of the month-end job")
+        parser.add_argument('--month-end-batch-size', type=int)
+        parser.add_argument('--account', type=int, help="Account whose history is paged")
+        parser.add_argument('--only', nargs='+', choices=BenchmarkSuite.BENCHMARKS, metavar='BENCHMARK')
+        parser.add_argument('--output', default='benchmark_results.json')
+        parser.add_argument('--compare', metavar='RESULTS', help="Earlier results file to compare with")
+
+    def handle(self, *args, **options):
+        previous = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    previous = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Can not read {options['compare']}: {e}")
+
+        def on_result(name, result):
+            self.stdout.write(
+                f"{name:>28}: median {result['median_ms']:9.2f} ms, p95 {result['p95_ms']:9.2f} ms, "
+                f"{result['queries']:3} queries ({result['runs']} runs)"
+            )
+
+        try:
+            suite = BenchmarkSuite(
+                runs=options['runs'],
+                batch_runs=options['batch_runs'],
+                account_no=options['account'],
+                month_end_batch_size=options['month_end_batch_size'],
+            )
+            results = suite.run(options['only'], on_result=on_result)
+        except BenchmarkError as e:
+            raise CommandError(str(e))
+
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+        if previous is not None:
+            self.stdout.write(f"Compared with {options['compare']} (commit {previous.get('commit')}):")
+            for name, before, after, change in compare(previous, results):
+                line = (
+                    f"{name:>28}: {before['median_ms']:9.2f} -> {after['median_ms']:9.2f} ms ({change:+.1%}), "
+                    f"{before['queries']} -> {after['queries']} queries"
+                )
+                slower = change > 0.1 or after['queries'] > before['queries']
+                self.stdout.write(self.style.WARNING(line) if slower else line)
@@ -0,0 +1,60 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from accounts.models import User
+from core.benchmark_data import BookGenerator
+
+
+class Command(BaseCommand):
+    help = (
+        "Loads a synthetic book of users, personal loans and accounts with consistent "
+        "transactions, journal entries and daily snapshots with COPY, for the benchmarks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000, help="0 gives every account to --owner")
+        parser.add_argument('--accounts', type=int, default=5000000)
+        parser.add_argument('--loan-rate', type=float, default=0.3, help="Share of the users with a personal loan")
+        parser.add_argument('--transactions', type=int, default=4, help="Maximum postings per account")
+        parser.add_argument('--days', type=int, default=30, help="Days of history the postings spread over")
+        parser.add_argument('--heavy-accounts', type=int, default=10, help="Accounts with a long history")
+        parser.add_argument('--heavy-transactions', type=int, default=10000, help="Postings of each heavy account")
+        parser.add_argument(
+            '--discrepancy-rate', type=float, default=0.0001,
+            help="Share of the accounts stored with a wrong balance",
+        )
+        parser.add_argument('--chunk-size', type=int, default=50000, help="Users or accounts written per transaction")
+        parser.add_argument('--seed', type=int)
+        parser.add_argument(
+            '--owner', default='bench-owner@bench.local', help="Email of the owner of the accounts without --users",
+        )
+
+    def handle(self, *args, **options):
+        owner_ids = ()
+        if not options['users']:
+            owner, created = User.objects.get_or_create(email=options['owner'])
+            if created:
+                owner.set_unusable_password()
+                owner.save()
+            owner_ids = [owner.pk]
+
+        generator = BookGenerator(
+            options['accounts'],
+            users=options['users'],
+            owner_ids=owner_ids,
+            loan_rate=options['loan_rate'],
+            transactions=options['transactions'],
+            days=options['days'],
+            heavy_accounts=options['heavy_accounts'],
+            heavy_transactions=options['heavy_transactions'],
+            discrepancy_rate=options['discrepancy_rate'],
+            chunk_size=options['chunk_size'],
+            seed=options['seed'],
+        )
+
+        def on_chunk(kind, done, total, elapsed):
+            self.stdout.write(f"{done}/{total} {kind} in {elapsed:.1f}s")
+
+        report = generator.generate(on_chunk=on_chunk)
+        self.stdout.write(self.style.SUCCESS(json.dumps(report)))
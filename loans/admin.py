@@ -8,3 +8,10 @@ admin.site.register(models.HomeLoan)
 admin.site.register(models.EducationLoan)
 admin.site.register(models.Address)
 admin.site.register(models.StudentInfo)
+
+
+@admin.register(models.LoanPortfolioAggregate)
+class LoanPortfolioAggregateAdmin(admin.ModelAdmin):
+    list_display = ('loan_type', 'status', 'interest_bucket', 'tenure_bucket', 'loan_count',
+                    'total_principal', 'outstanding_principal', 'expected_monthly_emi', 'updated_at')
+    list_filter = ('loan_type', 'status', 'interest_bucket', 'tenure_bucket')
@@ -0,0 +1,173 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+
+# Amortization schedules are computed in integer cents with NumPy, one vector operation per
+# installment number across all loans of a chunk. Interest is rounded half-up to the cent
+# on the outstanding balance of every month, and the final installment of each loan takes
+# whatever balance is left, so the principal parts always add up to the exact amount lent
+# and the schedule closes at exactly zero.
+
+CENT = Decimal('0.01')
+
+
+def installment(amount, interest_rate, tenure):
+    ''' The EMI of a loan of `amount` at `interest_rate` % a year over `tenure` months. '''
+    if tenure <= 0:
+        return Decimal('0.00')
+    r = Decimal(interest_rate) / Decimal('1200')
+    if r == 0:
+        return (Decimal(amount) / tenure).quantize(CENT, rounding=ROUND_HALF_UP)
+    growth = (1 + r) ** tenure
+    return (Decimal(amount) * r * growth / (growth - 1)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def to_cents(values):
+    return np.rint(np.asarray(values, dtype=np.float64) * 100).astype(np.int64)
+
+
+def monthly_rates(interest_rates):
+    return np.asarray(interest_rates, dtype=np.float64) / 1200
+
+
+def installments_cents(principal_cents, rates, tenures):
+    ''' Vectorized `installment` over arrays of loans, in cents. '''
+    principal = principal_cents.astype(np.float64)
+    tenures = np.maximum(tenures, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.power(1 + rates, tenures)
+        emi = np.where(rates > 0, principal * rates * growth / (growth - 1), principal / tenures)
+    return np.floor(emi + 0.5).astype(np.int64)
+
+
+def amortize(principal_cents, rates, tenures, emi_cents=None):
+    '''
+    Builds the schedules of a chunk of loans. Returns `(payment, principal, interest,
+    balance)` int64 arrays in cents of shape `(loans, max tenure)`; column `k` is
+    installment `k + 1` and is zero past the tenure of a loan.
+
+    Loans ordered by descending tenure are scheduled fastest, since every step then only
+    works on the prefix of loans that still have installments left.
+    '''
+    principal_cents = np.asarray(principal_cents, dtype=np.int64)
+    rates = np.asarray(rates, dtype=np.float64)
+    tenures = np.asarray(tenures, dtype=np.int64)
+    if emi_cents is None:
+        emi_cents = installments_cents(principal_cents, rates, tenures)
+    emi_cents = np.asarray(emi_cents, dtype=np.int64)
+
+    order = None
+    if np.any(tenures[1:] > tenures[:-1]):
+        order = np.argsort(-tenures, kind='stable')
+        principal_cents, rates, tenures, emi_cents = (
+            principal_cents[order], rates[order], tenures[order], emi_cents[order],
+        )
+
+    months = int(tenures[0]) if tenures.size else 0
+    # One row per installment number, so each step writes contiguous memory
+    shape = (months, principal_cents.size)
+    payment = np.zeros(shape, dtype=np.int64)
+    principal = np.zeros(shape, dtype=np.int64)
+    interest = np.zeros(shape, dtype=np.int64)
+    balance = np.zeros(shape, dtype=np.int64)
+
+    # Number of loans with more than k installments, for every k
+    remaining = np.searchsorted(-tenures, -np.arange(months + 1), side='left')
+    # Cents are whole numbers well inside the exact range of float64, which keeps the loop
+    # free of integer/float conversions
+    outstanding = principal_cents.astype(np.float64)
+    emi = emi_cents.astype(np.float64)
+    for k in range(months):
+        active, closing = remaining[k], remaining[k + 1]
+        month_interest = np.floor(outstanding[:active] * rates[:active] + 0.5)
+        month_principal = np.clip(emi[:active] - month_interest, 0, outstanding[:active])
+        # Reconciliation: the last installment repays everything that is left
+        month_principal[closing:] = outstanding[closing:active]
+        outstanding[:active] -= month_principal
+
+        interest[k, :active] = month_interest
+        principal[k, :active] = month_principal
+        payment[k, :active] = month_interest + month_principal
+        balance[k, :active] = outstanding[:active]
+
+    if order is not None:
+        inverse = np.argsort(order)
+        return payment[:, inverse].T, principal[:, inverse].T, interest[:, inverse].T, balance[:, inverse].T
+    return payment.T, principal.T, interest.T, balance.T
+
+
+def from_cents(cents):
+    return (Decimal(int(cents)) * CENT).quantize(CENT)
+
+
+def loan_schedule(loan):
+    ''' The full schedule of one loan as a list of installments in Decimal. '''
+    payment, principal, interest, balance = amortize(
+        to_cents([loan.amount]), monthly_rates([loan.interest_rate]), [loan.tenure],
+        emi_cents=to_cents([loan.emi_amount]),
+    )
+    return [
+        {
+            'number': k + 1,
+            'payment': from_cents(payment[0, k]),
+            'principal': from_cents(principal[0, k]),
+            'interest': from_cents(interest[0, k]),
+            'balance': from_cents(balance[0, k]),
+        }
+        for k in range(loan.tenure)
+    ]
+
+
+def portfolio_schedules(loans, chunk_size=10000):
+    '''
+    Schedules a whole portfolio in chunks of `chunk_size` loans. `loans` is a queryset (or
+    any iterable) of `(loan_id, amount, interest_rate, tenure, emi_amount)` rows; yields
+    `(loan_ids, payment, principal, interest, balance)` per chunk.
+    '''
+    chunk = []
+    for row in loans:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield _schedule_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield _schedule_chunk(chunk)
+
+
+def _schedule_chunk(rows):
+    rows.sort(key=lambda row: row[3], reverse=True)
+    loan_ids, amounts, interest_rates, tenures, emis = zip(*rows)
+    return (np.asarray(loan_ids),) + amortize(
+        to_cents(amounts), monthly_rates(interest_rates), tenures, emi_cents=to_cents(emis),
+    )
+
+
+def projected_cash_flows(chunks):
+    '''
+    Sums the chunks produced by `portfolio_schedules` into the portfolio's expected
+    principal and interest collections per installment number, in cents.
+    '''
+    principal_total = np.zeros(0, dtype=np.int64)
+    interest_total = np.zeros(0, dtype=np.int64)
+    for _, _, principal, interest, _ in chunks:
+        months = max(principal_total.size, principal.shape[1])
+        principal_total = np.pad(principal_total, (0, months - principal_total.size))
+        interest_total = np.pad(interest_total, (0, months - interest_total.size))
+        principal_total[:principal.shape[1]] += principal.sum(axis=0)
+        interest_total[:interest.shape[1]] += interest.sum(axis=0)
+    return principal_total, interest_total
+
+
+def outstanding_balance(amount, interest_rate, tenure, emi_amount, installments_paid):
+    '''
+    Principal still owed after `installments_paid` installments, following the same
+    rounding as `amortize` (so it matches the balance column of the loan's schedule).
+    '''
+    if installments_paid >= tenure:
+        return Decimal('0.00')
+    balance = Decimal(amount).quantize(CENT)
+    rate = Decimal(interest_rate) / Decimal('1200')
+    for _ in range(installments_paid):
+        interest = (balance * rate).quantize(CENT, rounding=ROUND_HALF_UP)
+        balance -= min(max(Decimal(emi_amount) - interest, Decimal('0.00')), balance)
+    return balance
@@ -0,0 +1,81 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Cached lookups over the loan catalogs (universities, insurances). Every catalog has a
+# version number in the shared cache that is part of the key of all of its cached results;
+# writes to a catalog bump the version, which orphans every result cached before the write
+# instead of having to find and delete them.
+#
+# Small, hot catalogs are also kept in process (`local_lookup`), so that serving them costs
+# no round trip at all; the shared version is re-read at most every CATALOG_LOCAL_SECONDS.
+
+# {(catalog, parts): (version, checked_at, value)}
+_local = {}
+
+
+def _version_key(catalog):
+    return f'loans:catalog:{catalog}:version'
+
+
+def catalog_version(catalog):
+    version = cache.get(_version_key(catalog))
+    if version is None:
+        cache.add(_version_key(catalog), 1, timeout=None)
+        version = cache.get(_version_key(catalog), 1)
+    return version
+
+
+def _bump_version(catalog):
+    for key in [key for key in list(_local) if key[0] == catalog]:
+        _local.pop(key, None)
+    try:
+        cache.incr(_version_key(catalog))
+    except ValueError:
+        # The version was never read (or was evicted), so nothing cached depends on it
+        cache.add(_version_key(catalog), 1, timeout=None)
+
+
+def invalidate_catalog(catalog):
+    '''
+    Drops every cached result of `catalog` once the current transaction commits, so no
+    reader can cache the pre-write rows under the new version.
+    '''
+    transaction.on_commit(lambda: _bump_version(catalog))
+
+
+def cached_lookup(catalog, parts, compute, timeout=None, version=None):
+    '''
+    Returns the cached result of `compute()` for the lookup described by `parts` (e.g. the
+    search term) in `catalog`, computing and caching it on a miss.
+    '''
+    version = version or catalog_version(catalog)
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+    key = f'loans:catalog:{catalog}:{version}:{digest}'
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        cache.set(key, result, timeout if timeout is not None else settings.CATALOG_CACHE_SECONDS)
+    return result
+
+
+def local_lookup(catalog, parts, compute):
+    '''
+    `cached_lookup` with a copy of the result kept in this process. Writes made by this
+    process are seen at once, writes made by other processes within CATALOG_LOCAL_SECONDS.
+    '''
+    now = time.monotonic()
+    entry = _local.get((catalog, parts))
+    if entry is not None and now - entry[1] < settings.CATALOG_LOCAL_SECONDS:
+        return entry[2]
+
+    version = catalog_version(catalog)
+    if entry is not None and entry[0] == version:
+        value = entry[2]
+    else:
+        value = cached_lookup(catalog, parts, compute, version=version)
+    _local[catalog, parts] = (version, now, value)
+    return value
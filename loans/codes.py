@@ -0,0 +1,47 @@
+from django.apps import apps
+from django.db import connection, connections, router
+
+# University codes come from a Postgres sequence instead of MAX(code) + 1: allocating a
+# code never scans the table, concurrent inserts can never receive the same code, and a
+# block of any size is reserved with a single round trip. The sequence is created after
+# `migrate` (see LoansConfig) and starts after the highest code already stored, so it
+# takes over existing data. The unique constraint on University.code also rejects codes
+# set by hand that collide with allocated ones.
+
+UNIVERSITY_CODE_SEQUENCE = 'loans_university_code_seq'
+FIRST_UNIVERSITY_CODE = 1001
+
+CREATE_SEQUENCE_SQL = f"""
+    DO $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext('{UNIVERSITY_CODE_SEQUENCE}'));
+        IF to_regclass('{UNIVERSITY_CODE_SEQUENCE}') IS NULL THEN
+            CREATE SEQUENCE {UNIVERSITY_CODE_SEQUENCE} START {FIRST_UNIVERSITY_CODE};
+            PERFORM setval(
+                '{UNIVERSITY_CODE_SEQUENCE}',
+                GREATEST((SELECT MAX(code) FROM loans_university), {FIRST_UNIVERSITY_CODE - 1})
+            );
+        END IF;
+    END
+    $$
+"""
+
+ALLOCATE_SQL = f"SELECT nextval('{UNIVERSITY_CODE_SEQUENCE}') FROM generate_series(1, %s)"
+
+
+def create_university_code_sequence(using, **kwargs):
+    ''' post_migrate handler: creates the code sequence if it does not exist yet. '''
+    # Databases the table is not migrated on (the replicas) get it by replication
+    if not router.allow_migrate_model(using, apps.get_model('loans', 'University')):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(CREATE_SEQUENCE_SQL)
+
+
+def allocate_university_codes(count):
+    ''' Reserves `count` unused university codes (in increasing order) in one round trip. '''
+    if count <= 0:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(ALLOCATE_SQL, [count])
+        return [row[0] for row in cursor.fetchall()]
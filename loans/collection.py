@@ -0,0 +1,155 @@
+import logging
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from transactions.constants import LEDGER_LOANS
+from transactions.journal import journal_sql, ledger_source
+from transactions.models import PostingCheckpoint
+from transactions.posting import MAX_ACCOUNT_NO, current_period, post_account_class
+from transactions.snapshots import snapshot_upsert_sql
+from . import portfolio
+
+logger = logging.getLogger(__name__)
+
+# ================================ EMI collection =============================================
+# One statement collects one keyset batch of due loans, in the style of the month-end
+# postings: it locks the loans of the batch and the accounts paying them (in account_no
+# order), debits each account once for all of its loans that it can afford, writes one EMI
+# transaction and journal entry per collected loan and advances the loans, the portfolio
+# aggregates and the daily balance snapshots from the RETURNING rows.
+#
+# A loan is due when it was approved before the current cycle (`approved_on`, so nothing is
+# collected in the month the loan is disbursed), has installments left and has not been
+# collected in the current cycle (`last_collected_period`), so re-running a batch never
+# collects twice.
+# Loans whose account cannot cover the installment stay due and are retried by the next run
+# of the cycle. An account pays its loans in loan_id order as long as its balance allows.
+# The payer is the borrower's checking account, or their oldest account if they have none.
+
+EMI_SNAPSHOT_SQL = snapshot_upsert_sql(
+    "SELECT account_no, 0 AS credits, total AS debits, balance, postings FROM posted"
+)
+
+EMI_JOURNAL_SQL = journal_sql(
+    ledger_source("SELECT account_no, -emi_amount AS delta FROM collectable", 'EMI', LEDGER_LOANS)
+)
+
+EMI_PORTFOLIO_SQL = portfolio.aggregate_upsert_sql(f"""
+    SELECT c.loan_type, c.status,
+           {portfolio.INTEREST_BUCKET_SQL} AS interest_bucket,
+           {portfolio.TENURE_BUCKET_SQL} AS tenure_bucket,
+           0 AS loan_count,
+           0 AS total_principal,
+           SUM(p.outstanding_principal - c.outstanding_principal) AS outstanding_principal,
+           -SUM(CASE WHEN p.installment_paid >= c.tenure THEN c.emi_amount ELSE 0 END) AS expected_monthly_emi
+    FROM collectable c
+    JOIN paid p USING (loan_id)
+    GROUP BY 1, 2, 3, 4
+""")
+
+COLLECT_EMI_SQL = f"""
+    WITH batch AS (
+        SELECT l.loan_id, l.user_id, l.loan_type, l.status, l.interest_rate, l.tenure,
+               l.emi_amount, l.outstanding_principal
+        FROM loans_loan l
+        WHERE l.loan_id > %(after)s AND l.loan_id <= %(until)s
+          AND l.status = 'Approved' AND l.approved_on < %(period)s
+          AND l.installment_paid < l.tenure AND l.emi_amount > 0
+          AND (l.last_collected_period IS NULL OR l.last_collected_period < %(period)s)
+        ORDER BY l.loan_id
+        LIMIT %(limit)s
+        FOR UPDATE OF l
+    ),
+    due AS (
+        SELECT b.*, payer.account_no,
+               SUM(b.emi_amount) OVER (PARTITION BY payer.account_no ORDER BY b.loan_id) AS running_total
+        FROM batch b
+        JOIN LATERAL (
+            SELECT a.account_no
+            FROM accounts_bankaccount a
+            LEFT JOIN accounts_checkingbankaccount c ON c.bankaccount_ptr_id = a.account_no
+            WHERE a.user_id = b.user_id
+            ORDER BY c.bankaccount_ptr_id IS NULL, a.account_no
+            LIMIT 1
+        ) payer ON true
+    ),
+    payers AS (
+        SELECT a.account_no, a.balance
+        FROM accounts_bankaccount a
+        WHERE a.account_no IN (SELECT account_no FROM due)
+        ORDER BY a.account_no
+        FOR UPDATE
+    ),
+    collectable AS (
+        SELECT d.*, p.balance - d.running_total AS balance_after
+        FROM due d
+        JOIN payers p USING (account_no)
+        WHERE d.running_total <= p.balance
+    ),
+    posted AS (
+        UPDATE accounts_bankaccount a
+        SET balance = a.balance - c.total
+        FROM (
+            SELECT account_no, SUM(emi_amount) AS total, COUNT(*) AS postings
+            FROM collectable
+            GROUP BY account_no
+        ) c
+        WHERE a.account_no = c.account_no
+        RETURNING a.account_no, c.total, a.balance, c.postings
+    ),
+    inserted AS (
+        INSERT INTO transactions_transaction
+            (account_id, amount, balance_after_transaction, transaction_type, timestamp)
+        SELECT account_no, emi_amount, balance_after, 'EMI', %(now)s FROM collectable
+        RETURNING id
+    ),
+    {EMI_JOURNAL_SQL},
+    paid AS (
+        UPDATE loans_loan l
+        SET installment_paid = l.installment_paid + 1,
+            last_collected_period = %(period)s,
+            outstanding_principal = CASE
+                WHEN l.installment_paid + 1 >= l.tenure THEN 0
+                ELSE l.outstanding_principal - LEAST(
+                    GREATEST(l.emi_amount - ROUND(l.outstanding_principal * l.interest_rate / 1200, 2), 0),
+                    l.outstanding_principal
+                )
+            END
+        FROM collectable c
+        WHERE l.loan_id = c.loan_id
+        RETURNING l.loan_id, l.installment_paid, l.outstanding_principal
+    ),
+    aggregates AS ({EMI_PORTFOLIO_SQL}),
+    snapshot AS ({EMI_SNAPSHOT_SQL})
+    SELECT (SELECT MAX(loan_id) FROM batch),
+           (SELECT COUNT(*) FROM batch),
+           (SELECT COUNT(*) FROM inserted)
+"""
+
+EMI_STAGE = 'emi'
+
+
+def run_emi_collection(batch_size=None, period=None, after=0, until=MAX_ACCOUNT_NO, shard=None):
+    '''
+    Collects the installments due in the cycle `period` from the loans in the `loan_id`
+    range (`after`, `until`] and returns a report of the loans scanned and collected.
+    With a `shard`, collection resumes from the shard's checkpoint.
+    '''
+    batch_size = batch_size or settings.EMI_COLLECTION_BATCH_SIZE
+    period = period or current_period()
+    started = time.monotonic()
+
+    checkpoint = None
+    if shard is not None:
+        checkpoint, _ = PostingCheckpoint.objects.get_or_create(
+            shard=shard, stage=EMI_STAGE, defaults={'last_account_no': after},
+        )
+    report = post_account_class(
+        COLLECT_EMI_SQL, batch_size, timezone.now(), period,
+        after=after, until=until, checkpoint=checkpoint,
+    )
+    report['elapsed_seconds'] = round(time.monotonic() - started, 3)
+    logger.info("EMI collection (%s, %s] for %s: %s", after, until, period, report)
+    return report
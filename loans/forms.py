@@ -57,6 +57,24 @@ class AddressForm(forms.ModelForm):
         fields = '__all__'
 
 
+class InsuranceChoiceField(forms.ChoiceField):
+    ''' Insurance picker over the cached catalog: renders and validates without queries. '''
+
+    def __init__(self, **kwargs):
+        super().__init__(choices=self.catalog_choices, **kwargs)
+
+    @staticmethod
+    def catalog_choices():
+        return [('', "Select Insurance")] + [(pk, str(insurance)) for pk, insurance in Insurance.catalog().items()]
+
+    def valid_value(self, value):
+        return str(value) in Insurance.catalog()
+
+    def clean(self, value):
+        value = super().clean(value)
+        return Insurance.catalog()[value] if value else None
+
+
 class HomeLoanForm(forms.ModelForm):
     # Fields from Address model
     street = forms.CharField(max_length=255)
@@ -64,7 +82,7 @@ class HomeLoanForm(forms.ModelForm):
     state = forms.ChoiceField(choices=US_STATES)
     zip_code = forms.CharField(max_length=10)
 
-    insurance = forms.ModelChoiceField(queryset=Insurance.objects.all(), empty_label="Select Insurance")
+    insurance = InsuranceChoiceField()
 
     class Meta:
         model = HomeLoan
@@ -131,10 +149,13 @@ def validate_graduation(value):
 
 
 class EducationLoanForm(ModelForm):
+    # Chosen through the university search endpoint, so only the selected id is posted and
+    # validated (one lookup) instead of rendering the whole catalog as options
     university = forms.ModelChoiceField(
-        queryset=University.objects.all().order_by('name'),
-        empty_label="Select University",
-        widget=forms.Select(attrs={'class': 'form-control'})
+        queryset=University.objects.all(),
+        widget=forms.HiddenInput,
+        error_messages={'required': "Select a university.",
+                        'invalid_choice': "Select a university from the search results."},
     )
     first_name = forms.CharField(max_length=100)
     last_name = forms.CharField(max_length=100)
@@ -152,6 +173,16 @@ class EducationLoanForm(ModelForm):
         self.user = kwargs.pop('user', None)
         super(EducationLoanForm, self).__init__(*args, **kwargs)
 
+    def university_name(self):
+        ''' Name of the selected university, to refill the search box on re-render. '''
+        value = self['university'].value()
+        if not value:
+            return ''
+        try:
+            return University.objects.filter(pk=value).values_list('name', flat=True).first() or ''
+        except ValidationError:
+            return ''
+
     def save(self, commit=True):
         if not commit:
             raise ValueError("Cannot save without committing the transaction")
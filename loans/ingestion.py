@@ -0,0 +1,309 @@
+import csv
+import io
+import json
+import time
+import uuid
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.db.models.functions import Upper
+
+from .catalog import invalidate_catalog
+from .codes import allocate_university_codes
+from .models import Insurance, University
+
+# Bulk ingestion of catalog data (universities, insurances) from JSON arrays, NDJSON or
+# CSV. Files are parsed as a stream, one record at a time, so memory use depends on the
+# batch size and not on the file size. Every batch is validated, deduplicated (within the
+# batch, then against the table, which already holds the file's earlier batches) and
+# written with a single COPY in its own transaction.
+#
+# The check against the table and the COPY run under a transaction-level advisory lock of
+# the catalog, so concurrent ingestions of the same rows queue up and the second one finds
+# the rows of the first instead of inserting them again.
+
+FORMATS = ('json', 'ndjson', 'csv')
+LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext(%s))"
+NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+
+class RowError(ValueError):
+    pass
+
+
+# ================================ Streaming parsers ==========================================
+def iter_json_array(stream, chunk_size=64 * 1024):
+    ''' Yields the elements of a top-level JSON array read incrementally from `stream`. '''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+
+    while True:
+        # Skip whitespace and separators up to the next value
+        while position < len(buffer) and buffer[position] in ' \t\r\n,' + ('' if started else '['):
+            if buffer[position] == '[':
+                started = True
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        if position < len(buffer) and not started:
+            raise RowError("Expected a JSON array")
+
+        if position < len(buffer):
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                # A value that runs up to the end of the buffer may continue in the next
+                # chunk (numbers also decode from a prefix, e.g. "2." or "1e")
+                tail = end
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    while tail < len(buffer) and buffer[tail] in NUMBER_CHARS:
+                        tail += 1
+                complete = tail < len(buffer) or eof
+            except json.JSONDecodeError:
+                complete = False
+            if complete:
+                yield value
+                position = end
+                continue
+            if eof:
+                raise RowError(f"Invalid JSON near: {buffer[position:position + 40]!r}")
+
+        if eof:
+            if started:
+                raise RowError("Unterminated JSON array")
+            return
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def iter_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield RowError(f"Invalid JSON: {e.msg}")
+
+
+def iter_records(stream, fmt):
+    ''' Yields one dict per record of `stream` (a text stream) in format `fmt`. '''
+    if fmt == 'json':
+        return iter_json_array(stream)
+    if fmt == 'ndjson':
+        return iter_ndjson(stream)
+    if fmt == 'csv':
+        return csv.DictReader(stream)
+    raise ValueError(f"Unsupported format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+
+def guess_format(name):
+    extension = name.rsplit('.', 1)[-1].lower()
+    return {'jsonl': 'ndjson'}.get(extension, extension)
+
+
+# ================================ Row specifications =========================================
+class UniversitySpec:
+    model = University
+    catalog = 'university'
+    columns = ('id', 'name', 'code')
+
+    @staticmethod
+    def clean(record):
+        name = (record.get('name') or record.get('institution') or '').strip()
+        if not name:
+            raise RowError("Missing 'name' (or 'institution')")
+        return {'name': name}
+
+    @staticmethod
+    def key(row):
+        return row['name'].casefold()
+
+    @staticmethod
+    def existing_keys(rows):
+        # Case-insensitive, like `key`, and served by the university_name_prefix index
+        names = {row['name'].upper() for row in rows}
+        existing = University.objects.annotate(upper_name=Upper('name')).filter(upper_name__in=names)
+        return {name.casefold() for name in existing.values_list('name', flat=True)}
+
+    @staticmethod
+    def prepare(rows):
+        for row, code in zip(rows, allocate_university_codes(len(rows))):
+            row['id'] = uuid.uuid4()
+            row['code'] = code
+
+
+class InsuranceSpec:
+    model = Insurance
+    catalog = 'insurance'
+    columns = ('id', 'number', 'company', 'premium')
+
+    @staticmethod
+    def clean(record):
+        company = (record.get('company') or '').strip()
+        if not company:
+            raise RowError("Missing 'company'")
+        try:
+            number = int(record.get('number'))
+        except (TypeError, ValueError):
+            raise RowError("'number' must be an integer")
+        try:
+            premium = Decimal(str(record.get('premium', '0') or '0')).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise RowError("'premium' must be a decimal amount")
+        if premium < 0 or premium >= Decimal('1e8'):
+            raise RowError("'premium' must be between 0 and 99999999.99")
+        return {'number': number, 'company': company, 'premium': premium}
+
+    @staticmethod
+    def key(row):
+        return row['company'].casefold(), row['number']
+
+    @staticmethod
+    def existing_keys(rows):
+        existing = Insurance.objects.filter(number__in={row['number'] for row in rows}).values_list('company', 'number')
+        return {(company.casefold(), number) for company, number in existing}
+
+    @staticmethod
+    def prepare(rows):
+        for row in rows:
+            row['id'] = uuid.uuid4()
+
+
+SPECS = {
+    'university': UniversitySpec,
+    'insurance': InsuranceSpec,
+}
+
+
+# ================================ Ingestion ==================================================
+class IngestionReport:
+    def __init__(self, max_rejects):
+        self.max_rejects = max_rejects
+        self.batches = []
+        self.rejected = []
+        self.rejected_count = 0
+        self.duplicates = 0
+        self.inserted = 0
+        self.started = time.monotonic()
+
+    def reject(self, row_number, reason):
+        self.rejected_count += 1
+        if len(self.rejected) < self.max_rejects:
+            self.rejected.append({'row': row_number, 'error': reason})
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'inserted': self.inserted,
+            'duplicates': self.duplicates,
+            'rejected': self.rejected_count,
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(self.inserted / elapsed, 1) if elapsed > 0 else 0.0,
+            'batches': self.batches,
+            'rejected_rows': self.rejected,
+        }
+
+
+def _copy_rows(spec, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in spec.columns])
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {spec.model._meta.db_table} ({', '.join(spec.columns)}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+
+
+def _write_batch(spec, pending, use_copy):
+    ''' Writes the rows of `pending` that are not in the table yet and returns them. '''
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(LOCK_SQL, [f'{spec.model._meta.db_table}_ingestion'])
+        existing = spec.existing_keys(pending)
+        rows = [row for row in pending if spec.key(row) not in existing]
+        if not rows:
+            return rows
+        spec.prepare(rows)
+        if use_copy:
+            _copy_rows(spec, rows)
+        else:
+            spec.model.objects.bulk_create([spec.model(**row) for row in rows])
+        # COPY bypasses the model, so cached lookups are dropped here
+        invalidate_catalog(spec.catalog)
+    return rows
+
+
+def ingest(kind, stream, fmt, batch_size=5000, use_copy=True, max_rejects=100, on_batch=None):
+    '''
+    Loads the `kind` records ('university' or 'insurance') of the text stream `stream` and
+    returns the IngestionReport. `on_batch` is called with the stats of every written batch.
+    '''
+    spec = SPECS[kind]
+    use_copy = use_copy and connection.vendor == 'postgresql'
+    report = IngestionReport(max_rejects)
+    seen = set()
+    pending = []
+
+    def flush():
+        started = time.monotonic()
+        rows = _write_batch(spec, pending, use_copy)
+        report.duplicates += len(pending) - len(rows)
+        elapsed = time.monotonic() - started
+        report.inserted += len(rows)
+        stats = {
+            'batch': len(report.batches) + 1,
+            'inserted': len(rows),
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(len(rows) / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+        report.batches.append(stats)
+        if on_batch:
+            on_batch(stats)
+        pending.clear()
+        # Later duplicates of these rows are found in the table
+        seen.clear()
+
+    row_number = 0
+    records = iter_records(stream, fmt)
+    while True:
+        try:
+            record = next(records)
+        except StopIteration:
+            break
+        except (RowError, csv.Error) as e:
+            # The stream itself is unreadable past this point
+            report.reject(row_number + 1, str(e))
+            break
+        row_number += 1
+
+        try:
+            if isinstance(record, RowError):
+                raise record
+            if not isinstance(record, dict):
+                raise RowError("Expected an object")
+            row = spec.clean(record)
+        except RowError as e:
+            report.reject(row_number, str(e))
+            continue
+
+        key = spec.key(row)
+        if key in seen:
+            report.duplicates += 1
+            continue
+        seen.add(key)
+        pending.append(row)
+        if len(pending) >= batch_size:
+            flush()
+
+    if pending:
+        flush()
+    return report
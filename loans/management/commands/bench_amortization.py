@@ -0,0 +1,70 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from loans.amortization import amortize, projected_cash_flows, portfolio_schedules
+from loans.models import Loan
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates the amortization schedules of a whole portfolio and reports throughput. "
+        "Uses a synthetic portfolio of --loans loans unless --from-db is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loans', type=int, default=1000000)
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--max-tenure', type=int, default=360)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--from-db', action='store_true', help="Schedule the loans stored in the database")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['from_db']:
+            rows = Loan.objects.values_list(
+                'loan_id', 'amount', 'interest_rate', 'tenure', 'emi_amount',
+            ).iterator(chunk_size=options['chunk_size'])
+            chunks = portfolio_schedules(rows, options['chunk_size'])
+        else:
+            chunks = self.synthetic_chunks(options)
+
+        loans = installments = 0
+        principal_repaid = 0
+
+        def counted(chunks):
+            nonlocal loans, installments, principal_repaid
+            for chunk in chunks:
+                loan_ids, payment, principal, interest, balance = chunk
+                loans += loan_ids.size
+                installments += int((payment > 0).sum())
+                principal_repaid += int(principal.sum())
+                if balance.shape[1] and balance[:, -1].any():
+                    raise AssertionError("A schedule did not close at zero")
+                yield chunk
+
+        principal_by_month, interest_by_month = projected_cash_flows(counted(chunks))
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(f"Loans scheduled:    {loans}")
+        self.stdout.write(f"Installments:       {installments}")
+        self.stdout.write(f"Elapsed:            {elapsed:.2f}s")
+        self.stdout.write(f"Throughput:         {loans / elapsed:,.0f} loans/s")
+        self.stdout.write(f"Projected interest: {interest_by_month.sum() / 100:,.2f}")
+        self.stdout.write(self.style.SUCCESS(f"Principal reconciled: {principal_repaid / 100:,.2f}"))
+
+    @staticmethod
+    def synthetic_chunks(options):
+        rng = np.random.default_rng(options['seed'])
+        remaining = options['loans']
+        next_id = 1
+        while remaining:
+            size = min(options['chunk_size'], remaining)
+            principal = rng.integers(1000, 500000, size) * 100
+            rates = rng.choice([8.0, 10.0, 12.5], size) / 1200
+            tenures = np.sort(rng.integers(6, options['max_tenure'] + 1, size))[::-1]
+            loan_ids = np.arange(next_id, next_id + size)
+            yield (loan_ids,) + amortize(principal, rates, tenures)
+            remaining -= size
+            next_id += size
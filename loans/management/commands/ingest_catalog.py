@@ -0,0 +1,48 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from loans import ingestion
+
+
+class Command(BaseCommand):
+    help = "Streams a JSON array, NDJSON or CSV file of universities or insurances into the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(ingestion.SPECS))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=ingestion.FORMATS, help="Defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=settings.INGESTION_BATCH_SIZE)
+        parser.add_argument('--no-copy', action='store_true', help="Insert with bulk_create instead of COPY")
+        parser.add_argument('--max-rejects', type=int, default=20, help="Rejected rows listed in the report")
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ingestion.guess_format(options['path'])
+        if fmt not in ingestion.FORMATS:
+            raise CommandError(f"Cannot tell the format of {options['path']}, use --format")
+
+        def on_batch(stats):
+            self.stdout.write(
+                f"batch {stats['batch']}: {stats['inserted']} rows in {stats['elapsed_seconds']:.3f}s "
+                f"({stats['rows_per_second']:.0f} rows/s)"
+            )
+
+        try:
+            with open(options['path'], encoding='utf-8', newline='') as stream:
+                report = ingestion.ingest(
+                    options['kind'], stream, fmt,
+                    batch_size=options['batch_size'],
+                    use_copy=not options['no_copy'],
+                    max_rejects=options['max_rejects'],
+                    on_batch=on_batch,
+                )
+        except OSError as e:
+            raise CommandError(str(e))
+
+        summary = report.as_dict()
+        for rejected in summary['rejected_rows']:
+            self.stderr.write(f"row {rejected['row']}: {rejected['error']}")
+        self.stdout.write(self.style.SUCCESS(json.dumps(
+            {key: value for key, value in summary.items() if key not in ('batches', 'rejected_rows')}
+        )))
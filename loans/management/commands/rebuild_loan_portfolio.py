@@ -0,0 +1,50 @@
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from loans import portfolio
+from loans.amortization import from_cents, portfolio_schedules
+from loans.models import Loan
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the loan portfolio aggregates from the loan table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recompute-outstanding', action='store_true',
+            help="Recompute every loan's outstanding principal from its schedule first",
+        )
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        with transaction.atomic():
+            if options['recompute_outstanding']:
+                updated = self.recompute_outstanding(options['chunk_size'])
+                self.stdout.write(f"Recomputed the outstanding principal of {updated} loans")
+            rows = portfolio.rebuild()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} aggregate rows in {elapsed:.2f}s"))
+
+    @staticmethod
+    def recompute_outstanding(chunk_size):
+        rows = Loan.objects.select_for_update().order_by('loan_id').values_list(
+            'loan_id', 'amount', 'interest_rate', 'tenure', 'emi_amount', 'installment_paid',
+        )
+        updated = 0
+        iterator = rows.iterator(chunk_size=chunk_size)
+        while chunk := list(islice(iterator, chunk_size)):
+            paid = {row[0]: row[5] for row in chunk}
+            amounts = {row[0]: row[1] for row in chunk}
+            loans = []
+            for loan_ids, _, _, _, balance in portfolio_schedules([row[:5] for row in chunk], chunk_size):
+                for i, loan_id in enumerate(loan_ids.tolist()):
+                    installments = min(paid[loan_id], balance.shape[1])
+                    outstanding = from_cents(balance[i, installments - 1]) if installments else amounts[loan_id]
+                    loans.append(Loan(loan_id=loan_id, outstanding_principal=outstanding))
+            Loan.objects.bulk_update(loans, ['outstanding_principal'], batch_size=1000)
+            updated += len(loans)
+        return updated
@@ -3,12 +3,18 @@ from decimal import Decimal
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import OpClass
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Max
+from django.db import models, transaction
+from django.db.models.functions import Upper
 from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 
+from . import portfolio
+from .amortization import installment, loan_schedule, outstanding_balance
+from .catalog import invalidate_catalog, local_lookup
+from .codes import allocate_university_codes
+
 
 # ---------------------------- Personal Loan ---------------------------------------------
 class Loan(models.Model):
@@ -30,6 +36,11 @@ class Loan(models.Model):
     interest_rate = models.DecimalField(decimal_places=2, max_digits=5, null=False, default=10)
     tenure = models.PositiveIntegerField(null=False)
     installment_paid = models.PositiveIntegerField(default=0, null=False)
+    outstanding_principal = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # First day of the month of the last collected installment
+    last_collected_period = models.DateField(null=True, blank=True)
+    # Set by save() when the loan is approved; the first installment is due the month after
+    approved_on = models.DateField(null=True, blank=True)
     status = models.CharField(
         max_length=10,
         choices=LoanStatusChoices.choices,
@@ -43,19 +54,65 @@ class Loan(models.Model):
 
     def save(self, *args, **kwargs):
         self.calculate_emi()
-        super().save(*args, **kwargs)
+        self.outstanding_principal = outstanding_balance(
+            self.amount, self.interest_rate, self.tenure, self.emi_amount, self.installment_paid,
+        )
+        if self.status == self.LoanStatusChoices.APPROVED and self.approved_on is None:
+            self.approved_on = timezone.localdate()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            # The derived fields follow the fields they are computed from
+            derived = {'emi_amount', 'outstanding_principal'}
+            if 'status' in update_fields:
+                derived.add('approved_on')
+            update_fields = kwargs['update_fields'] = {*update_fields, *derived}
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = Loan.objects.select_for_update().filter(pk=self.pk).values(*portfolio.LOAN_FIELDS).first()
+            super().save(*args, **kwargs)
+            current = {field: getattr(self, field) for field in portfolio.LOAN_FIELDS}
+            if update_fields is not None and previous is not None:
+                # Fields left out of the save keep their stored values
+                current.update({field: previous[field] for field in portfolio.LOAN_FIELDS if field not in update_fields})
+            portfolio.record_change(previous, current)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = Loan.objects.select_for_update().filter(pk=self.pk).values(*portfolio.LOAN_FIELDS).first()
+            result = super().delete(*args, **kwargs)
+            portfolio.record_change(previous, None)
+        return result
 
     def calculate_emi(self):
-        P = self.amount
-        r = self.interest_rate / Decimal('100.0') / Decimal('12.0')
-        n = self.tenure
+        self.emi_amount = installment(self.amount, self.interest_rate, self.tenure)
+
+    def schedule(self):
+        ''' Per-installment principal, interest and remaining balance of the loan. '''
+        return loan_schedule(self)
+
+
+class LoanPortfolioAggregate(models.Model):
+    '''
+    Precomputed exposure of the loan book per (type, status, interest bucket, tenure bucket),
+    maintained by `Loan.save` / `Loan.delete` through `loans.portfolio`.
+    '''
+    loan_type = models.CharField(choices=Loan.LOAN_TYPES, max_length=10)
+    status = models.CharField(choices=Loan.LoanStatusChoices.choices, max_length=10)
+    interest_bucket = models.CharField(max_length=10)
+    tenure_bucket = models.CharField(max_length=10)
+    loan_count = models.IntegerField(default=0)
+    total_principal = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    outstanding_principal = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    expected_monthly_emi = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('loan_type', 'status', 'interest_bucket', 'tenure_bucket')
 
-        if n > 0 and r > 0:
-            emi = (P * r * (1 + r) ** n) / ((1 + r) ** n - 1)
-        else:
-            emi = 0
+    def __str__(self):
+        return f"{self.loan_type} / {self.status} / {self.interest_bucket} / {self.tenure_bucket}"
 
-        self.emi_amount = emi.quantize(Decimal('0.01'))
 
     # -------------------------- Home Loan ---------------------------------------------------
 
@@ -78,6 +135,22 @@ class Insurance(models.Model):
     company = models.CharField(max_length=255)
     premium = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidate_catalog('insurance')
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        invalidate_catalog('insurance')
+        return result
+
+    @classmethod
+    def catalog(cls):
+        ''' Every insurance by company and number, keyed by id string; cached. '''
+        return local_lookup('insurance', ('all',), lambda: {
+            str(insurance.pk): insurance for insurance in cls.objects.order_by('company', 'number')
+        })
+
     def __str__(self):
         return f"{self.company} - ${self.premium}"
 
@@ -98,18 +171,47 @@ class HomeLoan(Loan):
 
 
 # ------------------------------- Student Loan ---------------------------------------
+class UniversityQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        ''' Assigns codes to the universities that have none, with one allocation for all. '''
+        objs = list(objs)
+        missing = [university for university in objs if not university.code]
+        for university, code in zip(missing, allocate_university_codes(len(missing))):
+            university.code = code
+        created = super().bulk_create(objs, *args, **kwargs)
+        invalidate_catalog('university')
+        return created
+
+    def search(self, term):
+        ''' Universities whose name starts with `term` (case-insensitive), by name. '''
+        return self.filter(name__istartswith=term).order_by('name')
+
+
 class University(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
 
     # University Info
     name = models.CharField()
-    code = models.IntegerField(blank=True, null=True)
+    code = models.IntegerField(blank=True, null=True, unique=True)
+
+    objects = UniversityQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Backs the case-insensitive prefix search of the university picker
+            models.Index(OpClass(Upper('name'), name='text_pattern_ops'), name='university_name_prefix'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.code:  # Check if code is not already set
-            last_code = University.objects.aggregate(Max('code'))['code__max']
-            self.code = last_code + 1 if last_code else 1001  # Start from 1001 if no entries exist
+            self.code = allocate_university_codes(1)[0]
         super(University, self).save(*args, **kwargs)
+        invalidate_catalog('university')
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        invalidate_catalog('university')
+        return result
 
     def __str__(self):
         return self.name
@@ -0,0 +1,116 @@
+from django.db import connection
+
+# Portfolio analytics are served from loans_loanportfolioaggregate, one row per
+# (loan_type, status, interest bucket, tenure bucket). Every write to a loan applies the
+# difference between its old and new contribution to its row(s) in the same transaction,
+# so reading exposure is a scan of a few dozen rows instead of the whole loan book.
+
+# Upper bounds (exclusive for rates, inclusive for tenures) and their labels
+INTEREST_BUCKETS = ((5, '0-5%'), (8, '5-8%'), (10, '8-10%'), (12, '10-12%'), (15, '12-15%'), (None, '15%+'))
+TENURE_BUCKETS = ((12, '0-12m'), (36, '13-36m'), (60, '37-60m'), (120, '61-120m'), (240, '121-240m'), (None, '240m+'))
+
+DIMENSIONS = ('loan_type', 'status', 'interest_bucket', 'tenure_bucket')
+MEASURES = ('loan_count', 'total_principal', 'outstanding_principal', 'expected_monthly_emi')
+
+# Loan columns a contribution depends on
+LOAN_FIELDS = ('loan_type', 'status', 'interest_rate', 'tenure', 'amount', 'outstanding_principal',
+               'emi_amount', 'installment_paid')
+
+
+def interest_bucket(rate):
+    for bound, label in INTEREST_BUCKETS:
+        if bound is None or rate < bound:
+            return label
+
+
+def tenure_bucket(tenure):
+    for bound, label in TENURE_BUCKETS:
+        if bound is None or tenure <= bound:
+            return label
+
+
+def _bucket_case(column, buckets, operator):
+    # Labels contain '%', which is escaped for statements executed with parameters
+    whens = ' '.join(
+        f"WHEN {column} {operator} {bound} THEN '{label.replace('%', '%%')}'" for bound, label in buckets[:-1]
+    )
+    return f"CASE {whens} ELSE '{buckets[-1][1].replace('%', '%%')}' END"
+
+
+INTEREST_BUCKET_SQL = _bucket_case('interest_rate', INTEREST_BUCKETS, '<')
+TENURE_BUCKET_SQL = _bucket_case('tenure', TENURE_BUCKETS, '<=')
+
+
+def aggregate_upsert_sql(source):
+    '''
+    Returns an INSERT that adds the deltas produced by `source` (a SELECT returning
+    DIMENSIONS followed by MEASURES) onto the aggregate rows. `source` must produce at most
+    one row per aggregate key.
+    '''
+    return f"""
+        INSERT INTO loans_loanportfolioaggregate AS a
+            ({', '.join(DIMENSIONS + MEASURES)}, updated_at)
+        SELECT {', '.join(DIMENSIONS + MEASURES)}, now()
+        FROM ({source}) AS source
+        ON CONFLICT ({', '.join(DIMENSIONS)}) DO UPDATE SET
+            loan_count = a.loan_count + EXCLUDED.loan_count,
+            total_principal = a.total_principal + EXCLUDED.total_principal,
+            outstanding_principal = a.outstanding_principal + EXCLUDED.outstanding_principal,
+            expected_monthly_emi = a.expected_monthly_emi + EXCLUDED.expected_monthly_emi,
+            updated_at = EXCLUDED.updated_at
+    """
+
+
+def contribution(loan):
+    ''' The aggregate key and measures of one loan, given as a dict of LOAN_FIELDS. '''
+    key = (loan['loan_type'], loan['status'],
+           interest_bucket(loan['interest_rate']), tenure_bucket(loan['tenure']))
+    emi = loan['emi_amount'] if loan['installment_paid'] < loan['tenure'] else 0
+    return key, (1, loan['amount'], loan['outstanding_principal'], emi)
+
+
+def record_change(old, new):
+    '''
+    Moves a loan's contribution from `old` to `new` (dicts of LOAN_FIELDS, or None when the
+    loan is being created or deleted). Must run in the transaction that writes the loan.
+    '''
+    deltas = {}
+    for loan, sign in ((old, -1), (new, 1)):
+        if loan is None:
+            continue
+        key, measures = contribution(loan)
+        current = deltas.get(key, (0, 0, 0, 0))
+        deltas[key] = tuple(total + sign * value for total, value in zip(current, measures))
+
+    rows = [key + measures for key, measures in deltas.items() if any(measures)]
+    if not rows:
+        return
+    values = ', '.join(['(%s, %s, %s, %s, %s, %s::numeric, %s::numeric, %s::numeric)'] * len(rows))
+    source = f"SELECT * FROM (VALUES {values}) AS v ({', '.join(DIMENSIONS + MEASURES)})"
+    with connection.cursor() as cursor:
+        cursor.execute(aggregate_upsert_sql(source), [value for row in rows for value in row])
+
+
+REBUILD_SQL = aggregate_upsert_sql(f"""
+    SELECT loan_type, status,
+           {INTEREST_BUCKET_SQL} AS interest_bucket,
+           {TENURE_BUCKET_SQL} AS tenure_bucket,
+           COUNT(*) AS loan_count,
+           SUM(amount) AS total_principal,
+           SUM(outstanding_principal) AS outstanding_principal,
+           SUM(CASE WHEN installment_paid < tenure THEN emi_amount ELSE 0 END) AS expected_monthly_emi
+    FROM loans_loan
+    GROUP BY 1, 2, 3, 4
+""")
+
+
+def rebuild():
+    '''
+    Recomputes every aggregate row from the loan table in one pass; used to seed the table
+    and to repair drift from bulk writes that bypass `Loan.save`. Run inside a transaction.
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute("LOCK TABLE loans_loan IN SHARE MODE")
+        cursor.execute("DELETE FROM loans_loanportfolioaggregate")
+        cursor.execute(REBUILD_SQL, [])
+        return cursor.rowcount
@@ -0,0 +1,67 @@
+import logging
+
+from celery import chord, shared_task
+from django.conf import settings
+from django.db import OperationalError
+from django.utils import timezone
+
+from loans.collection import run_emi_collection
+from transactions.constants import EMI_COLLECTION_JOB, RUN_DONE
+from transactions.models import PostingShard
+from transactions.posting import plan_shards
+from transactions.tasks import complete_shard, finish_posting_run, start_posting_run
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name="collect_emis")
+def collect_emis(run_date=None, shard_size=None, batch_size=None):
+    '''
+    Nightly fan-out of the EMI collection: splits the loan book into loan_id shards and
+    dispatches one `collect_emi_shard` per pending shard. Each night is its own run, so
+    installments that could not be collected are retried by the following nights of the
+    cycle, while a loan is never collected twice in the same cycle.
+    '''
+    logger.info("Running collect_emis task")
+    run_date = run_date or timezone.localdate().isoformat()
+    shard_size = shard_size or settings.EMI_COLLECTION_SHARD_SIZE
+
+    run, pending = start_posting_run(
+        EMI_COLLECTION_JOB, run_date,
+        lambda: plan_shards(shard_size, table='loans_loan', key='loan_id'),
+    )
+    if run.status == RUN_DONE:
+        logger.info("EMI collection run %s already finished, nothing to do", run)
+        return run.pk
+
+    logger.info("Dispatching %s of %s EMI collection shards for %s", len(pending), run.shard_count, run)
+    if pending:
+        chord(
+            collect_emi_shard.s(shard_id, batch_size) for shard_id in pending
+        )(finish_posting_run.si(run.pk))
+    else:
+        finish_posting_run.delay(run.pk)
+    return run.pk
+
+
+@shared_task(
+    name="collect_emi_shard",
+    autoretry_for=(OperationalError,),
+    retry_backoff=True,
+    max_retries=5,
+)
+def collect_emi_shard(shard_id, batch_size=None):
+    ''' Collects one shard of loans, resuming from its checkpoint. '''
+    shard = PostingShard.objects.select_related('run').get(pk=shard_id)
+    if shard.status == RUN_DONE:
+        logger.info("Shard %s already collected, skipping", shard)
+        return shard.transactions_posted
+
+    report = run_emi_collection(
+        batch_size=batch_size,
+        period=shard.run.period.replace(day=1),
+        after=shard.first_account_no,
+        until=shard.last_account_no,
+        shard=shard,
+    )
+    return complete_shard(shard_id, report['elapsed_seconds'])
@@ -1 +1,159 @@
-# Create your tests here.
+import json
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User, CheckingBankAccount
+from banking_system.celery import app
+from transactions import posting
+from transactions.constants import RUN_DONE
+from transactions.models import DailyBalanceSnapshot, PostingRun, Transaction
+from transactions.posting import current_period
+from transactions.reconciliation import reconcile
+from . import portfolio
+from .amortization import outstanding_balance
+from .collection import run_emi_collection
+from .models import Loan, LoanPortfolioAggregate
+from .tasks import collect_emis
+
+AGGREGATE_FIELDS = ('loan_type', 'status', 'interest_bucket', 'tenure_bucket', 'loan_count',
+                    'total_principal', 'outstanding_principal', 'expected_monthly_emi')
+
+
+class LoanSchedulesApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='borrower@mail.com', password='secret')
+        self.loan = Loan.objects.create(user=self.user, amount=Decimal('12000.00'), tenure=12)
+        self.client.force_login(self.user)
+
+    def post(self, loan_ids):
+        return self.client.post(
+            reverse('loans:loan_schedules'), json.dumps({'loan_ids': loan_ids}), content_type='application/json',
+        )
+
+    def test_returns_the_schedules_of_own_loans_only(self):
+        other = User.objects.create_user(email='other@mail.com', password='secret')
+        others = Loan.objects.create(user=other, amount=Decimal('5000.00'), tenure=6)
+
+        response = self.post([self.loan.pk, str(others.pk)])
+
+        self.assertEqual(response.status_code, 200)
+        schedules = response.json()['schedules']
+        self.assertEqual(list(schedules), [str(self.loan.pk)])
+        installments = schedules[str(self.loan.pk)]['installments']
+        self.assertEqual(
+            [(row['number'], Decimal(row['balance'])) for row in installments],
+            [(row['number'], row['balance']) for row in self.loan.schedule()],
+        )
+
+    def test_rejects_ids_that_are_not_loan_ids(self):
+        for loan_ids in (['x'], [{}], [[1]], [1.5], [True], ['-1'], [0], ['²'], [2 ** 63], [None]):
+            with self.subTest(loan_ids=loan_ids):
+                self.assertEqual(self.post(loan_ids).status_code, 400)
+
+
+@contextmanager
+def eager_tasks():
+    ''' Runs Celery tasks, chords included, synchronously in the calling thread. '''
+    app.conf.task_always_eager = True
+    try:
+        yield
+    finally:
+        app.conf.task_always_eager = False
+
+
+class EmiCollectionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='borrower@mail.com', password='secret')
+        self.account = CheckingBankAccount.objects.create(user=self.user, account_type='CHECKING')
+        self.loan = Loan.objects.create(
+            user=self.user, amount=Decimal('12000.00'), tenure=12, status=Loan.LoanStatusChoices.APPROVED,
+        )
+        self.this_month = current_period()
+        self.next_month = (self.this_month + timedelta(days=31)).replace(day=1)
+
+    def fund(self, amount):
+        posting.deposit(self.account, amount)
+
+    def emis(self):
+        return Transaction.objects.filter(account=self.account, transaction_type='EMI')
+
+    def test_nothing_is_collected_in_the_month_of_approval(self):
+        self.fund(Decimal('5000.00'))
+        self.assertEqual(self.loan.approved_on, timezone.localdate())
+
+        report = run_emi_collection(period=self.this_month)
+
+        self.assertEqual(report['transactions_posted'], 0)
+        self.assertFalse(self.emis().exists())
+
+        report = run_emi_collection(period=self.next_month)
+
+        self.assertEqual(report['transactions_posted'], 1)
+        self.loan.refresh_from_db()
+        self.assertEqual((self.loan.installment_paid, self.loan.last_collected_period), (1, self.next_month))
+
+    def test_an_installment_is_collected_once_per_period(self):
+        self.fund(Decimal('5000.00'))
+
+        run_emi_collection(period=self.next_month)
+        run_emi_collection(period=self.next_month)
+
+        self.assertEqual(self.emis().count(), 1)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('5000.00') - self.loan.emi_amount)
+
+        run_emi_collection(period=(self.next_month + timedelta(days=31)).replace(day=1))
+        self.assertEqual(self.emis().count(), 2)
+
+    def test_an_unpaid_installment_stays_due_until_the_account_can_cover_it(self):
+        self.fund(self.loan.emi_amount - Decimal('0.01'))
+
+        self.assertEqual(run_emi_collection(period=self.next_month)['transactions_posted'], 0)
+        self.loan.refresh_from_db()
+        self.assertEqual((self.loan.installment_paid, self.loan.last_collected_period), (0, None))
+
+        self.fund(Decimal('0.01'))
+        self.assertEqual(run_emi_collection(period=self.next_month)['transactions_posted'], 1)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('0.00'))
+
+    def test_collection_keeps_the_journal_snapshots_and_portfolio_consistent(self):
+        self.fund(Decimal('5000.00'))
+
+        run_emi_collection(period=self.next_month)
+
+        report = reconcile()
+        self.assertEqual(report['accounts_mismatched'], 0, report['mismatches'])
+        self.assertEqual(report['entries_unbalanced'], 0, report['unbalanced_entries'])
+        snapshot = DailyBalanceSnapshot.objects.get(account=self.account)
+        self.assertEqual((snapshot.total_debits, snapshot.transaction_count), (self.loan.emi_amount, 2))
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.outstanding_principal, outstanding_balance(
+            self.loan.amount, self.loan.interest_rate, self.loan.tenure, self.loan.emi_amount, 1,
+        ))
+
+        maintained = list(LoanPortfolioAggregate.objects.values_list(*AGGREGATE_FIELDS).order_by(*AGGREGATE_FIELDS))
+        portfolio.rebuild()
+        rebuilt = list(LoanPortfolioAggregate.objects.values_list(*AGGREGATE_FIELDS).order_by(*AGGREGATE_FIELDS))
+        self.assertEqual(maintained, rebuilt)
+
+    def test_nightly_task_runs_every_shard_and_closes_the_run(self):
+        self.fund(Decimal('5000.00'))
+        Loan.objects.filter(pk=self.loan.pk).update(approved_on=self.this_month - timedelta(days=1))
+
+        with eager_tasks():
+            run = PostingRun.objects.get(pk=collect_emis())
+            self.assertEqual((run.status, run.transactions_posted), (RUN_DONE, 1))
+            # The run of the night is finished, so running it again does nothing
+            collect_emis()
+
+        self.assertEqual(self.emis().count(), 1)
+        self.assertTrue(run.shards.exists())
+        self.assertFalse(run.shards.exclude(status=RUN_DONE).exists())
@@ -12,6 +12,12 @@ urlpatterns = [
     path('apply-home-loan/', views.HomeLoanCreateView.as_view(), name='apply_home_loan'),
     path('apply-education-loan/', views.EducationLoanCreateView.as_view(), name='apply_education_loan'),
 
+    path('<int:pk>/schedule/', views.LoanScheduleView.as_view(), name='loan_schedule'),
+    path('schedules/', views.loan_schedules, name='loan_schedules'),
+    path('portfolio/', views.LoanPortfolioView.as_view(), name='loan_portfolio'),
+
+    path('universities/search/', views.university_search, name='university_search'),
     path('add-university/', views.add_universities, name='add_university'),
-    path('save-insurance/', views.save_insurance)
+    path('save-insurance/', views.save_insurance),
+    path('ingest/<str:kind>/', views.ingest_catalog, name='ingest_catalog'),
 ]
@@ -1,19 +1,27 @@
-import json, logging
+import codecs, json, logging
 
+from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.db import transaction, IntegrityError
-from django.db.models import Max
+from django.db.models import Sum
 from django.http import HttpResponse, HttpResponseRedirect
 from django.http import JsonResponse, HttpResponseBadRequest
 from django.shortcuts import render, redirect
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
-from django.views.generic import CreateView, ListView, UpdateView
+from django.views import View
+from django.views.decorators.http import require_GET, require_POST
+from django.views.generic import CreateView, DetailView, ListView, UpdateView
 from django.views.generic.edit import FormView
 
+from banking_system.routers import use_replica
+from . import catalog, ingestion, portfolio
+from .amortization import from_cents, portfolio_schedules
 from .forms import LoanForm, HomeLoanForm, EducationLoanForm
-from .models import Insurance, Loan, University
+from .models import Insurance, Loan, LoanPortfolioAggregate, University
 
 
 logger = logging.getLogger(__name__)
@@ -127,6 +135,7 @@ class PersonalLoanCreateView(LoginRequiredMixin, CreateView):
         return kwargs
 
 
+@method_decorator(use_replica, name='dispatch')
 class LoanListView(ListView):
     model = Loan
     template_name = 'loans/loans_home.html'
@@ -154,6 +163,126 @@ class PersonalLoanUpdateView(UpdateView):
         return response
 
 
+# =========================== Amortization Schedule Views ===============================
+@method_decorator(use_replica, name='dispatch')
+class LoanScheduleView(LoginRequiredMixin, DetailView):
+    model = Loan
+    template_name = 'loans/loan_schedule.html'
+    context_object_name = 'loan'
+
+    def get_queryset(self):
+        return Loan.objects.filter(user=self.request.user)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        schedule = self.object.schedule()
+        context['schedule'] = schedule
+        context['total_interest'] = sum(row['interest'] for row in schedule)
+        context['total_payment'] = sum(row['payment'] for row in schedule)
+        return context
+
+
+MAX_SCHEDULES_PER_REQUEST = 500
+# Largest value of the bigint loan_id
+MAX_LOAN_ID = 2 ** 63 - 1
+
+
+def _parse_loan_ids(values):
+    ''' Returns the loan ids in `values` as ints, or None if one of them is not a loan id. '''
+    loan_ids = []
+    for value in values:
+        # int() would also accept booleans, floats and padded strings
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            return None
+        if isinstance(value, str) and not (value.isascii() and value.isdigit() and len(value) <= 19):
+            return None
+        loan_id = int(value)
+        if not 0 < loan_id <= MAX_LOAN_ID:
+            return None
+        loan_ids.append(loan_id)
+    return loan_ids
+
+
+@use_replica
+@require_POST
+@login_required
+def loan_schedules(request):
+    '''
+    Batch API: returns the amortization schedules of the loans listed in `loan_ids`.
+    Staff can query any loan, other users only their own. Clients send the `csrftoken`
+    cookie value in an X-CSRFToken header.
+    '''
+    try:
+        loan_ids = json.loads(request.body).get('loan_ids')
+    except (json.JSONDecodeError, AttributeError):
+        return HttpResponseBadRequest("Invalid JSON")
+    if not isinstance(loan_ids, list) or not loan_ids:
+        return HttpResponseBadRequest("Expected a non-empty list of loan_ids.")
+    if len(loan_ids) > MAX_SCHEDULES_PER_REQUEST:
+        return HttpResponseBadRequest(f"At most {MAX_SCHEDULES_PER_REQUEST} loans per request.")
+    loan_ids = _parse_loan_ids(loan_ids)
+    if loan_ids is None:
+        return HttpResponseBadRequest("loan_ids must be positive integers.")
+
+    loans = Loan.objects.filter(pk__in=loan_ids)
+    if not request.user.is_staff:
+        loans = loans.filter(user=request.user)
+    rows = list(loans.values_list('loan_id', 'amount', 'interest_rate', 'tenure', 'emi_amount'))
+    loans_by_id = {row[0]: row for row in rows}
+
+    schedules = {}
+    for chunk_ids, payment, principal, interest, balance in portfolio_schedules(rows):
+        for i, loan_id in enumerate(chunk_ids.tolist()):
+            _, amount, interest_rate, tenure, emi_amount = loans_by_id[loan_id]
+            schedules[loan_id] = {
+                'amount': str(amount),
+                'interest_rate': str(interest_rate),
+                'emi_amount': str(emi_amount),
+                'total_interest': str(from_cents(interest[i].sum())),
+                'installments': [
+                    {
+                        'number': k + 1,
+                        'payment': str(from_cents(payment[i, k])),
+                        'principal': str(from_cents(principal[i, k])),
+                        'interest': str(from_cents(interest[i, k])),
+                        'balance': str(from_cents(balance[i, k])),
+                    }
+                    for k in range(tenure)
+                ],
+            }
+    return JsonResponse({'schedules': schedules})
+
+
+# =========================== Portfolio Analytics View ==================================
+@method_decorator(use_replica, name='dispatch')
+class LoanPortfolioView(LoginRequiredMixin, UserPassesTestMixin, View):
+    '''
+    Staff-only JSON view of the loan book's exposure, read from the precomputed aggregates.
+    `?group_by=loan_type,status` picks the dimensions to break the totals down by, and
+    any dimension can be used as a filter (e.g. `?status=Approved`).
+    '''
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request):
+        group_by = [d for d in request.GET.get('group_by', 'loan_type,status').split(',') if d]
+        if any(dimension not in portfolio.DIMENSIONS for dimension in group_by):
+            return HttpResponseBadRequest(f"group_by must be a subset of {', '.join(portfolio.DIMENSIONS)}.")
+
+        aggregates = LoanPortfolioAggregate.objects.filter(
+            loan_count__gt=0,
+            **{dimension: request.GET[dimension] for dimension in portfolio.DIMENSIONS if dimension in request.GET},
+        )
+        measures = {measure: Sum(measure) for measure in portfolio.MEASURES}
+        rows = aggregates.values(*group_by).annotate(**measures).order_by(*group_by)
+        return JsonResponse({
+            'group_by': group_by,
+            'totals': aggregates.aggregate(**measures),
+            'rows': list(rows),
+        })
+
+
 # =========================== Home Loan Views ===========================================
 class HomeLoanCreateView(LoginRequiredMixin, FormView):
     template_name = 'loans/home_loan_form.html'
@@ -306,6 +435,26 @@ def save_insurance(request):
         return HttpResponse(insurance.id, insurance.number)
     
     
+# ========================= University Search API View ======================================
+@login_required
+@require_GET
+def university_search(request):
+    '''
+    Autocomplete for the education-loan form: universities whose name starts with `?q=`.
+    Results are cached per term until the university catalog changes.
+    '''
+    term = ' '.join(request.GET.get('q', '').split())[:100]
+    if len(term) < settings.UNIVERSITY_SEARCH_MIN_LENGTH:
+        return JsonResponse({'results': []})
+
+    limit = settings.UNIVERSITY_SEARCH_LIMIT
+    results = catalog.cached_lookup('university', ('search', term.upper(), limit), lambda: [
+        {'id': str(pk), 'name': name, 'code': code}
+        for pk, name, code in University.objects.search(term).values_list('id', 'name', 'code')[:limit]
+    ])
+    return JsonResponse({'results': results})
+
+
 # ========================= University Post API View ========================================
 @csrf_exempt
 def add_university(request):
@@ -332,17 +481,14 @@ def add_universities(request):
             if not isinstance(data, list):
                 return HttpResponseBadRequest("Expected a list of data.")
 
-            last_code = University.objects.all().aggregate(Max('code'))[
-                            'code__max'] or 1000  # Start from 1000 to increment to 1001 next
-
             universities = []
             for uni_data in data:
                 if 'institution' not in uni_data:
                     return HttpResponseBadRequest("Missing 'institution' in JSON data.")
-                last_code += 1  # Increment code
-                universities.append(University(name=uni_data['institution'], code=last_code))
+                universities.append(University(name=uni_data['institution']))
 
-            University.objects.bulk_create(universities)
+            # Codes for the whole list are reserved in one query by bulk_create
+            University.objects.bulk_create(universities, batch_size=1000)
             response_data = [{"name": uni.name, "code": uni.code} for uni in universities]
             return JsonResponse({"message": "Universities added successfully.", "universities": response_data},
                                 status=201)
@@ -351,3 +497,43 @@ def add_universities(request):
         return HttpResponseBadRequest("Invalid JSON")
     except Exception as e:
         return HttpResponseBadRequest(f"Error saving universities: {str(e)}")
+
+
+# ========================= Bulk Catalog Ingestion API View =================================
+INGESTION_CONTENT_TYPES = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+}
+
+
+@require_POST
+def ingest_catalog(request, kind):
+    '''
+    Streams the request body into the `kind` catalog ('university' or 'insurance').
+    The format comes from `?format=` or the Content-Type (JSON array, NDJSON or CSV);
+    the response reports per-batch throughput and the rejected rows. Staff only.
+
+    The staff session authenticates the upload, so it is CSRF protected: clients send the
+    `csrftoken` cookie value in an X-CSRFToken header. Scripts without a browser session
+    use the ingest_catalog management command.
+    '''
+    if not request.user.is_staff:
+        return JsonResponse({'error': "Staff access required."}, status=403)
+    if kind not in ingestion.SPECS:
+        return JsonResponse({'error': f"Unknown catalog {kind!r}."}, status=404)
+
+    fmt = request.GET.get('format') or INGESTION_CONTENT_TYPES.get(request.content_type)
+    if fmt not in ingestion.FORMATS:
+        return HttpResponseBadRequest(f"Unsupported format, expected one of {', '.join(ingestion.FORMATS)}.")
+    try:
+        batch_size = int(request.GET.get('batch_size', settings.INGESTION_BATCH_SIZE))
+    except ValueError:
+        return HttpResponseBadRequest("batch_size must be an integer.")
+
+    # Reading the request as a stream keeps the body out of memory
+    stream = codecs.getreader(request.encoding or 'utf-8')(request)
+    batch_size = min(max(batch_size, 1), settings.INGESTION_MAX_BATCH_SIZE)
+    report = ingestion.ingest(kind, stream, fmt, batch_size=batch_size)
+    return JsonResponse(report.as_dict(), status=201 if report.inserted else 200)
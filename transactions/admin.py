@@ -1,5 +1,16 @@
 from django.contrib import admin
 
-from transactions.models import Transaction
+from transactions.models import (
+    Transaction, DailyBalanceSnapshot, PostingRun, PostingShard, PostingCheckpoint, TransferBatch,
+    JournalEntry, JournalLeg, BalanceDiscrepancy,
+)
 
 admin.site.register(Transaction)
+admin.site.register(DailyBalanceSnapshot)
+admin.site.register(PostingRun)
+admin.site.register(PostingShard)
+admin.site.register(PostingCheckpoint)
+admin.site.register(TransferBatch)
+admin.site.register(JournalEntry)
+admin.site.register(JournalLeg)
+admin.site.register(BalanceDiscrepancy)
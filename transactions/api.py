@@ -0,0 +1,223 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from functools import wraps
+
+from django.conf import settings
+from django.db import DataError, connection
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET, require_POST
+
+from accounts.models import BankAccount
+from transactions import posting
+from transactions.pagination import InvalidCursor, paginate_keyset
+from transactions.posting import InsufficientFunds
+from transactions.transfers import (
+    DuplicateTransferBatch, TransferError, parse_amount, parse_line, post_transfers,
+)
+from .models import Transaction
+
+# Async JSON API over the posting paths, meant to be served by the ASGI application.
+#
+# Django 5.0's async ORM runs every query through sync_to_async on a thread created for the
+# request, so each request would open (and close) its own connection. The API instead hands
+# its database work, session lookup included, to a fixed pool of threads that keep their
+# connections between requests: the event loop never blocks, and a posting costs its
+# statements and nothing else.
+#
+# The API authenticates with the session cookie, so its POST views are CSRF protected like
+# the forms: clients send the `csrftoken` cookie value back in an X-CSRFToken header.
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_API_DATABASE_THREADS,
+    thread_name_prefix='api-db',
+)
+
+
+def _in_database_thread(func, *args):
+    # What close_old_connections does at the start of a request: a connection that is broken
+    # or older than CONN_MAX_AGE is replaced, and with CONN_HEALTH_CHECKS a reused one is
+    # pinged before its first query
+    connection.close_if_unusable_or_obsolete()
+    return func(*args)
+
+
+async def run_in_database_thread(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, _in_database_thread, func, *args)
+
+
+def api_login_required(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user_id = await run_in_database_thread(
+            lambda: request.user.pk if request.user.is_authenticated else None
+        )
+        if user_id is None:
+            return JsonResponse({'error': "Authentication required."}, status=401)
+        return await view(request, user_id, *args, **kwargs)
+    return wrapper
+
+
+def _account(account_no, user_id):
+    return BankAccount.objects.filter(pk=account_no, user_id=user_id).first()
+
+
+def _transaction_data(posted):
+    return {
+        'id': posted.id,
+        'timestamp': posted.timestamp.isoformat(),
+        'transaction_type': posted.transaction_type,
+        'amount': str(posted.amount),
+        'balance_after_transaction': str(posted.balance_after_transaction),
+    }
+
+
+def _parse_amount(request, minimum):
+    try:
+        value = json.loads(request.body or b'{}')['amount']
+    except (ValueError, KeyError, TypeError):
+        return None, "Expected a JSON object with a decimal 'amount'."
+    try:
+        return parse_amount(value, max(minimum, Decimal('0.01'))), None
+    except TransferError as e:
+        return None, f"{e}."
+
+
+# ================================ Views ======================================================
+@require_GET
+@api_login_required
+async def account_balance(request, user_id, account_no):
+    account = await run_in_database_thread(_account, account_no, user_id)
+    if account is None:
+        return JsonResponse({'error': "Account not found."}, status=404)
+    return JsonResponse({
+        'account_no': account.account_no,
+        'account_type': account.account_type,
+        'balance': str(account.balance),
+    })
+
+
+async def _post(request, user_id, account_no, post, minimum):
+    amount, error = _parse_amount(request, minimum)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+
+    def apply():
+        account = _account(account_no, user_id)
+        if account is None:
+            return None
+        return post(account, amount)
+
+    try:
+        posted = await run_in_database_thread(apply)
+    except InsufficientFunds:
+        return JsonResponse({'error': "Insufficient funds."}, status=409)
+    except DataError:
+        # The balance would overflow its numeric(12, 2) column
+        return JsonResponse({'error': "The balance would exceed the maximum balance."}, status=409)
+    if posted is None:
+        return JsonResponse({'error': "Account not found."}, status=404)
+    return JsonResponse({
+        'account_no': account_no,
+        'balance': str(posted.balance_after_transaction),
+        'transaction': _transaction_data(posted),
+    }, status=201)
+
+
+@require_POST
+@api_login_required
+async def deposit(request, user_id, account_no):
+    return await _post(request, user_id, account_no, posting.deposit, Decimal(settings.MINIMUM_DEPOSIT_AMOUNT))
+
+
+@require_POST
+@api_login_required
+async def withdraw(request, user_id, account_no):
+    return await _post(request, user_id, account_no, posting.withdraw, Decimal('0.01'))
+
+
+@require_GET
+@api_login_required
+async def transaction_history(request, user_id, account_no):
+    '''
+    Newest-first keyset page of an account's transactions; `?after=` / `?before=` take the
+    cursors returned with the previous page.
+    '''
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+    except ValueError:
+        return JsonResponse({'error': "'limit' must be an integer."}, status=400)
+
+    def page():
+        if not BankAccount.objects.filter(pk=account_no, user_id=user_id).exists():
+            return None
+        result = paginate_keyset(
+            Transaction.objects.filter(account_id=account_no), limit,
+            after=request.GET.get('after'), before=request.GET.get('before'),
+        )
+        return {
+            'transactions': [_transaction_data(posted) for posted in result],
+            'next': result.next_cursor,
+            'previous': result.previous_cursor,
+        }
+
+    try:
+        data = await run_in_database_thread(page)
+    except InvalidCursor:
+        return JsonResponse({'error': "Invalid page cursor."}, status=400)
+    if data is None:
+        return JsonResponse({'error': "Account not found."}, status=404)
+    return JsonResponse(data)
+
+
+def _parse_transfers(request):
+    try:
+        payload = json.loads(request.body or b'{}')
+        transfers = payload['transfers']
+        reference = payload.get('reference')
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None, None, "Expected a JSON object with a 'transfers' list."
+    if not isinstance(transfers, list) or not transfers:
+        return None, None, "'transfers' must be a non-empty list."
+    if len(transfers) > settings.TRANSFER_API_MAX_LINES:
+        return None, None, f"At most {settings.TRANSFER_API_MAX_LINES} transfers per batch."
+    if reference is not None and (not isinstance(reference, str) or not 0 < len(reference) <= 64):
+        return None, None, "'reference' must be a string of at most 64 characters."
+
+    lines = []
+    for line_number, item in enumerate(transfers, 1):
+        try:
+            lines.append((line_number, parse_line(item['debit_account'], item['credit_account'], item['amount'])))
+        except (KeyError, TypeError):
+            lines.append((line_number, TransferError("Expected debit_account, credit_account and amount")))
+        except TransferError as e:
+            lines.append((line_number, e))
+    return lines, reference, None
+
+
+@require_POST
+@api_login_required
+async def transfers(request, user_id):
+    '''
+    Posts a batch of transfers debiting the user's accounts, given as `{"reference": ...,
+    "transfers": [{"debit_account", "credit_account", "amount"}, ...]}`, and returns the
+    result of every line.
+    '''
+    lines, reference, error = _parse_transfers(request)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+    try:
+        report = await run_in_database_thread(
+            lambda: post_transfers(lines, reference=reference, owner=request.user)
+        )
+    except DuplicateTransferBatch as e:
+        return JsonResponse({'error': str(e)}, status=409)
+    return JsonResponse({
+        **report.as_dict(),
+        'total_amount': str(report.total_amount),
+        'results': [
+            {**result, 'amount': None if result['amount'] is None else str(result['amount'])}
+            for result in report.results
+        ],
+    }, status=201)
@@ -1,7 +1,62 @@
 
+DEPOSIT = "DEPOSIT"
+WITHDRAWAL = "WITHDRAWAL"
+TRANSFER = "TRANSFER"
+
 TRANSACTION_TYPE_CHOICES = (
     ("DEPOSIT", 'Deposit'),
     ("WITHDRAWAL", 'Withdrawal'),
     ("INTEREST", 'Interest'),
-    ("CHARGES", "Charges")
+    ("CHARGES", "Charges"),
+    ("EMI", "Loan Installment"),
+    ("TRANSFER", "Transfer"),
+)
+
+OPENING = "OPENING"
+
+JOURNAL_ENTRY_TYPE_CHOICES = TRANSACTION_TYPE_CHOICES + (
+    (OPENING, "Opening Balance"),
+)
+
+# Internal ledger accounts on the other side of the journal entries of customer postings
+LEDGER_CASH = 'cash'
+LEDGER_INTEREST = 'interest'
+LEDGER_FEES = 'fees'
+LEDGER_LOANS = 'loans'
+LEDGER_OPENING = 'opening'
+
+LEDGER_BY_TRANSACTION_TYPE = {
+    "DEPOSIT": LEDGER_CASH,
+    "WITHDRAWAL": LEDGER_CASH,
+    "INTEREST": LEDGER_INTEREST,
+    "CHARGES": LEDGER_FEES,
+    "EMI": LEDGER_LOANS,
+}
+
+# Transaction types that take money out of the account. CHARGES are stored as negative
+# amounts and WITHDRAW is the type older withdrawals were recorded with. TRANSFERs go both
+# ways: their debit legs are stored as negative amounts.
+DEBIT_TRANSACTION_TYPES = ("WITHDRAWAL", "WITHDRAW", "CHARGES", "EMI")
+
+RUN_PENDING = 'PENDING'
+RUN_RUNNING = 'RUNNING'
+RUN_DONE = 'DONE'
+
+RUN_STATUS_CHOICES = (
+    (RUN_PENDING, 'Pending'),
+    (RUN_RUNNING, 'Running'),
+    (RUN_DONE, 'Done'),
+)
+
+MONTH_END_JOB = 'month_end'
+EMI_COLLECTION_JOB = 'emi_collection'
+RECONCILIATION_JOB = 'reconciliation'
+
+# What a stored balance was found to disagree with by the nightly reconciliation
+DISCREPANCY_JOURNAL = 'journal'
+DISCREPANCY_SNAPSHOT = 'snapshot'
+
+DISCREPANCY_KIND_CHOICES = (
+    (DISCREPANCY_JOURNAL, 'Sum of journal legs'),
+    (DISCREPANCY_SNAPSHOT, 'Latest daily closing balance'),
 )
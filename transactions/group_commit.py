@@ -0,0 +1,94 @@
+import copy
+import threading
+
+
+class _Batch:
+    def __init__(self, key):
+        self.key = key
+        self.items = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+def _raise_copy(error):
+    # Every waiter raises its own copy: raising one shared exception object from several
+    # threads at once would make them overwrite each other's __traceback__
+    try:
+        fresh = copy.copy(error)
+    except Exception:
+        fresh = RuntimeError(f"Group commit failed: {error!r}")
+    raise fresh from error
+
+
+class GroupCommitter:
+    '''
+    Collects concurrent submissions for the same key (an account number) into
+    micro-batches that are applied with a single call to `apply_batch(key, items)`.
+
+    The first thread to submit for a key becomes the batch leader. If other submissions
+    for the key are in flight (joined followers, or an earlier batch still being applied),
+    it waits up to `max_latency` seconds (or until `max_batch_size` items have joined);
+    a submission that is alone is applied at once. The leader then applies the whole batch
+    on its own database connection and wakes up the followers. Every submitter gets back
+    the result for its own item, so each posting is acknowledged individually.
+    `apply_batch` must return one result per item; results that are exceptions are raised
+    in the thread that submitted the item.
+
+    Batches only form between threads of one process, so there is nothing to gain with
+    single-threaded workers.
+    '''
+
+    def __init__(self, apply_batch, max_latency, max_batch_size):
+        self.apply_batch = apply_batch
+        self.max_latency = max_latency
+        self.max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        self._open = {}
+        # Submissions per key that have not returned yet
+        self._in_flight = {}
+
+    def submit(self, key, item):
+        with self._lock:
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+            batch = self._open.get(key)
+            is_leader = batch is None
+            if is_leader:
+                batch = self._open[key] = _Batch(key)
+            index = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= self.max_batch_size:
+                # Close the batch so the next submitter starts a new one
+                del self._open[key]
+                batch.full.set()
+
+        try:
+            if is_leader:
+                with self._lock:
+                    contended = self._in_flight[key] > 1
+                if contended:
+                    batch.full.wait(self.max_latency)
+                with self._lock:
+                    if self._open.get(key) is batch:
+                        del self._open[key]
+                try:
+                    batch.results = self.apply_batch(key, batch.items)
+                except Exception as e:
+                    batch.error = e
+                finally:
+                    batch.done.set()
+            else:
+                batch.done.wait()
+        finally:
+            with self._lock:
+                self._in_flight[key] -= 1
+                if not self._in_flight[key]:
+                    del self._in_flight[key]
+
+        if batch.error is not None:
+            _raise_copy(batch.error)
+        result = batch.results[index]
+        if isinstance(result, Exception):
+            raise result
+        return result
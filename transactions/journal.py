@@ -0,0 +1,91 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .constants import LEDGER_OPENING, OPENING
+
+# Double-entry journal of every balance change. Each posting path writes, in the same
+# statement as its balance UPDATE, one JournalEntry per movement with two legs that add up
+# to zero: the movement on the customer account and the opposite movement on the other
+# side, which is a second customer account for transfers and an internal ledger (cash,
+# interest, fees, loans) otherwise. The journal is append-only, and
+# `BankAccount.balance` is a projection of it: the sum of the legs of the account, as
+# verified by transactions.reconciliation.
+#
+# Balances that predate the journal are brought in by one OPENING entry per account
+# (`open_accounts`), written once when the journal is deployed and when an account is
+# created with a non-zero balance.
+
+ENTRY_ID_SQL = "nextval(pg_get_serial_sequence('transactions_journalentry', 'id'))"
+
+
+def journal_sql(source):
+    '''
+    Returns the CTEs (for a WITH list) writing one journal entry per row of `source`, a
+    SELECT producing `account_no, delta, entry_type, contra_account, contra_ledger` rows:
+    `delta` is moved on the account and `-delta` on either the contra account or the contra
+    ledger (the other one being NULL). The entries are stamped with the `now` parameter.
+    '''
+    return f"""
+        journal AS MATERIALIZED (
+            SELECT {ENTRY_ID_SQL} AS entry_id, source.*
+            FROM ({source}) AS source
+        ),
+        journal_entries AS (
+            INSERT INTO transactions_journalentry (id, entry_type, timestamp)
+            SELECT entry_id, entry_type, %(now)s FROM journal
+        ),
+        journal_legs AS (
+            INSERT INTO transactions_journalleg (entry_id, account_id, ledger, amount)
+            SELECT entry_id, account_no, NULL, delta FROM journal
+            UNION ALL
+            SELECT entry_id, contra_account, contra_ledger, -delta FROM journal
+        )
+    """
+
+
+def ledger_source(source, entry_type, ledger):
+    '''
+    Adapts a SELECT producing `account_no, delta` rows to `journal_sql`, with `ledger` on
+    the other side of every entry.
+    '''
+    return (
+        f"SELECT account_no, delta, '{entry_type}'::text AS entry_type, NULL::bigint AS contra_account, "
+        f"'{ledger}'::text AS contra_ledger FROM ({source}) AS movements"
+    )
+
+
+# ================================ Opening balances ===========================================
+OPEN_ACCOUNTS_SQL = f"""
+    WITH unopened AS (
+        SELECT a.account_no, a.balance
+        FROM accounts_bankaccount a
+        WHERE a.account_no > %(after)s AND a.account_no <= %(until)s
+          AND NOT EXISTS (
+              SELECT 1
+              FROM transactions_journalleg l
+              JOIN transactions_journalentry e ON e.id = l.entry_id
+              WHERE l.account_id = a.account_no AND e.entry_type = '{OPENING}'
+          )
+        ORDER BY a.account_no
+        FOR UPDATE OF a
+    ),
+    opening AS (
+        SELECT u.account_no, u.balance - COALESCE(SUM(l.amount), 0) AS delta
+        FROM unopened u
+        LEFT JOIN transactions_journalleg l ON l.account_id = u.account_no
+        GROUP BY u.account_no, u.balance
+    ),
+    {journal_sql(ledger_source("SELECT account_no, delta FROM opening WHERE delta <> 0", OPENING, LEDGER_OPENING))}
+    SELECT COUNT(*) FROM journal
+"""
+
+
+def open_accounts(after, until):
+    '''
+    Writes an OPENING entry for every account in (`after`, `until`] whose balance is not
+    yet accounted for by the journal, for the part of the balance that is missing from it.
+    Accounts that already have one are left alone. Returns the number of entries written.
+    '''
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(OPEN_ACCOUNTS_SQL, {'after': after, 'until': until, 'now': timezone.now()})
+        return cursor.fetchone()[0]
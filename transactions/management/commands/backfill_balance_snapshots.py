@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from transactions.posting import plan_shards
+from transactions.snapshots import backfill_snapshots
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the daily balance snapshots of every account from its transaction history."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help="Number of accounts rebuilt per statement",
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        written = 0
+        chunks = plan_shards(options['chunk_size'])
+
+        for index, (after, until) in enumerate(chunks, start=1):
+            written += backfill_snapshots(after, until)
+            self.stdout.write(f"[{index}/{len(chunks)}] accounts ({after}, {until}]: {written} snapshots")
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} snapshots in {elapsed:.2f}s"))
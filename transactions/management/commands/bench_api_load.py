@@ -0,0 +1,182 @@
+import asyncio
+import json
+import secrets
+import time
+from decimal import Decimal
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand
+
+from accounts.models import BankAccount, User
+from transactions import posting
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test of deposits and withdrawals against a running server: `--target api` uses "
+        "the async JSON API (serve banking_system.asgi with uvicorn), `--target form` posts "
+        "the DepositView/WithdrawView forms (serve banking_system.wsgi with gunicorn). Every "
+        "client keeps one HTTP connection open and alternates deposits and withdrawals on "
+        "one of the benchmark accounts; reports requests/s and latency percentiles."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help="Base URL of the server, e.g. http://127.0.0.1:8000")
+        parser.add_argument('--target', choices=('api', 'form'), default='api')
+        parser.add_argument('--clients', type=int, default=2000, help="Concurrent connections")
+        parser.add_argument('--duration', type=float, default=20, help="Seconds of load")
+        parser.add_argument('--accounts', type=int, default=200, help="Accounts the clients spread over")
+        parser.add_argument('--timeout', type=float, default=10, help="Seconds before a request counts as failed")
+        parser.add_argument('--email', default='loadtest@bench.local')
+
+    def handle(self, *args, **options):
+        accounts = self.prepare_accounts(options['email'], options['accounts'])
+        session_key = self.login(options['email'])
+        csrf_token = secrets.token_hex(16)
+        self.cookie = f"sessionid={session_key}; csrftoken={csrf_token}"
+        self.csrf_token = csrf_token
+
+        results = asyncio.run(self.load(options, accounts))
+        self.report(options, results)
+
+    def prepare_accounts(self, email, count):
+        user, created = User.objects.get_or_create(email=email)
+        if created:
+            user.set_unusable_password()
+            user.save()
+        existing = list(BankAccount.objects.filter(user=user).values_list('pk', flat=True)[:count])
+        missing = count - len(existing)
+        if missing > 0:
+            created = BankAccount.objects.bulk_create(
+                BankAccount(user=user, account_type='CHECKING') for _ in range(missing)
+            )
+            # Funded through the posting path, so the journal accounts for the balance
+            for account in created:
+                posting.deposit(account, Decimal('100000.00'))
+            existing += [account.pk for account in created]
+        return existing
+
+    def login(self, email):
+        user = User.objects.get(email=email)
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.save()
+        return session.session_key
+
+    # ================================ Load =================================================
+    def request(self, target, account_no, deposit):
+        action = 'deposit' if deposit else 'withdraw'
+        if target == 'api':
+            path = f"/transactions/api/accounts/{account_no}/{action}/"
+            body = json.dumps({'amount': '10.00'}).encode()
+            content_type = 'application/json'
+        else:
+            path = f"/transactions/{action}/{account_no}/"
+            body = f"amount=10.00&transaction_type={'DEPOSIT' if deposit else 'WITHDRAWAL'}".encode()
+            content_type = 'application/x-www-form-urlencoded'
+        return (
+            f"POST {path} HTTP/1.1\r\n"
+            f"Host: {self.host}\r\n"
+            f"Cookie: {self.cookie}\r\n"
+            f"X-CSRFToken: {self.csrf_token}\r\n"
+            f"Referer: {self.base_url}/\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"\r\n"
+        ).encode() + body
+
+    async def read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by the server")
+        status = int(status_line.split()[1])
+        length, chunked, close = 0, False, False
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'transfer-encoding':
+                chunked = 'chunked' in value
+            elif name == 'connection':
+                close = value == 'close'
+        if chunked:
+            while True:
+                size = int((await reader.readline()).strip(), 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif length:
+            await reader.readexactly(length)
+        return status, close
+
+    async def client(self, index, options, accounts, deadline, results):
+        account_no = accounts[index % len(accounts)]
+        reader = writer = None
+        deposit = True
+        while time.monotonic() < deadline:
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.wait_for(
+                        asyncio.open_connection(self.hostname, self.port), options['timeout'],
+                    )
+                started = time.perf_counter()
+                writer.write(self.request(options['target'], account_no, deposit))
+                status, close = await asyncio.wait_for(self.read_response(reader), options['timeout'])
+                results['latencies'].append(time.perf_counter() - started)
+                # 201: API posting, 302: form redirect after a posting
+                if status not in (201, 302):
+                    results['errors'] += 1
+                deposit = not deposit
+                if close:
+                    writer.close()
+                    writer = None
+            except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+                results['errors'] += 1
+                if writer is not None:
+                    writer.close()
+                writer = None
+                await asyncio.sleep(0.05)
+        if writer is not None:
+            writer.close()
+
+    async def load(self, options, accounts):
+        parts = urlsplit(options['url'])
+        self.base_url = options['url'].rstrip('/')
+        self.hostname = parts.hostname
+        self.port = parts.port or 80
+        self.host = parts.netloc
+
+        results = {'latencies': [], 'errors': 0}
+        started = time.monotonic()
+        deadline = started + options['duration']
+        await asyncio.gather(*(
+            self.client(index, options, accounts, deadline, results)
+            for index in range(options['clients'])
+        ))
+        results['elapsed'] = time.monotonic() - started
+        return results
+
+    def report(self, options, results):
+        latencies = sorted(results['latencies'])
+        if not latencies:
+            self.stderr.write(f"No request completed, {results['errors']} errors")
+            return
+
+        def percentile(fraction):
+            return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{options['target']}: {options['clients']} clients, {len(latencies)} requests in "
+            f"{results['elapsed']:.1f}s = {len(latencies) / results['elapsed']:.0f} req/s, "
+            f"p50 {percentile(0.50):.1f} ms, p99 {percentile(0.99):.1f} ms, "
+            f"max {latencies[-1] * 1000:.1f} ms, {results['errors']} errors"
+        ))
@@ -0,0 +1,123 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from accounts.models import BankAccount
+from transactions import posting
+from transactions.constants import DEPOSIT, WITHDRAWAL
+from transactions.models import Transaction
+from transactions.posting import InsufficientFunds
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammers a single account with concurrent deposits and withdrawals from many threads, "
+        "then reports throughput and checks that no update was lost."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('account_no', type=int)
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--postings', type=int, default=200, help="Postings per thread")
+        parser.add_argument('--amount', type=Decimal, default=Decimal('10.00'))
+        parser.add_argument(
+            '--naive', action='store_true',
+            help="Use the old read-modify-write path (load, add in Python, save) for comparison; "
+                 "it bypasses the journal, so reconcile_journal reports the account afterwards",
+        )
+        parser.add_argument(
+            '--group-commit', action='store_true',
+            help="Enable POSTING_GROUP_COMMIT for the run",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            account = BankAccount.objects.get(pk=options['account_no'])
+        except BankAccount.DoesNotExist:
+            raise CommandError(f"Account {options['account_no']} does not exist")
+
+        amount = options['amount']
+        threads = options['threads']
+        postings = options['postings']
+        post = self.naive_post if options['naive'] else self.post
+
+        opening_balance = account.balance
+        opening_count = Transaction.objects.filter(account=account).count()
+        results = {'deposited': Decimal('0.00'), 'withdrawn': Decimal('0.00'), 'rejected': 0}
+        lock = threading.Lock()
+
+        def worker(index):
+            deposited = withdrawn = Decimal('0.00')
+            rejected = 0
+            try:
+                for i in range(postings):
+                    # Alternate directions so the balance stays around its opening value
+                    is_deposit = (index + i) % 2 == 0
+                    try:
+                        post(account.pk, amount, is_deposit)
+                    except InsufficientFunds:
+                        rejected += 1
+                        continue
+                    if is_deposit:
+                        deposited += amount
+                    else:
+                        withdrawn += amount
+            finally:
+                connection.close()
+            with lock:
+                results['deposited'] += deposited
+                results['withdrawn'] += withdrawn
+                results['rejected'] += rejected
+
+        started = time.monotonic()
+        with override_settings(POSTING_GROUP_COMMIT=options['group_commit']):
+            workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+        elapsed = time.monotonic() - started
+
+        account.refresh_from_db()
+        expected_balance = opening_balance + results['deposited'] - results['withdrawn']
+        posted = Transaction.objects.filter(account=account).count() - opening_count
+        attempted = threads * postings
+
+        self.stdout.write(f"Threads:            {threads}")
+        self.stdout.write(f"Postings attempted: {attempted} ({results['rejected']} rejected)")
+        self.stdout.write(f"Elapsed:            {elapsed:.3f}s")
+        self.stdout.write(f"Throughput:         {attempted / elapsed:.1f} postings/s")
+        self.stdout.write(f"Expected balance:   {expected_balance}")
+        self.stdout.write(f"Actual balance:     {account.balance}")
+        self.stdout.write(f"Transactions:       {posted} written")
+
+        if account.balance != expected_balance or posted != attempted - results['rejected']:
+            raise CommandError("Lost updates detected: balance does not match the applied postings")
+        self.stdout.write(self.style.SUCCESS("No lost updates"))
+
+    @staticmethod
+    def post(account_no, amount, is_deposit):
+        account = BankAccount(pk=account_no)
+        if is_deposit:
+            posting.deposit(account, amount)
+        else:
+            posting.withdraw(account, amount)
+
+    @staticmethod
+    def naive_post(account_no, amount, is_deposit):
+        with transaction.atomic():
+            account = BankAccount.objects.get(pk=account_no)
+            if not is_deposit and account.balance < amount:
+                raise InsufficientFunds()
+            account.balance += amount if is_deposit else -amount
+            Transaction.objects.create(
+                account=account,
+                amount=amount,
+                balance_after_transaction=account.balance,
+                transaction_type=DEPOSIT if is_deposit else WITHDRAWAL,
+            )
+            account.save()
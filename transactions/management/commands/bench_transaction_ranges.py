@@ -0,0 +1,80 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Max, Min, Sum
+from django.utils import timezone
+
+from transactions import partitions
+from transactions.models import Transaction
+from transactions.pagination import paginate_keyset
+from transactions.views import start_of_day
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the latency of date-range queries on the transactions table: one account's "
+        "history page (as served by the transaction list) and a book-wide monthly total. "
+        "Run it before and after `partition_transactions --convert` to compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=200, help="Queries per scenario")
+        parser.add_argument('--days', type=int, default=30, help="Width of the date range")
+        parser.add_argument('--page-size', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        bounds = Transaction.objects.aggregate(first=Min('timestamp'), last=Max('timestamp'))
+        if bounds['first'] is None:
+            raise CommandError("There are no transactions to query")
+        account_nos = list(Transaction.objects.values_list('account_id', flat=True).distinct()[:10000])
+
+        rng = random.Random(options['seed'])
+        width = timedelta(days=options['days'])
+        first_day = timezone.localtime(bounds['first']).date()
+        span = max((timezone.localtime(bounds['last']).date() - first_day).days - options['days'], 0)
+
+        def random_range():
+            start = first_day + timedelta(days=rng.randint(0, span))
+            return start_of_day(start), start_of_day(start + width)
+
+        def history_page():
+            start, end = random_range()
+            queryset = Transaction.objects.filter(
+                account_id=rng.choice(account_nos), timestamp__gte=start, timestamp__lt=end,
+            )
+            paginate_keyset(queryset, options['page_size'])
+
+        def monthly_total():
+            start, end = random_range()
+            Transaction.objects.filter(timestamp__gte=start, timestamp__lt=end).aggregate(
+                total=Sum('amount'), count=Count('id'),
+            )
+
+        layout = (
+            f"partitioned ({len(partitions.list_partitions())} partitions)"
+            if partitions.is_partitioned() else "single table"
+        )
+        self.stdout.write(f"Table layout: {layout}, {options['days']}-day ranges")
+        for name, query in (('history page', history_page), ('range total', monthly_total)):
+            self.report(name, self.measure(query, options['queries']))
+
+    @staticmethod
+    def measure(query, count):
+        query()  # warm up the connection and the plan cache
+        latencies = []
+        for _ in range(count):
+            started = time.perf_counter()
+            query()
+            latencies.append((time.perf_counter() - started) * 1000)
+        return sorted(latencies)
+
+    def report(self, name, latencies):
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(
+            f"{name:<14} mean {statistics.mean(latencies):8.2f} ms   "
+            f"p50 {statistics.median(latencies):8.2f} ms   p95 {p95:8.2f} ms"
+        )
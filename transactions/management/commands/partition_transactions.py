@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Manages the monthly partitions of the transactions table: converts it to a "
+        "partitioned table, pre-creates future partitions and detaches old ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convert', action='store_true',
+            help="Convert the plain transactions table to a partitioned one (locks the table)",
+        )
+        parser.add_argument(
+            '--months-ahead', type=int, default=settings.TRANSACTION_PARTITION_MONTHS_AHEAD,
+            help="Number of future monthly partitions to keep ready",
+        )
+        parser.add_argument(
+            '--retain-months', type=int, default=settings.TRANSACTION_PARTITION_RETENTION_MONTHS,
+            help="Detach and archive partitions older than this many months",
+        )
+
+    def handle(self, *args, **options):
+        if options['convert']:
+            if partitions.is_partitioned():
+                raise CommandError("The transactions table is already partitioned")
+            copied = partitions.convert_to_partitioned(options['months_ahead'])
+            self.stdout.write(f"Converted the transactions table ({copied} rows copied)")
+        elif not partitions.is_partitioned():
+            raise CommandError("The transactions table is not partitioned, run with --convert first")
+
+        for name in partitions.ensure_future_partitions(options['months_ahead']):
+            self.stdout.write(f"Partition ready: {name}")
+
+        if options['retain_months'] is not None:
+            for name in partitions.detach_old_partitions(options['retain_months']):
+                self.stdout.write(f"Detached: {name}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(partitions.list_partitions())} partitions attached"
+        ))
@@ -0,0 +1,38 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from transactions.transfers import REJECTED, DuplicateTransferBatch, iter_transfer_file, post_transfers
+
+
+class Command(BaseCommand):
+    help = (
+        "Posts a CSV file of debit_account,credit_account,amount lines (e.g. a payroll) as one "
+        "batch of transfers and reports throughput and the result of every line."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--reference', help="Unique reference of the batch; a batch is posted once per reference")
+        parser.add_argument('--results', help="Write the result of every line to this CSV file")
+        parser.add_argument('--max-rejects', type=int, default=20, help="Rejected lines listed in the report")
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], encoding='utf-8', newline='') as stream:
+                report = post_transfers(iter_transfer_file(stream), reference=options['reference'])
+        except (OSError, DuplicateTransferBatch) as e:
+            raise CommandError(str(e))
+
+        if options['results']:
+            with open(options['results'], 'w', encoding='utf-8', newline='') as out:
+                writer = csv.DictWriter(out, fieldnames=list(report.results[0]) if report.results else ['line'])
+                writer.writeheader()
+                writer.writerows(report.results)
+
+        rejected = [result for result in report.results if result['status'] == REJECTED]
+        for result in rejected[:options['max_rejects']]:
+            self.stderr.write(f"line {result['line']}: {result['error']}")
+        self.stdout.write(self.style.SUCCESS(json.dumps(report.as_dict(), cls=DjangoJSONEncoder)))
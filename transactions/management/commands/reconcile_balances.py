@@ -0,0 +1,59 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from transactions.constants import RECONCILIATION_JOB
+from transactions.models import BalanceDiscrepancy
+from transactions.posting import plan_shards
+from transactions.tasks import (
+    finish_posting_run, reconcile_balance_shard, reconcile_balances, start_posting_run,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the nightly balance reconciliation: dispatches it to the Celery workers, or with "
+        "--sync checks every shard in this process, and reports the discrepancies recorded."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Night to reconcile (ISO date), defaults to today")
+        parser.add_argument('--shard-size', type=int, default=settings.RECONCILIATION_SHARD_SIZE)
+        parser.add_argument('--batch-size', type=int, default=settings.RECONCILIATION_CHUNK_SIZE)
+        parser.add_argument('--sync', action='store_true', help="Run the shards here instead of on the workers")
+        parser.add_argument('--max-listed', type=int, default=20, help="Discrepancies listed in the report")
+
+    def handle(self, *args, **options):
+        checked_on = options['date'] or timezone.localdate().isoformat()
+        if not options['sync']:
+            run_id = reconcile_balances.delay(checked_on, options['shard_size'], options['batch_size'])
+            self.stdout.write(f"Dispatched the reconciliation of {checked_on} ({run_id})")
+            return
+
+        started = time.monotonic()
+        run, pending = start_posting_run(
+            RECONCILIATION_JOB, checked_on, lambda: plan_shards(options['shard_size']),
+        )
+        for index, shard_id in enumerate(pending, start=1):
+            found = reconcile_balance_shard(shard_id, options['batch_size'])
+            self.stdout.write(f"[{index}/{len(pending)}] shard {shard_id}: {found} discrepancies")
+        result = finish_posting_run(run.pk)
+        elapsed = time.monotonic() - started
+
+        discrepancies = BalanceDiscrepancy.objects.filter(checked_on=checked_on)
+        for discrepancy in discrepancies[:options['max_listed']]:
+            self.stderr.write(
+                f"account {discrepancy.account_no}: balance {discrepancy.balance}, "
+                f"{discrepancy.get_kind_display().lower()} {discrepancy.expected}"
+            )
+        self.stdout.write(self.style.SUCCESS(json.dumps({
+            'checked_on': checked_on,
+            'accounts_checked': result['accounts_scanned'],
+            'discrepancies': discrepancies.count(),
+            'shards': run.shard_count,
+            'elapsed_seconds': round(elapsed, 3),
+            'accounts_per_second': round(result['accounts_scanned'] / elapsed, 1) if elapsed > 0 else 0.0,
+        })))
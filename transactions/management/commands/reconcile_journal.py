@@ -0,0 +1,58 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from transactions.journal import open_accounts
+from transactions.posting import plan_shards
+from transactions.reconciliation import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifies that every account balance equals the sum of its journal legs and that "
+        "every journal entry is balanced. Exits with an error when anything does not match."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=settings.RECONCILIATION_CHUNK_SIZE)
+        parser.add_argument('--no-entries', action='store_true', help="Only reconcile the account balances")
+        parser.add_argument(
+            '--open', action='store_true',
+            help="First write OPENING entries for the balances that predate the journal",
+        )
+        parser.add_argument('--max-listed', type=int, default=20, help="Inconsistencies listed in the report")
+
+    def handle(self, *args, **options):
+        if options['open']:
+            opened = sum(open_accounts(after, until) for after, until in plan_shards(options['chunk_size']))
+            self.stdout.write(f"Wrote {opened} opening entries")
+
+        def on_chunk(kind, index, count, report):
+            self.stdout.write(
+                f"[{index}/{count}] {kind}: {report[kind + '_checked']} checked, "
+                f"{report['accounts_mismatched'] if kind == 'accounts' else report['entries_unbalanced']} inconsistent"
+            )
+
+        report = reconcile(
+            options['chunk_size'],
+            entries=not options['no_entries'],
+            max_listed=options['max_listed'],
+            on_chunk=on_chunk,
+        )
+        for mismatch in report.pop('mismatches'):
+            self.stderr.write(
+                f"account {mismatch['account_no']}: balance {mismatch['balance']}, "
+                f"journal {mismatch['journal_balance']} (difference {mismatch['difference']})"
+            )
+        for entry_id in report.pop('unbalanced_entries'):
+            self.stderr.write(f"entry {entry_id} is not balanced")
+
+        self.stdout.write(json.dumps(report, cls=DjangoJSONEncoder))
+        if report['accounts_mismatched'] or report['entries_unbalanced']:
+            raise CommandError(
+                f"{report['accounts_mismatched']} accounts and {report['entries_unbalanced']} "
+                "journal entries are inconsistent"
+            )
+        self.stdout.write(self.style.SUCCESS("The journal reconciles"))
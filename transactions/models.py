@@ -1,8 +1,12 @@
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
 
 from accounts.models import BankAccount
-from .constants import TRANSACTION_TYPE_CHOICES
+from .constants import (
+    TRANSACTION_TYPE_CHOICES, JOURNAL_ENTRY_TYPE_CHOICES, RUN_STATUS_CHOICES, RUN_PENDING,
+    DISCREPANCY_KIND_CHOICES,
+)
 
 
 class Transaction(models.Model):
@@ -21,9 +25,231 @@ class Transaction(models.Model):
     )
     transaction_type = models.CharField(choices=TRANSACTION_TYPE_CHOICES, max_length=10)
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Set only on periodic postings (interest, charges) to the first day of their month
+    period = models.DateField(null=True, blank=True)
 
     def __str__(self):
         return str(self.account.account_no)
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # Backs the keyset-paginated history of an account (newest first)
+            models.Index(fields=['account', '-timestamp', '-id'], name='transaction_account_history'),
+        ]
+        constraints = [
+            # An account can receive at most one periodic posting of each type per period,
+            # which makes re-running a month-end batch a no-op instead of a double credit.
+            models.UniqueConstraint(
+                fields=['account', 'transaction_type', 'period'],
+                condition=models.Q(period__isnull=False),
+                name='unique_periodic_posting',
+            ),
+        ]
+
+
+class DailyBalanceSnapshot(models.Model):
+    '''
+    Per-account, per-day balance summary, kept up to date by every posting path, so that
+    "balance at date D" is a single indexed lookup instead of a scan of the history.
+    '''
+    account = models.ForeignKey(
+        BankAccount,
+        related_name='daily_balances',
+        on_delete=models.CASCADE,
+    )
+    date = models.DateField()
+    opening_balance = models.DecimalField(decimal_places=2, max_digits=12)
+    closing_balance = models.DecimalField(decimal_places=2, max_digits=12)
+    total_debits = models.DecimalField(decimal_places=2, max_digits=14, default=0)
+    total_credits = models.DecimalField(decimal_places=2, max_digits=14, default=0)
+    transaction_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-date']
+        unique_together = ('account', 'date')
+
+    def __str__(self):
+        return f"{self.account_id} {self.date}"
+
+
+# ================================ Journal =====================================================
+class AppendOnlyQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise TypeError(f"{self.model.__name__} is append-only")
+
+    def delete(self):
+        raise TypeError(f"{self.model.__name__} is append-only")
+
+
+class AppendOnlyModel(models.Model):
+    objects = AppendOnlyQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise TypeError(f"{type(self).__name__} is append-only")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise TypeError(f"{type(self).__name__} is append-only")
+
+
+class JournalEntry(AppendOnlyModel):
+    '''
+    One balanced movement of money, written by every posting path in the same statement
+    as the balance change. Its legs add up to zero.
+    '''
+    entry_type = models.CharField(choices=JOURNAL_ENTRY_TYPE_CHOICES, max_length=10)
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        verbose_name_plural = 'journal entries'
+
+    def __str__(self):
+        return f"{self.entry_type} {self.pk}"
+
+
+class JournalLeg(AppendOnlyModel):
+    '''
+    A signed amount moved on either a customer account or an internal ledger (cash, fees,
+    ...). The balance of an account is the sum of its legs.
+    '''
+    entry = models.ForeignKey(JournalEntry, related_name='legs', on_delete=models.PROTECT, db_index=False)
+    account = models.ForeignKey(
+        BankAccount,
+        related_name='journal_legs',
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        db_index=False,
+    )
+    ledger = models.CharField(max_length=16, null=True, blank=True)
+    amount = models.DecimalField(decimal_places=2, max_digits=14)
+
+    class Meta:
+        indexes = [
+            # Both carry the amount so that the reconciliation sums are index-only scans
+            models.Index(fields=['account'], include=['amount'], name='journal_leg_account'),
+            models.Index(fields=['entry'], include=['amount'], name='journal_leg_entry'),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(account__isnull=False, ledger__isnull=True)
+                | models.Q(account__isnull=True, ledger__isnull=False),
+                name='journal_leg_account_or_ledger',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.entry_id} {self.account_id or self.ledger} {self.amount}"
+
+
+# ================================ Batch Posting Runs =========================================
+class PostingRun(models.Model):
+    '''One execution of a batch posting job (e.g. month-end) for a given period.'''
+    job = models.CharField(max_length=32)
+    period = models.DateField()
+    status = models.CharField(choices=RUN_STATUS_CHOICES, max_length=10, default=RUN_PENDING)
+    shard_count = models.PositiveIntegerField(default=0)
+    accounts_scanned = models.BigIntegerField(default=0)
+    transactions_posted = models.BigIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('job', 'period')
+
+    def __str__(self):
+        return f"{self.job} {self.period}"
+
+
+class PostingShard(models.Model):
+    '''
+    A contiguous `account_no` range of a run, processed by a single worker (jobs that
+    iterate over another table, such as EMI collection, store that table's key range).
+    The idempotency key is derived from the run and the range, so a retried or
+    re-dispatched shard always maps onto the same row.
+    '''
+    run = models.ForeignKey(PostingRun, related_name='shards', on_delete=models.CASCADE)
+    idempotency_key = models.CharField(max_length=128, unique=True)
+    first_account_no = models.BigIntegerField(help_text="Exclusive lower bound of the shard")
+    last_account_no = models.BigIntegerField(help_text="Inclusive upper bound of the shard")
+    status = models.CharField(choices=RUN_STATUS_CHOICES, max_length=10, default=RUN_PENDING)
+    accounts_scanned = models.BigIntegerField(default=0)
+    transactions_posted = models.BigIntegerField(default=0)
+    elapsed_seconds = models.FloatField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['first_account_no']
+
+    def __str__(self):
+        return self.idempotency_key
+
+
+class PostingCheckpoint(models.Model):
+    '''
+    Progress of one stage (e.g. interest, charges) of a shard. It is updated in the same
+    transaction as every posted batch, so a crashed shard resumes after the last
+    committed account instead of starting over.
+    '''
+    shard = models.ForeignKey(PostingShard, related_name='checkpoints', on_delete=models.CASCADE)
+    stage = models.CharField(max_length=32)
+    last_account_no = models.BigIntegerField()
+    accounts_scanned = models.BigIntegerField(default=0)
+    transactions_posted = models.BigIntegerField(default=0)
+    batches = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('shard', 'stage')
+
+    def __str__(self):
+        return f"{self.shard} {self.stage} @ {self.last_account_no}"
+
+
+class BalanceDiscrepancy(models.Model):
+    '''
+    An account whose stored balance disagreed with its journal or its latest daily snapshot
+    when the reconciliation of `checked_on` ran. Rows are only ever added by the job, one
+    per account and kind per night, so a re-run shard records nothing twice.
+    '''
+    checked_on = models.DateField()
+    account_no = models.BigIntegerField()
+    kind = models.CharField(choices=DISCREPANCY_KIND_CHOICES, max_length=10)
+    balance = models.DecimalField(decimal_places=2, max_digits=14)
+    expected = models.DecimalField(decimal_places=2, max_digits=14)
+    difference = models.DecimalField(decimal_places=2, max_digits=14)
+    detected_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['checked_on', 'account_no']
+        unique_together = ('checked_on', 'account_no', 'kind')
+
+    def __str__(self):
+        return f"{self.checked_on} {self.account_no} {self.kind} {self.difference}"
+
+
+# ================================ Transfer Batches ===========================================
+class TransferBatch(models.Model):
+    '''
+    One applied batch of transfers. A batch posted with a `reference` (e.g. the payroll run
+    it pays) can be posted only once, so a re-submitted file is refused instead of paid twice.
+    '''
+    reference = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    line_count = models.PositiveIntegerField(default=0)
+    posted_count = models.PositiveIntegerField(default=0)
+    rejected_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(decimal_places=2, max_digits=16, default=0)
+    elapsed_seconds = models.FloatField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.reference or f"transfer batch {self.pk}"
@@ -0,0 +1,95 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+# Largest value of the bigint transaction id
+MAX_ID = 2 ** 63 - 1
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(transaction):
+    raw = f"{transaction.timestamp.isoformat()}|{transaction.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    ''' Returns the `(timestamp, id)` position encoded in `cursor`, or None if it is invalid. '''
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        timestamp, pk = datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, TypeError, UnicodeDecodeError, binascii.Error):
+        return None
+    # Cursors are made from stored rows, so anything else has been tampered with
+    if timestamp.tzinfo is None or not 0 < pk <= MAX_ID:
+        return None
+    return timestamp, pk
+
+
+class KeysetPage:
+    '''
+    A page of transactions positioned by `(timestamp, id)` cursors instead of an OFFSET,
+    so fetching any page is an index range scan of `page_size + 1` rows.
+    '''
+
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1]) if self.has_next else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0]) if self.has_previous else None
+
+
+def paginate_keyset(queryset, page_size, after=None, before=None):
+    '''
+    Returns the KeysetPage of `queryset` (newest first) that follows the `after` cursor or
+    precedes the `before` cursor; the first page if neither is given. Raises InvalidCursor
+    if the given cursor can not be decoded.
+
+    The `timestamp__lte` / `timestamp__gte` bound repeats the first half of the tuple
+    comparison so that Postgres can start the index scan at the cursor.
+    '''
+    queryset = queryset.order_by('-timestamp', '-id')
+    if after or before:
+        position = decode_cursor(after or before)
+        if position is None:
+            raise InvalidCursor("Invalid cursor")
+
+    if after:
+        timestamp, pk = position
+        rows = list(
+            queryset.filter(timestamp__lte=timestamp)
+            .filter(Q(timestamp__lt=timestamp) | Q(id__lt=pk))[:page_size + 1]
+        )
+        return KeysetPage(rows[:page_size], has_next=len(rows) > page_size, has_previous=bool(rows))
+
+    if before:
+        timestamp, pk = position
+        rows = list(
+            queryset.filter(timestamp__gte=timestamp)
+            .filter(Q(timestamp__gt=timestamp) | Q(id__gt=pk))
+            .order_by('timestamp', 'id')[:page_size + 1]
+        )
+        has_previous = len(rows) > page_size
+        rows = rows[:page_size]
+        rows.reverse()
+        return KeysetPage(rows, has_next=bool(rows), has_previous=has_previous)
+
+    rows = list(queryset[:page_size + 1])
+    return KeysetPage(rows[:page_size], has_next=len(rows) > page_size, has_previous=False)
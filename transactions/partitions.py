@@ -0,0 +1,201 @@
+import logging
+import re
+from datetime import date, datetime, time
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Monthly range partitioning of transactions_transaction on `timestamp`.
+#
+# Postgres requires every unique index of a partitioned table to contain the partition key,
+# so the primary key becomes (id, timestamp) and the per-period uniqueness of month-end
+# postings is only enforced by a local unique index on each partition. That is weaker than
+# a global index: a period posted after the month has rolled over (e.g. `--period` for last
+# month) lands in a later partition than the period's earlier postings. Across partitions,
+# a double posting is only prevented by the month-end statements' own lookup of the
+# period's postings, made under the account's row lock, and by the job's shard checkpoints.
+#
+# A DEFAULT partition catches the rows of any month whose partition does not exist yet, so
+# a missed run of `maintain_transaction_partitions` does not make every posting fail. When
+# that month's partition is created, the rows are moved out of the default partition first.
+
+TABLE = 'transactions_transaction'
+DEFAULT_PARTITION = f"{TABLE}_default"
+PARTITION_NAME = re.compile(rf'^{TABLE}_p(\d{{4}})(\d{{2}})$')
+
+
+def is_partitioned():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{TABLE}_p{month:%Y%m}"
+
+
+def month_bounds(month):
+    start = timezone.make_aware(datetime.combine(month, time.min))
+    end = timezone.make_aware(datetime.combine(add_months(month, 1), time.min))
+    return start, end
+
+
+def _periodic_index(cursor, name):
+    cursor.execute(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_periodic "
+        f"ON {name} (account_id, transaction_type, period) WHERE period IS NOT NULL"
+    )
+
+
+def create_partition(cursor, month):
+    '''
+    Creates the partition holding `month` (and its local indexes) if it does not exist,
+    moving the month's rows out of the default partition. Returns the number of rows moved.
+    '''
+    name = partition_name(month)
+    start, end = month_bounds(month)
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL, to_regclass(%s) IS NOT NULL", [name, DEFAULT_PARTITION])
+    exists, has_default = cursor.fetchone()
+    if exists:
+        return 0
+
+    moved = 0
+    if has_default:
+        # Attaching a range that the default partition holds rows of would fail
+        cursor.execute(f"LOCK TABLE {DEFAULT_PARTITION} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= %s AND timestamp < %s RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved",
+            [start, end],
+        )
+        moved = cursor.rowcount
+        cursor.execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", [start, end])
+        if moved:
+            logger.warning("Moved %s transactions of %s out of the default partition", moved, f"{month:%Y-%m}")
+    else:
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)", [start, end])
+    _periodic_index(cursor, name)
+    return moved
+
+
+def create_default_partition(cursor):
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT")
+    _periodic_index(cursor, DEFAULT_PARTITION)
+
+
+def list_partitions():
+    ''' Returns `(month, name)` for every partition currently attached, oldest first. '''
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+        """, [TABLE])
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions.append((date(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(partitions)
+
+
+def ensure_future_partitions(months_ahead):
+    '''
+    Makes sure partitions exist from the current month up to `months_ahead` months ahead,
+    and that the default partition exists.
+    '''
+    current = month_start(timezone.localdate())
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            create_partition(cursor, month)
+            created.append(partition_name(month))
+        create_default_partition(cursor)
+    return created
+
+
+def detach_old_partitions(retention_months):
+    '''
+    Detaches the partitions older than `retention_months` months and renames them with an
+    `_archive` prefix, so they can be dumped and dropped without touching the live table.
+    '''
+    cutoff = add_months(month_start(timezone.localdate()), -retention_months)
+    detached = []
+    for month, name in list_partitions():
+        if month >= cutoff:
+            break
+        archive = f"{TABLE}_archive_{month:%Y%m}"
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+            cursor.execute(f"ALTER TABLE {name} RENAME TO {archive}")
+        logger.info("Detached transaction partition %s as %s", name, archive)
+        detached.append(archive)
+    return detached
+
+
+def convert_to_partitioned(months_ahead):
+    '''
+    Replaces the plain transactions table with a partitioned one holding the same rows.
+    Runs in a single transaction and takes an exclusive lock on the table for its duration.
+    '''
+    legacy = f"{TABLE}_legacy"
+    sequence = f"{TABLE}_id_part_seq"
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(f"SELECT MIN(timestamp), COALESCE(MAX(id), 0) FROM {TABLE}")
+        first_timestamp, last_id = cursor.fetchone()
+
+        cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {legacy}")
+        cursor.execute(f"CREATE SEQUENCE {sequence}")
+        cursor.execute("SELECT setval(%s, %s, %s)", [sequence, max(last_id, 1), last_id > 0])
+        cursor.execute(
+            f"CREATE TABLE {TABLE} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)"
+        )
+        cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+        cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id")
+
+        current = month_start(timezone.localdate())
+        month = month_start(timezone.localtime(first_timestamp).date()) if first_timestamp else current
+        while month <= add_months(current, months_ahead):
+            create_partition(cursor, month)
+            month = add_months(month, 1)
+        create_default_partition(cursor)
+
+        cursor.execute(f"INSERT INTO {TABLE} SELECT * FROM {legacy}")
+        copied = cursor.rowcount
+        cursor.execute(f"DROP TABLE {legacy}")
+
+        # Indexes and constraints are created after the copy, on the parent, and cascade to
+        # every partition (present and future)
+        cursor.execute(f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id, timestamp)")
+        cursor.execute(
+            f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_account_id_fk "
+            f"FOREIGN KEY (account_id) REFERENCES accounts_bankaccount (account_no) "
+            f"DEFERRABLE INITIALLY DEFERRED"
+        )
+        cursor.execute(
+            f"CREATE INDEX transaction_account_history "
+            f"ON {TABLE} (account_id, timestamp DESC, id DESC)"
+        )
+
+    logger.info("Converted %s to a partitioned table (%s rows copied)", TABLE, copied)
+    return copied
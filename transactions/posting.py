@@ -0,0 +1,452 @@
+import logging
+import time
+from datetime import date, datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from accounts.models import BankAccount
+from accounts.summary import invalidate_all_summaries, record_posting
+from .constants import (
+    DEPOSIT, LEDGER_BY_TRANSACTION_TYPE, LEDGER_FEES, LEDGER_INTEREST, WITHDRAWAL,
+)
+from .group_commit import GroupCommitter
+from .journal import journal_sql, ledger_source
+from .models import PostingCheckpoint, Transaction
+from .snapshots import snapshot_upsert_sql
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientFunds(Exception):
+    pass
+
+
+# ================================ Single postings ============================================
+# The balance is moved with a relative UPDATE that touches only the balance column; the row
+# lock it takes serialises concurrent postings on the same account, the overdraft check is
+# part of the same statement, and the new balance comes back from the database straight into
+# the Transaction row, the journal and the day's balance snapshot, so a posting is one round
+# trip and can never lose an update.
+
+POSTED_SNAPSHOT_SQL = snapshot_upsert_sql(
+    "SELECT account_no, %(credits)s::numeric AS credits, %(debits)s::numeric AS debits, "
+    "balance, 1 AS postings FROM posted"
+)
+
+POSTED_JOURNAL_SQL = journal_sql(
+    "SELECT account_no, %(delta)s::numeric AS delta, %(transaction_type)s::text AS entry_type, "
+    "NULL::bigint AS contra_account, %(ledger)s::text AS contra_ledger FROM posted"
+)
+
+POST_TRANSACTION_SQL = f"""
+    WITH posted AS (
+        UPDATE accounts_bankaccount
+        SET balance = balance + %(delta)s
+        WHERE account_no = %(account_no)s AND balance + %(delta)s >= 0
+        RETURNING account_no, balance
+    ),
+    inserted AS (
+        INSERT INTO transactions_transaction
+            (account_id, amount, balance_after_transaction, transaction_type, timestamp)
+        SELECT account_no, %(amount)s, balance, %(transaction_type)s, %(now)s FROM posted
+        RETURNING id, balance_after_transaction, timestamp
+    ),
+    {POSTED_JOURNAL_SQL},
+    snapshot AS ({POSTED_SNAPSHOT_SQL})
+    SELECT id, balance_after_transaction, timestamp FROM inserted
+"""
+
+
+def post_transaction(account, amount, transaction_type, delta):
+    '''
+    Applies `delta` to the balance of `account` and records a Transaction of `amount`.
+    Returns the saved Transaction, whose `balance_after_transaction` is the balance read
+    back from the database. Raises InsufficientFunds if the balance would go negative.
+
+    With POSTING_GROUP_COMMIT enabled, postings made outside of an atomic block are queued
+    and committed together with concurrent postings on the same account.
+    '''
+    if settings.POSTING_GROUP_COMMIT and not connection.in_atomic_block:
+        posted = group_committer.submit(account.pk, (amount, transaction_type, delta))
+        posted.account = account
+        account.balance = posted.balance_after_transaction
+        return posted
+
+    now = timezone.now()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(POST_TRANSACTION_SQL, {
+            'account_no': account.pk,
+            'delta': delta,
+            'amount': amount,
+            'transaction_type': transaction_type,
+            'ledger': LEDGER_BY_TRANSACTION_TYPE[transaction_type],
+            'now': now,
+            'day': timezone.localdate(now),
+            'credits': max(delta, 0),
+            'debits': max(-delta, 0),
+        })
+        row = cursor.fetchone()
+
+    if row is None:
+        raise InsufficientFunds(f"Account {account.pk} can not be debited {-delta} $")
+
+    transaction_id, balance, timestamp = row
+    account.balance = balance
+    posted = Transaction(
+        id=transaction_id,
+        account=account,
+        amount=amount,
+        balance_after_transaction=balance,
+        transaction_type=transaction_type,
+        timestamp=timestamp,
+    )
+    posted._state.adding = False
+    posted._state.db = connection.alias
+    record_posting(account.pk, [posted])
+    return posted
+
+
+def deposit(account, amount):
+    return post_transaction(account, amount, DEPOSIT, amount)
+
+
+def withdraw(account, amount):
+    return post_transaction(account, amount, WITHDRAWAL, -amount)
+
+
+# ================================ Group commit ===============================================
+# Hot accounts serialise on their row lock, so each posting pays a full lock/commit round
+# trip. In group-commit mode the postings queued for an account are applied as one batch:
+# one locking read, one balance UPDATE, one bulk INSERT and one journal and snapshot
+# statement, however many postings it holds.
+
+BATCH_SNAPSHOT_SQL = snapshot_upsert_sql(
+    "SELECT %(account_no)s::bigint AS account_no, %(credits)s::numeric AS credits, "
+    "%(debits)s::numeric AS debits, %(balance)s::numeric AS balance, %(postings)s AS postings"
+)
+
+BATCH_JOURNAL_SQL = "WITH " + journal_sql(
+    "SELECT %(account_no)s::bigint AS account_no, delta, entry_type, NULL::bigint AS contra_account, "
+    "contra_ledger FROM unnest(%(deltas)s::numeric[], %(entry_types)s::text[], %(ledgers)s::text[]) "
+    "AS posting(delta, entry_type, contra_ledger)"
+) + BATCH_SNAPSHOT_SQL
+
+
+def apply_posting_batch(account_no, postings):
+    '''
+    Applies a list of `(amount, transaction_type, delta)` postings to one account in order
+    and returns, for each of them, the saved Transaction or an InsufficientFunds error.
+    '''
+    results = []
+    accepted = []
+    deltas = []
+    credits = debits = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT balance FROM accounts_bankaccount WHERE account_no = %s FOR UPDATE",
+            [account_no],
+        )
+        row = cursor.fetchone()
+        if row is None:
+            raise BankAccount.DoesNotExist(f"Account {account_no} does not exist")
+        balance = row[0]
+
+        for amount, transaction_type, delta in postings:
+            if balance + delta < 0:
+                results.append(InsufficientFunds(f"Account {account_no} can not be debited {-delta} $"))
+                continue
+            balance += delta
+            credits += max(delta, 0)
+            debits += max(-delta, 0)
+            posted = Transaction(
+                account_id=account_no,
+                amount=amount,
+                balance_after_transaction=balance,
+                transaction_type=transaction_type,
+            )
+            results.append(posted)
+            accepted.append(posted)
+            deltas.append(delta)
+
+        if accepted:
+            cursor.execute(
+                "UPDATE accounts_bankaccount SET balance = %s WHERE account_no = %s",
+                [balance, account_no],
+            )
+            Transaction.objects.bulk_create(accepted)
+            record_posting(account_no, accepted)
+            now = timezone.now()
+            cursor.execute(BATCH_JOURNAL_SQL, {
+                'account_no': account_no,
+                'deltas': deltas,
+                'entry_types': [posted.transaction_type for posted in accepted],
+                'ledgers': [LEDGER_BY_TRANSACTION_TYPE[posted.transaction_type] for posted in accepted],
+                'now': now,
+                'credits': credits,
+                'debits': debits,
+                'balance': balance,
+                'postings': len(accepted),
+                'day': timezone.localdate(now),
+            })
+    return results
+
+
+group_committer = GroupCommitter(
+    apply_posting_batch,
+    max_latency=settings.POSTING_GROUP_COMMIT_MAX_LATENCY,
+    max_batch_size=settings.POSTING_GROUP_COMMIT_MAX_BATCH_SIZE,
+)
+
+
+# ================================ Month-end posting ==========================================
+# Each statement handles one keyset batch of one account class: it locks the batch rows,
+# moves the balance in a single UPDATE and feeds the RETURNING rows straight into the
+# INSERT of the matching Transaction rows, so a batch is one round trip whatever its size.
+# The journal entries and daily balance snapshots are written from the same RETURNING rows.
+# Accounts that already hold a posting of the same type for the period are skipped, and the
+# `unique_periodic_posting` constraint guarantees they can never be posted twice. A posting
+# is never older than its period, so the `timestamp` bound of that lookup lets Postgres prune
+# it to the partitions of the period when the transactions table is partitioned. The lookup
+# is a LATERAL probe keyed on the batch's account_no: as an anti-join, Postgres would scan the
+# period's postings once per batch whenever its statistics predate the period (i.e. for the
+# whole run), which makes the job quadratic in the number of accounts.
+
+INTEREST_SNAPSHOT_SQL = snapshot_upsert_sql(
+    "SELECT account_no, amount AS credits, 0 AS debits, balance, 1 AS postings FROM posted"
+)
+CHARGES_SNAPSHOT_SQL = snapshot_upsert_sql(
+    "SELECT account_no, 0 AS credits, amount AS debits, balance, 1 AS postings FROM posted"
+)
+
+INTEREST_JOURNAL_SQL = journal_sql(
+    ledger_source("SELECT account_no, amount AS delta FROM posted", 'INTEREST', LEDGER_INTEREST)
+)
+CHARGES_JOURNAL_SQL = journal_sql(
+    ledger_source("SELECT account_no, -amount AS delta FROM posted", 'CHARGES', LEDGER_FEES)
+)
+
+SAVINGS_INTEREST_SQL = f"""
+    WITH batch AS (
+        SELECT a.account_no, ROUND(a.balance * s.interest_rate / 1200, 2) AS amount
+        FROM accounts_bankaccount a
+        JOIN accounts_savingsbankaccount s ON s.bankaccount_ptr_id = a.account_no
+        WHERE a.account_no > %(after)s AND a.account_no <= %(until)s AND a.balance > 0
+        ORDER BY a.account_no
+        LIMIT %(limit)s
+        FOR UPDATE OF a
+    ),
+    posted AS (
+        UPDATE accounts_bankaccount a
+        SET balance = a.balance + b.amount
+        FROM batch b
+        LEFT JOIN LATERAL (
+            SELECT 1 AS found FROM transactions_transaction t
+            WHERE t.account_id = b.account_no
+              AND t.transaction_type = 'INTEREST' AND t.period = %(period)s
+              AND t.timestamp >= %(period_start)s
+            LIMIT 1
+        ) done ON true
+        WHERE a.account_no = b.account_no AND b.amount > 0 AND done.found IS NULL
+        RETURNING a.account_no, b.amount, a.balance
+    ),
+    inserted AS (
+        INSERT INTO transactions_transaction
+            (account_id, amount, balance_after_transaction, transaction_type, timestamp, period)
+        SELECT account_no, amount, balance, 'INTEREST', %(now)s, %(period)s FROM posted
+        RETURNING id
+    ),
+    {INTEREST_JOURNAL_SQL},
+    snapshot AS ({INTEREST_SNAPSHOT_SQL})
+    SELECT (SELECT MAX(account_no) FROM batch),
+           (SELECT COUNT(*) FROM batch),
+           (SELECT COUNT(*) FROM inserted)
+"""
+
+CHECKING_CHARGES_SQL = f"""
+    WITH batch AS (
+        SELECT a.account_no, c.service_charge AS amount
+        FROM accounts_bankaccount a
+        JOIN accounts_checkingbankaccount c ON c.bankaccount_ptr_id = a.account_no
+        WHERE a.account_no > %(after)s AND a.account_no <= %(until)s AND a.balance > 0
+        ORDER BY a.account_no
+        LIMIT %(limit)s
+        FOR UPDATE OF a
+    ),
+    posted AS (
+        UPDATE accounts_bankaccount a
+        SET balance = a.balance - b.amount
+        FROM batch b
+        LEFT JOIN LATERAL (
+            SELECT 1 AS found FROM transactions_transaction t
+            WHERE t.account_id = b.account_no
+              AND t.transaction_type = 'CHARGES' AND t.period = %(period)s
+              AND t.timestamp >= %(period_start)s
+            LIMIT 1
+        ) done ON true
+        WHERE a.account_no = b.account_no AND a.balance > b.amount AND done.found IS NULL
+        RETURNING a.account_no, b.amount, a.balance
+    ),
+    inserted AS (
+        INSERT INTO transactions_transaction
+            (account_id, amount, balance_after_transaction, transaction_type, timestamp, period)
+        SELECT account_no, -amount, balance, 'CHARGES', %(now)s, %(period)s FROM posted
+        RETURNING id
+    ),
+    {CHARGES_JOURNAL_SQL},
+    snapshot AS ({CHARGES_SNAPSHOT_SQL})
+    SELECT (SELECT MAX(account_no) FROM batch),
+           (SELECT COUNT(*) FROM batch),
+           (SELECT COUNT(*) FROM inserted)
+"""
+
+MONTH_END_STATEMENTS = (
+    ('interest', SAVINGS_INTEREST_SQL),
+    ('charges', CHECKING_CHARGES_SQL),
+)
+
+
+# Upper bound used when a range is open-ended (largest BIGINT)
+MAX_ACCOUNT_NO = 2 ** 63 - 1
+
+
+def _rate(rows, elapsed):
+    return round(rows / elapsed, 1) if elapsed > 0 else 0.0
+
+
+def current_period():
+    ''' The first day of the current month, which identifies a month-end posting. '''
+    return timezone.localdate().replace(day=1)
+
+
+def period_start(period):
+    ''' The (aware) local midnight on which `period`, a date or ISO date string, begins. '''
+    if isinstance(period, str):
+        period = date.fromisoformat(period)
+    return timezone.make_aware(datetime.combine(period, datetime.min.time()))
+
+
+def post_account_class(sql, batch_size, now, period, after=0, until=MAX_ACCOUNT_NO, checkpoint=None,
+                       invalidate_summaries=True):
+    '''
+    Runs one month-end statement over the accounts in (`after`, `until`] in keyset batches
+    of `batch_size` accounts. Every batch is its own transaction so row locks are held only
+    for one batch. When a `PostingCheckpoint` is given, the batch starts after its
+    `last_account_no` and advances it in the same transaction as the postings. Statements
+    that do not move balances pass `invalidate_summaries=False`.
+    '''
+    scanned = posted = batches = 0
+    started = time.monotonic()
+
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            if checkpoint is not None:
+                checkpoint = PostingCheckpoint.objects.select_for_update().get(pk=checkpoint.pk)
+                after = checkpoint.last_account_no
+
+            cursor.execute(sql, {
+                'after': after,
+                'until': until,
+                'limit': batch_size,
+                'now': now,
+                'day': timezone.localdate(now),
+                'period': period,
+                'period_start': period_start(period),
+            })
+            last_account_no, batch_scanned, batch_posted = cursor.fetchone()
+
+            if batch_scanned and checkpoint is not None:
+                checkpoint.last_account_no = last_account_no
+                checkpoint.accounts_scanned = F('accounts_scanned') + batch_scanned
+                checkpoint.transactions_posted = F('transactions_posted') + batch_posted
+                checkpoint.batches = F('batches') + 1
+                checkpoint.save(update_fields=[
+                    'last_account_no', 'accounts_scanned', 'transactions_posted', 'batches', 'updated_at',
+                ])
+
+        if not batch_scanned:
+            break
+        after = last_account_no
+        scanned += batch_scanned
+        posted += batch_posted
+        batches += 1
+
+    if posted and invalidate_summaries:
+        # Too many accounts to write through one by one
+        invalidate_all_summaries()
+    elapsed = time.monotonic() - started
+    return {
+        'accounts_scanned': scanned,
+        'transactions_posted': posted,
+        'batches': batches,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': _rate(scanned, elapsed),
+    }
+
+
+def run_month_end(batch_size=None, period=None, after=0, until=MAX_ACCOUNT_NO, shard=None):
+    '''
+    Posts monthly interest to savings accounts and service charges to checking accounts
+    in the `account_no` range (`after`, `until`] and returns a report with per-class and
+    total throughput. With a `shard`, every stage resumes from its checkpoint, so the
+    report only counts the work done by this call.
+    '''
+    batch_size = batch_size or settings.MONTH_END_BATCH_SIZE
+    period = period or current_period()
+    now = timezone.now()
+    started = time.monotonic()
+
+    report = {}
+    for name, sql in MONTH_END_STATEMENTS:
+        checkpoint = None
+        if shard is not None:
+            checkpoint, _ = PostingCheckpoint.objects.get_or_create(
+                shard=shard, stage=name, defaults={'last_account_no': after},
+            )
+        report[name] = post_account_class(
+            sql, batch_size, now, period, after=after, until=until, checkpoint=checkpoint,
+        )
+        logger.info("Month-end %s (%s, %s]: %s", name, after, until, report[name])
+
+    elapsed = time.monotonic() - started
+    scanned = sum(part['accounts_scanned'] for part in report.values())
+    report['total'] = {
+        'accounts_scanned': scanned,
+        'transactions_posted': sum(part['transactions_posted'] for part in report.values()),
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': _rate(scanned, elapsed),
+    }
+    return report
+
+
+# ================================ Sharding ===================================================
+SHARD_BOUNDARIES_SQL = """
+    SELECT {key} FROM (
+        SELECT {key}, ROW_NUMBER() OVER (ORDER BY {key}) AS position
+        FROM {table}
+    ) numbered
+    WHERE position %% %(size)s = 0
+"""
+
+
+def plan_shards(shard_size=None, table='accounts_bankaccount', key='account_no'):
+    '''
+    Splits `table` into `(after, until]` ranges of its integer primary key `key` holding
+    `shard_size` rows each (the book of accounts by default), computed in one index-only
+    pass over the primary key. The last range is open-ended (up to MAX_ACCOUNT_NO), so
+    rows created after the plan, e.g. accounts opened while a run is in progress, still
+    belong to a shard of the run.
+    '''
+    shard_size = shard_size or settings.MONTH_END_SHARD_SIZE
+    with connection.cursor() as cursor:
+        cursor.execute(SHARD_BOUNDARIES_SQL.format(table=table, key=key), {'size': shard_size})
+        boundaries = [row[0] for row in cursor.fetchall()]
+
+    shards = []
+    after = 0
+    for until in boundaries + [MAX_ACCOUNT_NO]:
+        shards.append((after, until))
+        after = until
+    return shards
@@ -0,0 +1,219 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .constants import DISCREPANCY_JOURNAL, DISCREPANCY_SNAPSHOT
+from .models import PostingCheckpoint
+from .posting import MAX_ACCOUNT_NO, plan_shards, post_account_class
+
+logger = logging.getLogger(__name__)
+
+# Verification of the journal. Both checks run as one aggregate query per chunk of keys,
+# over the covering indexes of the legs, so they read millions of legs without ever holding
+# them in memory and without locking anything:
+#
+# - every account balance must equal the sum of the journal legs of the account;
+# - every journal entry must have at least two legs adding up to zero.
+#
+# Each chunk is checked by a single statement, and so against a single snapshot: a posting
+# committing while it runs can not make the chunk look inconsistent.
+
+RECONCILE_ACCOUNTS_SQL = """
+    WITH journal AS (
+        SELECT account_id, SUM(amount) AS total
+        FROM transactions_journalleg
+        WHERE account_id > %(after)s AND account_id <= %(until)s
+        GROUP BY account_id
+    ),
+    checked AS (
+        SELECT a.account_no, a.balance, COALESCE(j.total, 0) AS journal_balance
+        FROM accounts_bankaccount a
+        LEFT JOIN journal j ON j.account_id = a.account_no
+        WHERE a.account_no > %(after)s AND a.account_no <= %(until)s
+    )
+    SELECT COUNT(*),
+           ARRAY_AGG(account_no ORDER BY account_no) FILTER (WHERE balance <> journal_balance),
+           ARRAY_AGG(balance ORDER BY account_no) FILTER (WHERE balance <> journal_balance),
+           ARRAY_AGG(journal_balance ORDER BY account_no) FILTER (WHERE balance <> journal_balance)
+    FROM checked
+"""
+
+CHECK_ENTRIES_SQL = """
+    WITH legs AS (
+        SELECT entry_id, SUM(amount) AS total, COUNT(*) AS legs
+        FROM transactions_journalleg
+        WHERE entry_id > %(after)s AND entry_id <= %(until)s
+        GROUP BY entry_id
+    )
+    SELECT COUNT(*),
+           ARRAY_AGG(e.id ORDER BY e.id) FILTER (WHERE l.legs IS NULL OR l.legs < 2 OR l.total <> 0)
+    FROM transactions_journalentry e
+    LEFT JOIN legs l ON l.entry_id = e.id
+    WHERE e.id > %(after)s AND e.id <= %(until)s
+"""
+
+
+def _rate(rows, elapsed):
+    return round(rows / elapsed, 1) if elapsed > 0 else 0.0
+
+
+def reconcile_accounts(after, until):
+    '''
+    Compares the balance of every account in (`after`, `until`] with the sum of its journal
+    legs. Returns the number of accounts checked and `(account_no, balance, journal_balance)`
+    for each one that does not match.
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(RECONCILE_ACCOUNTS_SQL, {'after': after, 'until': until})
+        checked, account_nos, balances, journal_balances = cursor.fetchone()
+    return checked, list(zip(account_nos or [], balances or [], journal_balances or []))
+
+
+def check_entries(after, until):
+    '''
+    Returns the number of journal entries in the id range (`after`, `until`] and the ids of
+    those that are not balanced.
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(CHECK_ENTRIES_SQL, {'after': after, 'until': until})
+        checked, unbalanced = cursor.fetchone()
+    return checked, unbalanced or []
+
+
+def reconcile(chunk_size=None, entries=True, max_listed=100, on_chunk=None):
+    '''
+    Verifies the whole book in chunks of `chunk_size` keys and returns a report with the
+    number of accounts and entries checked, the first `max_listed` inconsistencies of each
+    kind and the throughput. `on_chunk(kind, index, count, report)` is called after every chunk.
+    '''
+    chunk_size = chunk_size or settings.RECONCILIATION_CHUNK_SIZE
+    started = time.monotonic()
+    report = {
+        'accounts_checked': 0,
+        'accounts_mismatched': 0,
+        'mismatches': [],
+        'entries_checked': 0,
+        'entries_unbalanced': 0,
+        'unbalanced_entries': [],
+    }
+
+    chunks = plan_shards(chunk_size)
+    for index, (after, until) in enumerate(chunks, start=1):
+        checked, mismatches = reconcile_accounts(after, until)
+        report['accounts_checked'] += checked
+        report['accounts_mismatched'] += len(mismatches)
+        for account_no, balance, journal_balance in mismatches:
+            if len(report['mismatches']) < max_listed:
+                report['mismatches'].append({
+                    'account_no': account_no,
+                    'balance': balance,
+                    'journal_balance': journal_balance,
+                    'difference': balance - journal_balance,
+                })
+        if on_chunk:
+            on_chunk('accounts', index, len(chunks), report)
+
+    if entries:
+        chunks = plan_shards(chunk_size, table='transactions_journalentry', key='id')
+        for index, (after, until) in enumerate(chunks, start=1):
+            checked, unbalanced = check_entries(after, until)
+            report['entries_checked'] += checked
+            report['entries_unbalanced'] += len(unbalanced)
+            report['unbalanced_entries'].extend(unbalanced[:max_listed - len(report['unbalanced_entries'])])
+            if on_chunk:
+                on_chunk('entries', index, len(chunks), report)
+
+    elapsed = time.monotonic() - started
+    report['elapsed_seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = _rate(report['accounts_checked'] + report['entries_checked'], elapsed)
+    return report
+
+
+# ================================ Nightly balance reconciliation =============================
+# The nightly job checks every stored balance against two independent derivations of it and
+# records each disagreement in BalanceDiscrepancy:
+#
+# - the sum of the account's journal legs (every posting, since the account was opened);
+# - the closing balance of the account's latest daily snapshot, which every posting path
+#   sets from the balance it returned, under the account's row lock.
+#
+# (The latest Transaction is not compared directly: month-end batches stamp all of their
+# postings with the start time of the run and single postings take their timestamp before
+# they wait for the row lock, so ordering by timestamp does not reliably find the last one.)
+#
+# It runs in the style of the month-end job: the book is split into account_no shards that
+# Celery workers check in parallel, each shard in keyset batches with one read-only
+# statement per batch that commits together with the shard's checkpoint.
+
+RECONCILE_BALANCES_SQL = f"""
+    WITH batch AS (
+        SELECT account_no, balance
+        FROM accounts_bankaccount
+        WHERE account_no > %(after)s AND account_no <= %(until)s
+        ORDER BY account_no
+        LIMIT %(limit)s
+    ),
+    journal AS (
+        SELECT account_id, SUM(amount) AS total
+        FROM transactions_journalleg
+        WHERE account_id > %(after)s AND account_id <= (SELECT MAX(account_no) FROM batch)
+        GROUP BY account_id
+    ),
+    checked AS (
+        SELECT b.account_no, b.balance, COALESCE(j.total, 0) AS journal_balance, s.closing_balance
+        FROM batch b
+        LEFT JOIN journal j ON j.account_id = b.account_no
+        LEFT JOIN LATERAL (
+            SELECT closing_balance
+            FROM transactions_dailybalancesnapshot
+            WHERE account_id = b.account_no
+            ORDER BY date DESC
+            LIMIT 1
+        ) s ON true
+    ),
+    found AS (
+        SELECT account_no, '{DISCREPANCY_JOURNAL}' AS kind, balance, journal_balance AS expected
+        FROM checked WHERE balance <> journal_balance
+        UNION ALL
+        SELECT account_no, '{DISCREPANCY_SNAPSHOT}', balance, closing_balance
+        FROM checked WHERE balance <> closing_balance
+    ),
+    recorded AS (
+        INSERT INTO transactions_balancediscrepancy
+            (checked_on, account_no, kind, balance, expected, difference, detected_at)
+        SELECT %(period)s, account_no, kind, balance, expected, balance - expected, %(now)s FROM found
+        ON CONFLICT (checked_on, account_no, kind) DO NOTHING
+        RETURNING 1
+    )
+    SELECT (SELECT MAX(account_no) FROM batch),
+           (SELECT COUNT(*) FROM batch),
+           (SELECT COUNT(*) FROM recorded)
+"""
+
+RECONCILIATION_STAGE = 'reconcile'
+
+
+def run_balance_reconciliation(checked_on=None, batch_size=None, after=0, until=MAX_ACCOUNT_NO, shard=None):
+    '''
+    Reconciles the accounts in (`after`, `until`] for the night of `checked_on` and returns
+    a report of the accounts checked and the discrepancies recorded. With a `shard`, the
+    check resumes from the shard's checkpoint.
+    '''
+    batch_size = batch_size or settings.RECONCILIATION_CHUNK_SIZE
+    checked_on = checked_on or timezone.localdate()
+
+    checkpoint = None
+    if shard is not None:
+        checkpoint, _ = PostingCheckpoint.objects.get_or_create(
+            shard=shard, stage=RECONCILIATION_STAGE, defaults={'last_account_no': after},
+        )
+    report = post_account_class(
+        RECONCILE_BALANCES_SQL, batch_size, timezone.now(), checked_on,
+        after=after, until=until, checkpoint=checkpoint, invalidate_summaries=False,
+    )
+    report['discrepancies'] = report.pop('transactions_posted')
+    logger.info("Balance reconciliation (%s, %s] for %s: %s", after, until, checked_on, report)
+    return report
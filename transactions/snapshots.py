@@ -0,0 +1,102 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from .constants import DEBIT_TRANSACTION_TYPES
+from .models import DailyBalanceSnapshot
+
+
+def snapshot_upsert_sql(source):
+    '''
+    Returns an INSERT that folds postings into the per-account daily snapshots. `source`
+    is a SELECT producing `account_no, credits, debits, balance, postings` rows, where
+    `balance` is the balance after the postings. Postings on one account are serialised by
+    its row lock, so the latest writer always carries the closing balance of the day.
+    '''
+    return f"""
+        INSERT INTO transactions_dailybalancesnapshot AS s
+            (account_id, date, opening_balance, closing_balance,
+             total_debits, total_credits, transaction_count)
+        SELECT account_no, %(day)s, balance - credits + debits, balance, debits, credits, postings
+        FROM ({source}) AS source
+        ON CONFLICT (account_id, date) DO UPDATE SET
+            closing_balance = EXCLUDED.closing_balance,
+            total_debits = s.total_debits + EXCLUDED.total_debits,
+            total_credits = s.total_credits + EXCLUDED.total_credits,
+            transaction_count = s.transaction_count + EXCLUDED.transaction_count
+    """
+
+
+def balance_at(account_no, day):
+    ''' Closing balance of an account on `day`, from the latest snapshot on or before it. '''
+    snapshot = (
+        DailyBalanceSnapshot.objects
+        .filter(account_id=account_no, date__lte=day)
+        .order_by('-date')
+        .values_list('closing_balance', flat=True)
+        .first()
+    )
+    return snapshot if snapshot is not None else Decimal('0.00')
+
+
+def statement_summary(account_no, start_date, end_date):
+    ''' Opening/closing balance and movement totals of an account over a date range. '''
+    totals = DailyBalanceSnapshot.objects.filter(
+        account_id=account_no, date__gte=start_date, date__lte=end_date,
+    ).aggregate(
+        total_credits=Sum('total_credits'),
+        total_debits=Sum('total_debits'),
+        transaction_count=Sum('transaction_count'),
+    )
+    return {
+        'opening_balance': balance_at(account_no, start_date - timedelta(days=1)),
+        'closing_balance': balance_at(account_no, end_date),
+        'total_credits': totals['total_credits'] or Decimal('0.00'),
+        'total_debits': totals['total_debits'] or Decimal('0.00'),
+        'transaction_count': totals['transaction_count'] or 0,
+    }
+
+
+# ================================ Backfill ===================================================
+BACKFILL_SQL = """
+    WITH daily AS (
+        SELECT account_id,
+               (timestamp AT TIME ZONE %(tz)s)::date AS day,
+               SUM(CASE WHEN transaction_type = ANY(%(debit_types)s) OR amount < 0 THEN 0 ELSE amount END) AS credits,
+               SUM(CASE WHEN transaction_type = ANY(%(debit_types)s) OR amount < 0 THEN ABS(amount) ELSE 0 END) AS debits,
+               (ARRAY_AGG(balance_after_transaction ORDER BY timestamp DESC, id DESC))[1] AS closing,
+               COUNT(*) AS postings
+        FROM transactions_transaction
+        WHERE account_id > %(after)s AND account_id <= %(until)s
+        GROUP BY account_id, day
+    )
+    INSERT INTO transactions_dailybalancesnapshot AS s
+        (account_id, date, opening_balance, closing_balance,
+         total_debits, total_credits, transaction_count)
+    SELECT account_id, day, closing - credits + debits, closing, debits, credits, postings
+    FROM daily
+    ON CONFLICT (account_id, date) DO UPDATE SET
+        opening_balance = EXCLUDED.opening_balance,
+        closing_balance = EXCLUDED.closing_balance,
+        total_debits = EXCLUDED.total_debits,
+        total_credits = EXCLUDED.total_credits,
+        transaction_count = EXCLUDED.transaction_count
+"""
+
+
+def backfill_snapshots(after, until):
+    '''
+    Rebuilds the snapshots of the accounts in (`after`, `until`] from their transactions
+    in one statement and returns the number of snapshot rows written.
+    '''
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(BACKFILL_SQL, {
+            'tz': settings.TIME_ZONE,
+            'debit_types': list(DEBIT_TRANSACTION_TYPES),
+            'after': after,
+            'until': until,
+        })
+        return cursor.rowcount
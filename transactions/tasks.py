@@ -1,58 +1,217 @@
+import logging
+
+from celery import chord, shared_task
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.models import Count, Q, Sum
 from django.utils import timezone
-from celery import shared_task
 
-from accounts.models import BankAccount, SavingsBankAccount, CheckingBankAccount
-from banking_system.celery import app
-from transactions.models import Transaction
+from transactions.constants import MONTH_END_JOB, RECONCILIATION_JOB, RUN_DONE, RUN_RUNNING
+from transactions import partitions
+from transactions.models import PostingRun, PostingShard
+from transactions.posting import current_period, plan_shards, run_month_end
+from transactions.reconciliation import run_balance_reconciliation
 
+logger = logging.getLogger(__name__)
 
-from django.db import transaction
 
-import logging
+@shared_task(name="update_account_balances")
+def update_account_balances(period=None, shard_size=None, batch_size=None):
+    '''
+    Fan-out step of the month-end job: splits the book into account_no shards and
+    dispatches one `post_month_end_shard` per pending shard as a chord whose callback
+    aggregates the totals. Calling it again for the same period only re-dispatches the
+    shards that have not finished yet.
+    '''
+    logger.info("Running update_account_balances task")
+    period = period or current_period().isoformat()
+    shard_size = shard_size or settings.MONTH_END_SHARD_SIZE
 
-logger = logging.getLogger(__name__)
+    run, pending = start_posting_run(MONTH_END_JOB, period, lambda: plan_shards(shard_size))
+    if run.status == RUN_DONE:
+        logger.info("Month-end run %s already finished, nothing to do", run)
+        return run.pk
 
-from django.db import connection
+    logger.info("Dispatching %s of %s month-end shards for %s", len(pending), run.shard_count, run)
+    if pending:
+        chord(
+            post_month_end_shard.s(shard_id, batch_size) for shard_id in pending
+        )(finish_posting_run.si(run.pk))
+    else:
+        finish_posting_run.delay(run.pk)
+    return run.pk
 
 
-@shared_task(name="update_account_balances")
-def update_account_balances():
-    logger.info("Running update_account_balances task")
-    
-    # accounts = BankAccount.objects.filter(balance__gt=0)
-    accounts = BankAccount.objects.filter(balance__gt=0)
-    
-    created_transactions = []
-    updated_accounts = []
-
-    for account in accounts:
-        with transaction.atomic():
-            if isinstance(account, SavingsBankAccount):
-                interest = account.add_interest()
-                transaction_obj = Transaction(
-                    account=account,
-                    transaction_type='Interest',
-                    amount=interest
-                )
-                created_transactions.append(transaction_obj)
-                logger.info(f"Added interest {interest} to SavingsAccount {account.id}")
-                
-            elif isinstance(account, CheckingBankAccount):
-                # Deduct service charge for checking accounts
-                service_charge = account.deduct_service_charge() 
-                transaction_obj = Transaction(
-                    account=account,
-                    transaction_type='Charges',
-                    amount=-service_charge 
+def start_posting_run(job, period, plan):
+    '''
+    Gets or creates the PostingRun of `job` for `period`, creates its shards from the
+    `(after, until]` ranges returned by `plan()` the first time, and returns the run with
+    the ids of the shards still to post. A finished run is returned untouched.
+    '''
+    run, _ = PostingRun.objects.get_or_create(job=job, period=period)
+    if run.status == RUN_DONE:
+        return run, []
+
+    if not run.shards.exists():
+        PostingShard.objects.bulk_create(
+            [
+                PostingShard(
+                    run=run,
+                    idempotency_key=f"{run.job}:{period}:{after}-{until}",
+                    first_account_no=after,
+                    last_account_no=until,
                 )
-                created_transactions.append(transaction_obj)
-                logger.info(f"Deducted charge {service_charge} from CheckingAccount {account.id}")
-                
-            updated_accounts.append(account)
+                for after, until in plan()
+            ],
+            ignore_conflicts=True,
+        )
+
+    pending = list(run.shards.exclude(status=RUN_DONE).values_list('pk', flat=True))
+    run.status = RUN_RUNNING
+    run.shard_count = run.shards.count()
+    run.save(update_fields=['status', 'shard_count'])
+    return run, pending
+
+
+@shared_task(
+    name="post_month_end_shard",
+    autoretry_for=(OperationalError,),
+    retry_backoff=True,
+    max_retries=5,
+)
+def post_month_end_shard(shard_id, batch_size=None):
+    '''
+    Posts one shard. Every batch commits together with the shard's checkpoint, so a
+    retried or redelivered shard resumes after the last committed account and a finished
+    shard is a no-op.
+    '''
+    shard = PostingShard.objects.select_related('run').get(pk=shard_id)
+    if shard.status == RUN_DONE:
+        logger.info("Shard %s already posted, skipping", shard)
+        return shard.transactions_posted
+
+    report = run_month_end(
+        batch_size=batch_size,
+        period=shard.run.period,
+        after=shard.first_account_no,
+        until=shard.last_account_no,
+        shard=shard,
+    )
+
+    return complete_shard(shard_id, report['total']['elapsed_seconds'])
+
+
+def complete_shard(shard_id, elapsed_seconds):
+    ''' Marks a shard done with the totals of its checkpoints; returns the postings made. '''
+    with transaction.atomic():
+        shard = PostingShard.objects.select_for_update().get(pk=shard_id)
+        totals = shard.checkpoints.aggregate(
+            accounts_scanned=Sum('accounts_scanned'),
+            transactions_posted=Sum('transactions_posted'),
+        )
+        shard.status = RUN_DONE
+        shard.accounts_scanned = totals['accounts_scanned'] or 0
+        shard.transactions_posted = totals['transactions_posted'] or 0
+        shard.elapsed_seconds += elapsed_seconds
+        shard.finished_at = timezone.now()
+        shard.save()
+
+    return shard.transactions_posted
+
+
+@shared_task(name="finish_posting_run")
+def finish_posting_run(run_id):
+    ''' Fan-in step: records the totals of all shards on the run. '''
+    run = PostingRun.objects.get(pk=run_id)
+    totals = run.shards.aggregate(
+        accounts_scanned=Sum('accounts_scanned'),
+        transactions_posted=Sum('transactions_posted'),
+        pending=Count('pk', filter=~Q(status=RUN_DONE)),
+    )
+
+    run.accounts_scanned = totals['accounts_scanned'] or 0
+    run.transactions_posted = totals['transactions_posted'] or 0
+    if not totals['pending']:
+        run.status = RUN_DONE
+        run.finished_at = timezone.now()
+    run.save()
+
+    logger.info(
+        "Run %s: %s rows written for %s accounts, %s shards pending",
+        run, run.transactions_posted, run.accounts_scanned, totals['pending'],
+    )
+    return {
+        'run': run.pk,
+        'accounts_scanned': run.accounts_scanned,
+        'transactions_posted': run.transactions_posted,
+        'pending_shards': totals['pending'],
+    }
+
+
+@shared_task(name="reconcile_balances")
+def reconcile_balances(checked_on=None, shard_size=None, batch_size=None):
+    '''
+    Nightly fan-out of the balance reconciliation: splits the book into account_no shards
+    and dispatches one `reconcile_balance_shard` per pending shard. The discrepancies are
+    recorded in BalanceDiscrepancy, and their count takes the place of the transactions
+    posted on the run and its shards.
+    '''
+    logger.info("Running reconcile_balances task")
+    checked_on = checked_on or timezone.localdate().isoformat()
+    shard_size = shard_size or settings.RECONCILIATION_SHARD_SIZE
+
+    run, pending = start_posting_run(RECONCILIATION_JOB, checked_on, lambda: plan_shards(shard_size))
+    if run.status == RUN_DONE:
+        logger.info("Reconciliation run %s already finished, nothing to do", run)
+        return run.pk
+
+    logger.info("Dispatching %s of %s reconciliation shards for %s", len(pending), run.shard_count, run)
+    if pending:
+        chord(
+            reconcile_balance_shard.s(shard_id, batch_size) for shard_id in pending
+        )(finish_posting_run.si(run.pk))
+    else:
+        finish_posting_run.delay(run.pk)
+    return run.pk
+
+
+@shared_task(
+    name="reconcile_balance_shard",
+    autoretry_for=(OperationalError,),
+    retry_backoff=True,
+    max_retries=5,
+)
+def reconcile_balance_shard(shard_id, batch_size=None):
+    ''' Reconciles one shard of accounts, resuming from its checkpoint. '''
+    shard = PostingShard.objects.select_related('run').get(pk=shard_id)
+    if shard.status == RUN_DONE:
+        logger.info("Shard %s already reconciled, skipping", shard)
+        return shard.transactions_posted
+
+    report = run_balance_reconciliation(
+        checked_on=shard.run.period,
+        batch_size=batch_size,
+        after=shard.first_account_no,
+        until=shard.last_account_no,
+        shard=shard,
+    )
+    return complete_shard(shard_id, report['elapsed_seconds'])
+
 
-    if created_transactions:
-        Transaction.objects.bulk_create(created_transactions)
+@shared_task(name="maintain_transaction_partitions")
+def maintain_transaction_partitions():
+    '''
+    Keeps TRANSACTION_PARTITION_MONTHS_AHEAD monthly partitions of the transactions table
+    ready and detaches the ones older than TRANSACTION_PARTITION_RETENTION_MONTHS.
+    Does nothing until the table has been converted with `partition_transactions --convert`.
+    '''
+    if not partitions.is_partitioned():
+        logger.info("Transactions table is not partitioned, skipping partition maintenance")
+        return {'created': [], 'detached': []}
 
-    if updated_accounts:
-        BankAccount.objects.bulk_update(updated_accounts, ['balance'])
-        
\ No newline at end of file
+    created = partitions.ensure_future_partitions(settings.TRANSACTION_PARTITION_MONTHS_AHEAD)
+    detached = []
+    if settings.TRANSACTION_PARTITION_RETENTION_MONTHS is not None:
+        detached = partitions.detach_old_partitions(settings.TRANSACTION_PARTITION_RETENTION_MONTHS)
+    logger.info("Transaction partitions ready: %s, detached: %s", created, detached)
+    return {'created': created, 'detached': detached}
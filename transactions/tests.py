@@ -1 +1,441 @@
-# Create your tests here.
+import base64
+import csv
+import json
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import IntegrityError, OperationalError, transaction
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User, BankAccount, CheckingBankAccount, SavingsBankAccount
+from accounts.summary import get_summary
+from . import posting
+from .constants import DEPOSIT, MONTH_END_JOB, RUN_DONE, TRANSFER, WITHDRAWAL
+from .models import DailyBalanceSnapshot, JournalEntry, JournalLeg, PostingCheckpoint, Transaction
+from .pagination import paginate_keyset
+from .reconciliation import reconcile
+from .snapshots import backfill_snapshots, balance_at, statement_summary
+from .tasks import finish_posting_run, post_month_end_shard, start_posting_run
+from .transfers import MAX_AMOUNT, iter_transfer_file, post_transfers
+from .views import TransactionExportView
+
+
+class PostingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='customer@mail.com', password='secret')
+        self.checking = CheckingBankAccount.objects.create(user=self.user, account_type='CHECKING')
+        self.savings = SavingsBankAccount.objects.create(user=self.user, account_type='SAVINGS')
+
+    def balance(self, account):
+        account.refresh_from_db(fields=['balance'])
+        return account.balance
+
+    def assertBalanced(self):
+        report = reconcile()
+        self.assertEqual(report['accounts_mismatched'], 0, report['mismatches'])
+        self.assertEqual(report['entries_unbalanced'], 0, report['unbalanced_entries'])
+
+
+class SinglePostingTests(PostingTestCase):
+    def test_deposit_and_withdrawal_move_the_balance(self):
+        posting.deposit(self.checking, Decimal('100.00'))
+        posted = posting.withdraw(self.checking, Decimal('30.00'))
+
+        self.assertEqual(posted.balance_after_transaction, Decimal('70.00'))
+        self.assertEqual(self.balance(self.checking), Decimal('70.00'))
+        self.assertEqual(
+            list(Transaction.objects.filter(account=self.checking).order_by('id')
+                 .values_list('transaction_type', 'amount', 'balance_after_transaction')),
+            [(DEPOSIT, Decimal('100.00'), Decimal('100.00')), (WITHDRAWAL, Decimal('30.00'), Decimal('70.00'))],
+        )
+        snapshot = DailyBalanceSnapshot.objects.get(account=self.checking)
+        self.assertEqual(
+            (snapshot.total_credits, snapshot.total_debits, snapshot.closing_balance, snapshot.transaction_count),
+            (Decimal('100.00'), Decimal('30.00'), Decimal('70.00'), 2),
+        )
+
+    def test_overdraft_is_rejected_and_posts_nothing(self):
+        posting.deposit(self.checking, Decimal('10.00'))
+
+        with self.assertRaises(posting.InsufficientFunds):
+            posting.withdraw(self.checking, Decimal('10.01'))
+
+        self.assertEqual(self.balance(self.checking), Decimal('10.00'))
+        self.assertEqual(Transaction.objects.filter(account=self.checking).count(), 1)
+        self.assertEqual(JournalEntry.objects.count(), 1)
+
+    def test_every_posting_writes_a_balanced_journal_entry(self):
+        posting.deposit(self.checking, Decimal('50.00'))
+        posting.withdraw(self.checking, Decimal('20.00'))
+        posting.deposit(self.savings, Decimal('5.00'))
+
+        self.assertEqual(JournalEntry.objects.count(), 3)
+        self.assertEqual(JournalLeg.objects.count(), 6)
+        self.assertBalanced()
+
+
+class TransferTests(PostingTestCase):
+    def setUp(self):
+        super().setUp()
+        posting.deposit(self.checking, Decimal('100.00'))
+
+    def transfer(self, *lines, **kwargs):
+        rows = ['debit_account,credit_account,amount'] + [','.join(map(str, line)) for line in lines]
+        return post_transfers(iter_transfer_file(rows), **kwargs)
+
+    def test_lines_are_checked_in_order_against_the_locked_balances(self):
+        report = self.transfer(
+            (self.checking.pk, self.savings.pk, '60.00'),
+            (self.checking.pk, self.savings.pk, '60.00'),
+            (self.savings.pk, self.checking.pk, '10.00'),
+        )
+
+        self.assertEqual([result['status'] for result in report.results], ['posted', 'rejected', 'posted'])
+        self.assertEqual(report.results[1]['error'], f"Insufficient funds in account {self.checking.pk}")
+        self.assertEqual(self.balance(self.checking), Decimal('50.00'))
+        self.assertEqual(self.balance(self.savings), Decimal('50.00'))
+        self.assertEqual(Transaction.objects.filter(transaction_type=TRANSFER).count(), 4)
+        self.assertBalanced()
+
+    def test_unknown_and_unowned_accounts_are_rejected(self):
+        other = User.objects.create_user(email='other@mail.com', password='secret')
+        others = CheckingBankAccount.objects.create(user=other, account_type='CHECKING')
+
+        report = self.transfer(
+            (self.checking.pk, 999999999, '1.00'),
+            (others.pk, self.checking.pk, '1.00'),
+            owner=self.user,
+        )
+
+        self.assertEqual(
+            [result['error'] for result in report.results],
+            ["Account 999999999 not found", f"Account {others.pk} not found"],
+        )
+        self.assertEqual(self.balance(self.checking), Decimal('100.00'))
+
+    def test_credit_past_the_maximum_balance_is_rejected(self):
+        BankAccount.objects.filter(pk=self.savings.pk).update(balance=MAX_AMOUNT)
+
+        report = self.transfer((self.checking.pk, self.savings.pk, '0.01'))
+
+        self.assertEqual(report.rejected, 1)
+        self.assertEqual(report.results[0]['error'], f"Account {self.savings.pk} would exceed the maximum balance")
+        self.assertEqual(self.balance(self.checking), Decimal('100.00'))
+
+    def test_transfers_write_through_the_cached_summary(self):
+        get_summary(self.user.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.transfer((self.checking.pk, self.savings.pk, '25.00'))
+
+        with self.assertNumQueries(0):
+            accounts = {account['account_no']: account for account in get_summary(self.user.pk)}
+        self.assertEqual(accounts[self.checking.pk]['balance'], Decimal('75.00'))
+        self.assertEqual(accounts[self.savings.pk]['balance'], Decimal('25.00'))
+        self.assertEqual(accounts[self.savings.pk]['recent_transactions'][0]['transaction_type'], TRANSFER)
+
+
+class ReconciliationTests(PostingTestCase):
+    def test_reports_a_balance_that_does_not_match_the_journal(self):
+        posting.deposit(self.checking, Decimal('40.00'))
+        self.assertBalanced()
+
+        BankAccount.objects.filter(pk=self.checking.pk).update(balance=Decimal('45.00'))
+
+        report = reconcile()
+        self.assertEqual(report['accounts_mismatched'], 1)
+        self.assertEqual(report['mismatches'][0]['account_no'], self.checking.pk)
+        self.assertEqual(report['mismatches'][0]['difference'], Decimal('5.00'))
+
+
+class MonthEndTests(PostingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.period = posting.current_period()
+
+    def postings(self, transaction_type):
+        return Transaction.objects.filter(transaction_type=transaction_type, period=self.period)
+
+    def test_charges_are_debited_and_interest_credited(self):
+        posting.deposit(self.checking, Decimal('100.00'))
+        posting.deposit(self.savings, Decimal('300.00'))
+
+        posting.run_month_end(period=self.period)
+
+        charge = self.postings('CHARGES').get()
+        self.assertEqual((charge.account_id, charge.amount), (self.checking.pk, Decimal('-10.00')))
+        self.assertEqual(self.balance(self.checking), Decimal('90.00'))
+        self.assertEqual(self.postings('INTEREST').get().amount, Decimal('2.00'))
+        self.assertEqual(self.balance(self.savings), Decimal('302.00'))
+        self.assertEqual(DailyBalanceSnapshot.objects.get(account=self.checking).total_debits, Decimal('10.00'))
+        self.assertBalanced()
+
+    def test_interest_is_rounded_half_up_like_add_interest(self):
+        # 100.50 at 1% a month is exactly 1.005
+        SavingsBankAccount.objects.filter(pk=self.savings.pk).update(interest_rate=12)
+        posting.deposit(self.savings, Decimal('100.50'))
+        posting.run_month_end(period=self.period)
+
+        other = SavingsBankAccount.objects.create(user=self.user, account_type='SAVINGS', interest_rate=Decimal('12'))
+        posting.deposit(other, Decimal('100.50'))
+
+        self.assertEqual(self.postings('INTEREST').get().amount, Decimal('1.01'))
+        self.assertEqual(other.add_interest(), Decimal('1.01'))
+
+    def test_a_period_is_posted_once(self):
+        posting.deposit(self.checking, Decimal('100.00'))
+        posting.deposit(self.savings, Decimal('300.00'))
+
+        posting.run_month_end(period=self.period)
+        report = posting.run_month_end(period=self.period)
+
+        self.assertEqual(report['total']['transactions_posted'], 0)
+        self.assertEqual(self.postings('CHARGES').count(), 1)
+        self.assertEqual(self.postings('INTEREST').count(), 1)
+        self.assertEqual(self.balance(self.checking), Decimal('90.00'))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Transaction.objects.create(
+                account=self.checking, amount=Decimal('-10.00'), balance_after_transaction=Decimal('80.00'),
+                transaction_type='CHARGES', period=self.period,
+            )
+
+    def test_a_rerun_after_an_interrupted_batch_posts_every_account_once(self):
+        accounts = [self.savings] + [
+            SavingsBankAccount.objects.create(user=self.user, account_type='SAVINGS') for _ in range(2)
+        ]
+        for account in accounts:
+            posting.deposit(account, Decimal('300.00'))
+
+        with mock.patch.object(posting, 'period_start', side_effect=interrupted(posting.period_start, calls=1)):
+            with self.assertRaises(OperationalError):
+                posting.run_month_end(batch_size=1, period=self.period)
+        self.assertEqual(self.postings('INTEREST').count(), 1)
+
+        posting.run_month_end(batch_size=1, period=self.period)
+
+        self.assertEqual(
+            sorted(self.postings('INTEREST').values_list('account_id', flat=True)),
+            [account.pk for account in accounts],
+        )
+        self.assertBalanced()
+
+
+def interrupted(func, calls):
+    ''' Wraps `func` to raise OperationalError, as a lost connection would, after `calls` calls. '''
+    remaining = [calls]
+
+    def wrapper(*args, **kwargs):
+        if not remaining[0]:
+            raise OperationalError("connection lost")
+        remaining[0] -= 1
+        return func(*args, **kwargs)
+    return wrapper
+
+
+class MonthEndRunTests(PostingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.accounts = [self.checking, self.savings] + [
+            SavingsBankAccount.objects.create(user=self.user, account_type='SAVINGS') for _ in range(3)
+        ]
+        for account in self.accounts:
+            posting.deposit(account, Decimal('300.00'))
+        self.period = posting.current_period().isoformat()
+
+    def start_run(self):
+        return start_posting_run(MONTH_END_JOB, self.period, lambda: posting.plan_shards(2))
+
+    def test_an_interrupted_shard_resumes_from_its_checkpoint(self):
+        run, pending = self.start_run()
+        self.assertEqual(len(pending), 3)
+        first = run.shards.order_by('first_account_no').first().pk
+
+        # The shard fails after its first batch of interest has committed
+        with mock.patch.object(posting, 'period_start', side_effect=interrupted(posting.period_start, calls=1)):
+            with self.assertRaises(OperationalError):
+                post_month_end_shard(first, batch_size=1)
+        checkpoint = PostingCheckpoint.objects.get(shard_id=first, stage='interest')
+        self.assertEqual((checkpoint.last_account_no, checkpoint.transactions_posted), (self.savings.pk, 1))
+        self.assertEqual(finish_posting_run(run.pk)['pending_shards'], 3)
+
+        # Dispatching the run again hands out the same shards, which resume where they stopped
+        run, pending_again = self.start_run()
+        self.assertEqual(sorted(pending_again), sorted(pending))
+        for shard_id in pending_again:
+            post_month_end_shard(shard_id, batch_size=1)
+
+        totals = finish_posting_run(run.pk)
+        run.refresh_from_db()
+        self.assertEqual((run.status, totals['pending_shards'], totals['transactions_posted']), (RUN_DONE, 0, 5))
+        self.assertEqual(
+            sorted(Transaction.objects.filter(period=self.period).values_list('account_id', 'transaction_type')),
+            [(self.checking.pk, 'CHARGES')] + [(account.pk, 'INTEREST') for account in self.accounts[1:]],
+        )
+        self.assertBalanced()
+
+        # A finished run and its shards are not posted again
+        self.assertEqual(self.start_run(), (run, []))
+        self.assertEqual(post_month_end_shard(first), 2)
+        self.assertEqual(Transaction.objects.filter(period=self.period).count(), 5)
+
+    def test_accounts_opened_during_the_run_are_posted_by_its_last_shard(self):
+        run, pending = self.start_run()
+        opened = SavingsBankAccount.objects.create(user=self.user, account_type='SAVINGS')
+        posting.deposit(opened, Decimal('300.00'))
+
+        for shard_id in pending:
+            post_month_end_shard(shard_id)
+        finish_posting_run(run.pk)
+
+        interest = Transaction.objects.filter(account=opened, transaction_type='INTEREST', period=self.period)
+        self.assertTrue(interest.exists())
+
+
+class TransactionHistoryTests(PostingTestCase):
+    def setUp(self):
+        super().setUp()
+        for _ in range(7):
+            posting.deposit(self.checking, Decimal('10.00'))
+        # Postings of the same instant are ordered by id
+        Transaction.objects.filter(account=self.checking).update(timestamp=timezone.now())
+        self.history = Transaction.objects.filter(account=self.checking)
+        self.newest_first = list(self.history.order_by('-id').values_list('id', flat=True))
+        self.url = reverse('transactions:transaction_list', args=[self.checking.pk])
+
+    def ids(self, page):
+        return [posted.id for posted in page]
+
+    def test_pages_of_equal_timestamps_are_split_by_id(self):
+        first = paginate_keyset(self.history, 5)
+        second = paginate_keyset(self.history, 5, after=first.next_cursor)
+        back = paginate_keyset(self.history, 5, before=second.previous_cursor)
+
+        self.assertEqual(self.ids(first) + self.ids(second), self.newest_first)
+        self.assertEqual((second.has_next, second.has_previous), (False, True))
+        self.assertEqual(self.ids(back), self.ids(first))
+        self.assertFalse(back.has_previous)
+
+    def test_invalid_cursors_are_rejected(self):
+        cursors = [
+            'not base64!',
+            base64.urlsafe_b64encode(b'garbage').decode(),
+            base64.urlsafe_b64encode(b'\xff\xfe|1').decode(),
+            base64.urlsafe_b64encode(b'2026-01-01T00:00:00+00:00|abc').decode(),
+            # Naive timestamp, and ids out of the bigint range
+            base64.urlsafe_b64encode(b'2026-01-01T00:00:00|1').decode(),
+            base64.urlsafe_b64encode(f'2026-01-01T00:00:00+00:00|{2 ** 63}'.encode()).decode(),
+            base64.urlsafe_b64encode(b'2026-01-01T00:00:00+00:00|-1').decode(),
+        ]
+        for cursor in cursors:
+            for direction in ('after', 'before'):
+                with self.subTest(cursor=cursor, direction=direction):
+                    self.assertEqual(self.client.get(self.url, {direction: cursor}).status_code, 400)
+
+    def test_total_is_counted_on_request_and_keeps_the_page(self):
+        response = self.client.get(self.url)
+        self.assertNotIn('total_count', response.context)
+
+        cursor = response.context['page_obj'].next_cursor
+        response = self.client.get(self.url, {'after': cursor, 'count': '1'})
+
+        self.assertEqual(response.context['total_count'], 7)
+        self.assertEqual(self.ids(response.context['transactions']), self.newest_first[5:])
+
+
+class BalanceSnapshotTests(PostingTestCase):
+    SNAPSHOT_FIELDS = ('date', 'opening_balance', 'closing_balance', 'total_debits', 'total_credits',
+                       'transaction_count')
+
+    def snapshots(self):
+        snapshots = DailyBalanceSnapshot.objects.filter(account=self.checking).order_by('date')
+        return list(snapshots.values_list(*self.SNAPSHOT_FIELDS))
+
+    def move_to(self, posted, day):
+        Transaction.objects.filter(pk=posted.pk).update(
+            timestamp=timezone.make_aware(datetime.combine(day, time(12))),
+        )
+
+    def test_backfill_rebuilds_the_snapshots_written_by_the_postings(self):
+        posting.deposit(self.checking, Decimal('100.00'))
+        posting.withdraw(self.checking, Decimal('30.00'))
+        posting.deposit(self.checking, Decimal('5.00'))
+        posted = self.snapshots()
+
+        DailyBalanceSnapshot.objects.all().delete()
+        backfill_snapshots(0, posting.MAX_ACCOUNT_NO)
+
+        self.assertEqual(self.snapshots(), posted)
+        self.assertEqual(posted[0][1:], (Decimal('0.00'), Decimal('75.00'), Decimal('30.00'), Decimal('105.00'), 3))
+
+    def test_balance_at_carries_the_last_closing_balance_forward(self):
+        today = timezone.localdate()
+        first, third = today - timedelta(days=3), today - timedelta(days=1)
+        self.move_to(posting.deposit(self.checking, Decimal('100.00')), first)
+        self.move_to(posting.withdraw(self.checking, Decimal('40.00')), third)
+        DailyBalanceSnapshot.objects.all().delete()
+        backfill_snapshots(0, posting.MAX_ACCOUNT_NO)
+
+        self.assertEqual(
+            [balance_at(self.checking.pk, first + timedelta(days=offset)) for offset in range(-1, 4)],
+            [Decimal('0.00'), Decimal('100.00'), Decimal('100.00'), Decimal('60.00'), Decimal('60.00')],
+        )
+        self.assertEqual(statement_summary(self.checking.pk, first + timedelta(days=1), third), {
+            'opening_balance': Decimal('100.00'),
+            'closing_balance': Decimal('60.00'),
+            'total_credits': Decimal('0.00'),
+            'total_debits': Decimal('40.00'),
+            'transaction_count': 1,
+        })
+
+
+class TransactionExportTests(PostingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.deposited = posting.deposit(self.checking, Decimal('100.00'))
+        self.withdrawn = posting.withdraw(self.checking, Decimal('30.00'))
+        self.url = reverse('transactions:transaction_export', args=[self.checking.pk])
+
+    def export(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response['Content-Type'], b''.join(response.streaming_content).decode()
+
+    def test_owner_exports_the_history_as_csv_and_ndjson(self):
+        self.client.force_login(self.user)
+
+        content_type, content = self.export()
+        self.assertEqual(content_type, 'text/csv')
+        rows = list(csv.reader(content.splitlines()))
+        self.assertEqual(rows[0], list(TransactionExportView.fields))
+        self.assertEqual([(int(row[0]), row[2], Decimal(row[4])) for row in rows[1:]], [
+            (self.deposited.pk, DEPOSIT, Decimal('100.00')),
+            (self.withdrawn.pk, WITHDRAWAL, Decimal('70.00')),
+        ])
+
+        content_type, content = self.export(format='ndjson')
+        self.assertEqual(content_type, 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([(row['id'], row['amount']) for row in rows], [
+            (self.deposited.pk, '100.00'), (self.withdrawn.pk, '30.00'),
+        ])
+
+    def test_accounts_of_other_users_are_not_found(self):
+        other = User.objects.create_user(email='other@mail.com', password='secret')
+        self.client.force_login(other)
+
+        for export_format in ('csv', 'ndjson'):
+            with self.subTest(format=export_format):
+                self.assertEqual(self.client.get(self.url, {'format': export_format}).status_code, 404)
+
+    def test_anonymous_users_are_sent_to_login(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_unsupported_formats_are_rejected(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(self.url, {'format': 'xml'}).status_code, 400)
@@ -0,0 +1,277 @@
+import csv
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from accounts.summary import invalidate_all_summaries, record_posting
+from .constants import TRANSFER
+from .journal import journal_sql
+from .models import Transaction, TransferBatch
+from .snapshots import snapshot_upsert_sql
+
+# Batch transfers between accounts, e.g. a payroll file of thousands of credits from one
+# employer account. A batch is applied in a single transaction:
+#
+# - every account it touches is locked up front by one SELECT ... FOR UPDATE in account_no
+#   order, so batches (and single postings, which lock one row) sharing accounts queue up
+#   instead of deadlocking;
+# - the lines are checked in file order against the locked balances, so a line may spend
+#   money credited by an earlier one, and a line that would overdraw its debit account is
+#   rejected on its own;
+# - the accepted lines are written by one statement: a set-based UPDATE of the balances,
+#   a bulk INSERT of both legs of every transfer, one journal entry per transfer and the
+#   daily snapshot upsert.
+#
+# The debit leg of a transfer is stored with a negative amount, like CHARGES.
+
+TRANSFER_SNAPSHOT_SQL = snapshot_upsert_sql(
+    "SELECT account_no, credits, debits, balance, postings FROM moved"
+)
+
+TRANSFER_JOURNAL_SQL = journal_sql(
+    "SELECT debit_account AS account_no, -amount AS delta, %(transaction_type)s::text AS entry_type, "
+    "credit_account AS contra_account, NULL::text AS contra_ledger "
+    "FROM unnest(%(line_debits)s::bigint[], %(line_credits)s::bigint[], %(line_amounts)s::numeric[]) "
+    "AS line(debit_account, credit_account, amount)"
+)
+
+APPLY_TRANSFERS_SQL = f"""
+    WITH moved AS (
+        UPDATE accounts_bankaccount a
+        SET balance = v.balance
+        FROM unnest(%(account_nos)s::bigint[], %(balances)s::numeric[], %(credits)s::numeric[],
+                    %(debits)s::numeric[], %(postings)s::integer[])
+             AS v(account_no, balance, credits, debits, postings)
+        WHERE a.account_no = v.account_no
+        RETURNING a.account_no, v.credits, v.debits, a.balance, v.postings
+    ),
+    inserted AS (
+        INSERT INTO transactions_transaction
+            (account_id, amount, balance_after_transaction, transaction_type, timestamp)
+        SELECT account_no, amount, balance, %(transaction_type)s, %(now)s
+        FROM unnest(%(leg_accounts)s::bigint[], %(leg_amounts)s::numeric[], %(leg_balances)s::numeric[])
+             WITH ORDINALITY AS leg(account_no, amount, balance, position)
+        ORDER BY position
+        RETURNING id, account_id, amount, balance_after_transaction, timestamp
+    ),
+    {TRANSFER_JOURNAL_SQL},
+    snapshot AS ({TRANSFER_SNAPSHOT_SQL})
+    SELECT id, account_id, amount, balance_after_transaction, timestamp FROM inserted
+"""
+
+POSTED = 'posted'
+REJECTED = 'rejected'
+
+
+class DuplicateTransferBatch(Exception):
+    pass
+
+
+class TransferError(ValueError):
+    pass
+
+
+# Largest amount a numeric(12, 2) balance or transaction amount can hold
+MAX_AMOUNT = Decimal('9999999999.99')
+
+
+# ================================ Parsing ====================================================
+def parse_amount(value, minimum=Decimal('0.01')):
+    ''' Returns `value` as a Decimal amount of at least `minimum` (> 0) or raises TransferError. '''
+    try:
+        amount = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        raise TransferError("'amount' must be a decimal amount")
+    if not amount.is_finite():
+        raise TransferError("'amount' must be a decimal amount")
+    # The range is checked first: quantize raises InvalidOperation on huge exponents
+    if amount < minimum or amount > MAX_AMOUNT:
+        raise TransferError(f"'amount' must be between {minimum} and {MAX_AMOUNT}")
+    if amount != amount.quantize(Decimal('0.01')):
+        raise TransferError("'amount' must have at most two decimal places")
+    return amount
+
+
+def parse_line(debit_account, credit_account, amount):
+    ''' Returns a `(debit_account, credit_account, amount)` line or raises TransferError. '''
+    try:
+        debit_account, credit_account = int(debit_account), int(credit_account)
+    except (TypeError, ValueError):
+        raise TransferError("Account numbers must be integers")
+    if debit_account == credit_account:
+        raise TransferError("Debit and credit accounts are the same")
+    return debit_account, credit_account, parse_amount(amount)
+
+
+def iter_transfer_file(stream):
+    '''
+    Yields `(line_number, line_or_error)` for a CSV file of `debit_account,credit_account,
+    amount` lines. A header line and blank lines are skipped.
+    '''
+    for line_number, row in enumerate(csv.reader(stream), 1):
+        if not row or not ''.join(row).strip():
+            continue
+        if line_number == 1 and not row[0].strip().isdigit():
+            continue
+        if len(row) != 3:
+            yield line_number, TransferError("Expected debit_account,credit_account,amount")
+            continue
+        try:
+            yield line_number, parse_line(*row)
+        except TransferError as e:
+            yield line_number, e
+
+
+# ================================ Posting ====================================================
+class TransferReport:
+    def __init__(self):
+        self.results = []
+        self.posted = 0
+        self.rejected = 0
+        self.total_amount = Decimal('0.00')
+        self.elapsed = 0.0
+
+    def add(self, line_number, line, error=None):
+        self.results.append({
+            'line': line_number,
+            'debit_account': line[0] if line else None,
+            'credit_account': line[1] if line else None,
+            'amount': line[2] if line else None,
+            'status': REJECTED if error else POSTED,
+            'error': error,
+        })
+        if error:
+            self.rejected += 1
+        else:
+            self.posted += 1
+            self.total_amount += line[2]
+
+    def as_dict(self):
+        return {
+            'lines': len(self.results),
+            'posted': self.posted,
+            'rejected': self.rejected,
+            'total_amount': self.total_amount,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'lines_per_second': round(len(self.results) / self.elapsed, 1) if self.elapsed > 0 else 0.0,
+        }
+
+
+def _lock_accounts(cursor, account_nos, owner_id):
+    cursor.execute(
+        "SELECT account_no, balance, user_id FROM accounts_bankaccount "
+        "WHERE account_no = ANY(%s) ORDER BY account_no FOR UPDATE",
+        [sorted(account_nos)],
+    )
+    balances, owned = {}, set()
+    for account_no, balance, user_id in cursor.fetchall():
+        balances[account_no] = balance
+        if owner_id is None or user_id == owner_id:
+            owned.add(account_no)
+    return balances, owned
+
+
+def post_transfers(lines, reference=None, owner=None):
+    '''
+    Applies a batch of transfers and returns a TransferReport with the result of every
+    line. `lines` holds `(line_number, line_or_error)` pairs as yielded by
+    `iter_transfer_file`, errors being reported as rejected lines. When `owner` is given,
+    only lines debiting one of their accounts are posted. A batch with the `reference` of
+    an earlier batch raises DuplicateTransferBatch and posts nothing.
+    '''
+    started = time.monotonic()
+    lines = list(lines)
+    report = TransferReport()
+    account_nos = set()
+    for _, line in lines:
+        if not isinstance(line, Exception):
+            account_nos.update(line[:2])
+
+    now = timezone.now()
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            batch = TransferBatch.objects.create(reference=reference, created_by=owner, line_count=len(lines))
+            balances, owned = _lock_accounts(cursor, account_nos, owner.pk if owner else None)
+
+            movements = {}
+            legs = []
+            transfers = []
+            for line_number, line in lines:
+                if isinstance(line, Exception):
+                    report.add(line_number, None, str(line))
+                    continue
+                debit_account, credit_account, amount = line
+                if debit_account not in owned:
+                    report.add(line_number, line, f"Account {debit_account} not found")
+                elif credit_account not in balances:
+                    report.add(line_number, line, f"Account {credit_account} not found")
+                elif balances[debit_account] < amount:
+                    report.add(line_number, line, f"Insufficient funds in account {debit_account}")
+                elif balances[credit_account] + amount > MAX_AMOUNT:
+                    report.add(line_number, line, f"Account {credit_account} would exceed the maximum balance")
+                else:
+                    balances[debit_account] -= amount
+                    balances[credit_account] += amount
+                    legs.append((debit_account, -amount, balances[debit_account]))
+                    legs.append((credit_account, amount, balances[credit_account]))
+                    transfers.append(line)
+                    for account_no, credit, debit in ((debit_account, 0, amount), (credit_account, amount, 0)):
+                        credits, debits, postings = movements.get(account_no, (0, 0, 0))
+                        movements[account_no] = (credits + credit, debits + debit, postings + 1)
+                    report.add(line_number, line)
+
+            if legs:
+                cursor.execute(APPLY_TRANSFERS_SQL, {
+                    'account_nos': list(movements),
+                    'balances': [balances[account_no] for account_no in movements],
+                    'credits': [movement[0] for movement in movements.values()],
+                    'debits': [movement[1] for movement in movements.values()],
+                    'postings': [movement[2] for movement in movements.values()],
+                    'leg_accounts': [leg[0] for leg in legs],
+                    'leg_amounts': [leg[1] for leg in legs],
+                    'leg_balances': [leg[2] for leg in legs],
+                    'line_debits': [transfer[0] for transfer in transfers],
+                    'line_credits': [transfer[1] for transfer in transfers],
+                    'line_amounts': [transfer[2] for transfer in transfers],
+                    'transaction_type': TRANSFER,
+                    'now': now,
+                    'day': timezone.localdate(now),
+                })
+                _update_summaries(cursor.fetchall(), len(movements))
+
+            report.elapsed = time.monotonic() - started
+            batch.posted_count = report.posted
+            batch.rejected_count = report.rejected
+            batch.total_amount = report.total_amount
+            batch.elapsed_seconds = report.elapsed
+            batch.save(update_fields=['posted_count', 'rejected_count', 'total_amount', 'elapsed_seconds'])
+    except IntegrityError:
+        if reference is not None and TransferBatch.objects.filter(reference=reference).exists():
+            raise DuplicateTransferBatch(f"Transfer batch '{reference}' was already posted")
+        raise
+    return report
+
+
+def _update_summaries(rows, account_count):
+    if account_count > settings.TRANSFER_WRITE_THROUGH_MAX_ACCOUNTS:
+        # Too many accounts to write through one by one
+        invalidate_all_summaries()
+        return
+    postings = {}
+    for transaction_id, account_no, amount, balance, timestamp in rows:
+        posted = Transaction(
+            id=transaction_id,
+            account_id=account_no,
+            amount=amount,
+            balance_after_transaction=balance,
+            transaction_type=TRANSFER,
+            timestamp=timestamp,
+        )
+        posted._state.adding = False
+        posted._state.db = connection.alias
+        postings.setdefault(account_no, []).append(posted)
+    for account_no, account_postings in postings.items():
+        record_posting(account_no, account_postings)
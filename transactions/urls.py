@@ -1,11 +1,20 @@
 from django.urls import path
 
-from .views import DepositView, WithdrawView, TransactionListView
+from . import api
+from .views import DepositView, WithdrawView, TransactionListView, TransactionExportView
 
 app_name = 'transactions'
 
 urlpatterns = [
     path("deposit/<int:account_no>/", DepositView.as_view(), name="deposit_money"),
     path("withdraw/<int:account_no>/", WithdrawView.as_view(), name="withdraw_money"),
-    path("list/<int:account_no>/", TransactionListView.as_view(), name="transaction_list")
+    path("list/<int:account_no>/", TransactionListView.as_view(), name="transaction_list"),
+    path("export/<int:account_no>/", TransactionExportView.as_view(), name="transaction_export"),
+
+    # Async JSON API (served by the ASGI application)
+    path("api/accounts/<int:account_no>/balance/", api.account_balance, name="api_balance"),
+    path("api/accounts/<int:account_no>/deposit/", api.deposit, name="api_deposit"),
+    path("api/accounts/<int:account_no>/withdraw/", api.withdraw, name="api_withdraw"),
+    path("api/accounts/<int:account_no>/transactions/", api.transaction_history, name="api_transactions"),
+    path("api/transfers/", api.transfers, name="api_transfers"),
 ]
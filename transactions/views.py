@@ -1,11 +1,26 @@
+import csv
+import itertools
+import json
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.generic import ListView
 
 from accounts.models import BankAccount
+from banking_system.routers import read_alias, use_replica
+from transactions import posting
 from transactions.forms import DepositForm, WithdrawForm, DateRangeForm
+from transactions.pagination import InvalidCursor, paginate_keyset
+from transactions.snapshots import statement_summary
+from transactions.posting import InsufficientFunds
 from .models import Transaction
 
 
@@ -22,17 +37,7 @@ class DepositView(LoginRequiredMixin, View):
         account = get_object_or_404(BankAccount, pk=account_no)
         form = self.form_class(request.POST, account=account)
         if form.is_valid():
-            deposit_amount = form.cleaned_data['amount']
-            new_balance = account.balance + deposit_amount
-            transaction = Transaction(
-                account=account,
-                amount=deposit_amount,
-                balance_after_transaction=new_balance,
-                transaction_type="DEPOSIT"
-            )
-            transaction.save()
-            account.balance = new_balance
-            account.save()
+            posting.deposit(account, form.cleaned_data['amount'])
             return redirect(reverse('accounts:accounts_home'))
         else:
             print("Form errors:", form.errors)  # Debug to see what errors are occurring
@@ -52,28 +57,26 @@ class WithdrawView(LoginRequiredMixin, View):
         account = get_object_or_404(BankAccount, pk=account_no)
         form = self.form_class(request.POST, account=account)
         if form.is_valid():
-            withdraw_amount = form.cleaned_data['amount']
-            new_balance = account.balance - withdraw_amount
-            transaction = Transaction(
-                account=account,
-                amount=withdraw_amount,
-                balance_after_transaction=new_balance,
-                transaction_type="WITHDRAW"
-            )
-            transaction.save()
-            account.balance = new_balance
-            account.save()
-            return redirect(reverse('accounts:accounts_home'))
+            try:
+                posting.withdraw(account, form.cleaned_data['amount'])
+            except InsufficientFunds:
+                # The balance changed between validating the form and posting
+                account.refresh_from_db(fields=['balance'])
+                form.add_error('amount', f'You have {account.balance} $ in your account. '
+                                         'You can not withdraw more than your account balance')
+            else:
+                return redirect(reverse('accounts:accounts_home'))
         else:
             print("Form errors:", form.errors)  # Debug to see what errors are occurring
         return render(request, self.template_name, {'form': form, 'account': account})
 
 
+@method_decorator(use_replica, name='dispatch')
 class TransactionListView(ListView):
     model = Transaction
     template_name = 'transactions/transaction_list.html'
     context_object_name = 'transactions'
-    paginate_by = 5  # Adjust the number as needed
+    page_size = 5  # Adjust the number as needed
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -89,11 +92,110 @@ class TransactionListView(ListView):
             start_date = form.cleaned_data.get('start_date')
             end_date = form.cleaned_data.get('end_date')
             if start_date and end_date:
-                queryset = queryset.filter(timestamp__date__range=(start_date, end_date))
+                # Compare the raw column against day boundaries so the index on timestamp is usable
+                queryset = queryset.filter(
+                    timestamp__gte=start_of_day(start_date),
+                    timestamp__lt=start_of_day(end_date + timedelta(days=1)),
+                )
         return queryset
 
+    def get(self, request, *args, **kwargs):
+        try:
+            return super().get(request, *args, **kwargs)
+        except InvalidCursor:
+            return HttpResponseBadRequest("Invalid page cursor.")
+
     def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
+        page = paginate_keyset(
+            self.object_list,
+            self.page_size,
+            after=self.request.GET.get('after'),
+            before=self.request.GET.get('before'),
+        )
+        context = super().get_context_data(object_list=page.object_list, **kwargs)
+        context['page_obj'] = page
         context['date_form'] = DateRangeForm(self.request.GET or None)
         context['account_no'] = self.kwargs.get('account_no', None)
+        context['filter_query'] = self.request.GET.copy()
+        for key in ('after', 'before'):
+            context['filter_query'].pop(key, None)
+        # Showing the total stays on the current page
+        context['count_query'] = self.request.GET.copy()
+        context['count_query']['count'] = '1'
+        # Counting a long history is a full index scan, so it is only done on request
+        if settings.TRANSACTION_LIST_EXACT_COUNT or self.request.GET.get('count') == '1':
+            context['total_count'] = self.object_list.count()
+
+        # Range totals come from the daily snapshots rather than from the transactions
+        date_form = context['date_form']
+        if context['account_no'] and date_form.is_valid() and date_form.cleaned_data.get('start_date'):
+            context['summary'] = statement_summary(
+                context['account_no'],
+                date_form.cleaned_data['start_date'],
+                date_form.cleaned_data['end_date'],
+            )
         return context
+
+
+class Echo:
+    """An object that implements just the write method of the file-like interface."""
+
+    def write(self, value):
+        return value
+
+
+@method_decorator(use_replica, name='dispatch')
+class TransactionExportView(LoginRequiredMixin, View):
+    '''
+    Streams the transactions of one of the user's accounts as CSV or NDJSON. Rows are read
+    through a server-side cursor in chunks and written out as they arrive, so memory use
+    stays flat and the first bytes go out before the whole history has been read.
+    '''
+    chunk_size = 2000
+    fields = ('id', 'timestamp', 'transaction_type', 'amount', 'balance_after_transaction')
+    formats = {
+        'csv': 'text/csv',
+        'ndjson': 'application/x-ndjson',
+    }
+
+    def get(self, request, account_no):
+        account = get_object_or_404(BankAccount, pk=account_no, user=request.user)
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in self.formats:
+            return HttpResponseBadRequest(f"Unsupported format '{export_format}'.")
+
+        # The rows are read while the response streams, after the view has returned, so the
+        # database is picked now
+        queryset = Transaction.objects.using(read_alias()).filter(account=account).order_by('timestamp', 'id')
+        form = DateRangeForm(request.GET or None)
+        if form.is_valid():
+            start_date = form.cleaned_data.get('start_date')
+            end_date = form.cleaned_data.get('end_date')
+            if start_date and end_date:
+                queryset = queryset.filter(
+                    timestamp__gte=start_of_day(start_date),
+                    timestamp__lt=start_of_day(end_date + timedelta(days=1)),
+                )
+        rows = queryset.values_list(*self.fields).iterator(chunk_size=self.chunk_size)
+
+        if export_format == 'csv':
+            writer = csv.writer(Echo())
+            content = itertools.chain(
+                [writer.writerow(self.fields)],
+                (writer.writerow(row) for row in rows),
+            )
+        else:
+            content = (
+                json.dumps(dict(zip(self.fields, row)), cls=DjangoJSONEncoder) + '\n'
+                for row in rows
+            )
+
+        response = StreamingHttpResponse(content, content_type=self.formats[export_format])
+        response['Content-Disposition'] = (
+            f'attachment; filename="transactions-{account.account_no}.{export_format}"'
+        )
+        return response
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))